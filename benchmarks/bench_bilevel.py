@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк формата отрендеренных страниц: JPEG, однобитный CCITT G4 и выбор по страницам
+
+Для каждого входного файла сравниваются время конвертации, размер
+результата и время повторного рендеринга результата (как при печати)
+для output_format="jpeg", "bilevel" с разными способами бинаризации и
+"auto" (для него выводится и число страниц по кодекам).
+Входы: примеры и синтетические текстовые документы - векторный и
+отсканированный (страницы-изображения на желтоватой бумаге).
+
+Запуск:
+    python benchmarks/bench_bilevel.py [--pages 20] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from src.converter import PDFToBWConverter
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+VARIANTS = [
+    ("jpeg", "otsu"),
+    ("bilevel", "otsu"),
+    ("bilevel", "adaptive"),
+    ("bilevel", "dither"),
+    ("auto", "otsu"),
+]
+
+
+def make_text_document(path, pages):
+    """Создает текстовый документ с цветными заголовками"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.insert_text((60, 72), f"Глава {page_num + 1}", fontname="helv", fontsize=20, color=(0.7, 0, 0))
+        body = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40
+        page.insert_textbox(fitz.Rect(50, 110, 545, 780), body, fontsize=11)
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def make_scanned_document(text_path, path):
+    """Создает «скан» текстового документа: страницы-изображения JPEG 150 dpi"""
+    source = fitz.open(text_path)
+    doc = fitz.open()
+    for page in source:
+        pix = page.get_pixmap(matrix=fitz.Matrix(150 / 72, 150 / 72))
+        # Желтоватая бумага вместо белой
+        pix.tint_with(0x000000, 0xF4EBD0)
+        new_page = doc.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, stream=pix.tobytes("jpeg", jpg_quality=85))
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+    source.close()
+
+
+def measure(output_format, binarization, input_path, output_path, repeat):
+    """Возвращает лучшее время конвертации, размер результата и время его рендеринга"""
+    converter = PDFToBWConverter()
+    converter.set_pass_through(False)
+    converter.set_output_format(output_format, binarization)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        summary = converter.convert_pdf_to_bw(input_path, output_path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    doc = fitz.open(output_path)
+    start = time.perf_counter()
+    for page in doc:
+        page.get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY)
+    render_seconds = time.perf_counter() - start
+    doc.close()
+    return best, os.path.getsize(output_path), render_seconds, summary.codec_totals()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        text_path = os.path.join(tmp_dir, "text_color.pdf")
+        scan_path = os.path.join(tmp_dir, "text_scan.pdf")
+        make_text_document(text_path, args.pages)
+        make_scanned_document(text_path, scan_path)
+        inputs = [
+            os.path.join(EXAMPLES_DIR, "cat_color.pdf"),
+            text_path,
+            scan_path,
+        ]
+        output_path = os.path.join(tmp_dir, "output.pdf")
+
+        for input_path in inputs:
+            print(f"{os.path.basename(input_path)} ({os.path.getsize(input_path) / 1024:.0f} КБ):")
+            for output_format, binarization in VARIANTS:
+                seconds, output_size, render_seconds, codecs = measure(
+                    output_format, binarization, input_path, output_path, args.repeat
+                )
+                name = output_format if output_format != "bilevel" else f"{output_format}/{binarization}"
+                print(f"  {name:>16}: {seconds * 1000:8.1f} мс, {output_size / 1024:8.1f} КБ, "
+                      f"рендеринг результата {render_seconds * 1000:6.1f} мс")
+                if output_format == "auto":
+                    print("                    " + ", ".join(
+                        f"{codec}: {pages} стр." for codec, (pages, _) in sorted(codecs.items())
+                    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк кэша результатов конвертации
+
+На «скане» из bench_quality сравнивается время конвертации без кэша,
+первой конвертации с кэшем (расходы на хэширование и запись), повторно
+присланного файла (попадание по документу) и пересохраненной копии с
+переставленными и одной измененной страницей (попадания по страницам).
+
+Запуск:
+    python benchmarks/bench_cache.py [--pages 20] [--workers 1]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from benchmarks.bench_quality import make_scanned_document
+from src.converter import PDFToBWConverter
+
+
+def measure(converter, input_path, output_path):
+    """Конвертирует документ и возвращает время и итоги"""
+    start = time.perf_counter()
+    summary = converter.convert_pdf_to_bw(input_path, output_path)
+    return time.perf_counter() - start, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "scan.pdf")
+        resent_path = os.path.join(tmp_dir, "resent.pdf")
+        edited_path = os.path.join(tmp_dir, "edited.pdf")
+        output_path = os.path.join(tmp_dir, "output.pdf")
+        make_scanned_document(input_path, args.pages)
+        with open(input_path, "rb") as source, open(resent_path, "wb") as copy:
+            copy.write(source.read())
+
+        doc = fitz.open(input_path)
+        doc.select(list(reversed(range(len(doc)))))
+        doc[0].insert_text((60, 820), "Получено повторно", fontname="helv", fontsize=9)
+        doc.save(edited_path, garbage=4, deflate=True)
+        doc.close()
+
+        converter = PDFToBWConverter()
+        converter.set_workers(args.workers)
+        seconds, _ = measure(converter, input_path, output_path)
+        print(f"{args.pages} страниц без кэша: {seconds * 1000:.0f} мс")
+
+        converter.set_cache(os.path.join(tmp_dir, "cache"))
+        for name, path in [("первая с кэшем", input_path), ("тот же файл", resent_path),
+                           ("измененная копия", edited_path)]:
+            seconds, summary = measure(converter, path, output_path)
+            print(f"  {name:>16}: {seconds * 1000:7.1f} мс, из кэша: {summary.from_cache}, "
+                  f"страниц из кэша: {summary.cached_pages}")
+        print(f"  кэш: {converter.cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
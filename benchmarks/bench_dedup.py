@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк повторного использования изображений повторяющихся страниц
+
+Документ из писем, между которыми вставлены одинаковые титульные листы и
+повторные сканы одного бланка-разделителя с шумом сканирования,
+конвертируется без поиска повторов, с точными повторами и с допуском
+(set_deduplication). Для каждого варианта выводятся время, число
+пропущенных кодирований, доля повторов и размер результата; с
+--memory-limit результат пишется на диск частями, и общие объекты не
+объединяются при сохранении.
+
+Запуск:
+    python benchmarks/bench_dedup.py [--pages 200] [--every 4] [--tolerance 16] [--memory-limit 16]
+"""
+
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+from PIL import Image, ImageChops, ImageDraw
+
+from src.converter import Instrumentation, PDFToBWConverter
+
+
+def make_document(path, pages, every):
+    """Создает документ с титульными листами и сканами разделителя через каждые every страниц"""
+    form = Image.new("RGB", (850, 1100), (250, 245, 235))
+    draw = ImageDraw.Draw(form)
+    draw.rectangle((60, 60, 790, 220), fill=(30, 60, 160))
+    for y in range(300, 1000, 24):
+        draw.line((60, y, 790, y), fill=(120, 120, 120))
+
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        if page_num % every == 0 and page_num % (2 * every) == 0:
+            page.draw_rect(fitz.Rect(50, 60, 545, 260), color=(0.8, 0.1, 0.1), fill=(0.2, 0.5, 0.9))
+            page.insert_text((50, 320), "Cover sheet", fontsize=28, color=(0, 0.3, 0))
+        elif page_num % every == 0:
+            noise = Image.effect_noise(form.size, 6).convert("RGB")
+            buffer = io.BytesIO()
+            ImageChops.add(form, noise, 1, -128).save(buffer, "JPEG", quality=90)
+            page.insert_image(page.rect, stream=buffer.getvalue())
+        else:
+            page.draw_rect(fitz.Rect(50, 60, 545, 140), color=(0.1, 0.4, 0.1), fill=(0.9, 0.8, 0.3))
+            body = f"{page_num} Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 25
+            page.insert_textbox(fitz.Rect(50, 200, 545, 780), body, fontsize=11, color=(0, 0, 0.4))
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--every", type=int, default=4, help="повторяющаяся страница через каждые every")
+    parser.add_argument("--tolerance", type=int, default=16, help="допуск для сканов разделителя")
+    parser.add_argument("--memory-limit", type=int, help="ограничение памяти под выходной документ, МБ")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "input.pdf")
+        output_path = os.path.join(tmp_dir, "output.pdf")
+        make_document(input_path, args.pages, args.every)
+        print(f"{args.pages} страниц, повтор через каждые {args.every}")
+
+        for name, enabled, tolerance in (("без поиска повторов", False, 0), ("точные повторы", True, 0),
+                                         (f"допуск {args.tolerance}", True, args.tolerance)):
+            converter = PDFToBWConverter()
+            converter.set_deduplication(enabled, tolerance)
+            converter.set_memory_limit(args.memory_limit)
+            instrumentation = Instrumentation(keep_spans=False)
+            converter.set_instrumentation(instrumentation)
+            start = time.perf_counter()
+            summary = converter.convert_pdf_to_bw(input_path, output_path)
+            seconds = time.perf_counter() - start
+            print(f"  {name:>19}: {seconds:.2f} с, кодирований пропущено "
+                  f"{instrumentation.counters.get('encodes_skipped', 0)}, повторов {summary.duplicate_pages} "
+                  f"({summary.dedup_ratio():.0%} байт изображений), {os.path.getsize(output_path) / 1024:.0f} КБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк способов конвертации: время и размер результата
+
+Сравнивает рендеринг страниц (engine="raster") с перезаписью операторов
+цвета (engine="vector") на примерах и на синтетическом текстовом
+документе с цветными заголовками и заливками.
+
+Запуск:
+    python benchmarks/bench_engines.py [--pages 50] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from src.converter import PDFToBWConverter
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+
+
+def make_text_document(path, pages):
+    """Создает текстовый документ с цветными заголовками и заливками"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.draw_rect(fitz.Rect(50, 40, 545, 90), color=(0, 0.3, 0.6), fill=(0.85, 0.9, 1))
+        page.insert_text((60, 72), f"Глава {page_num + 1}", fontname="helv", fontsize=20, color=(0.7, 0, 0))
+        body = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40
+        page.insert_textbox(fitz.Rect(50, 110, 545, 780), body, fontsize=11)
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def measure(engine, input_path, output_path, repeat):
+    """Возвращает лучшее время конвертации в секундах и размер результата"""
+    converter = PDFToBWConverter()
+    converter.set_engine(engine)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        converter.convert_pdf_to_bw(input_path, output_path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, os.path.getsize(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        text_path = os.path.join(tmp_dir, "text_color.pdf")
+        make_text_document(text_path, args.pages)
+        inputs = [
+            os.path.join(EXAMPLES_DIR, "cat_color.pdf"),
+            os.path.join(EXAMPLES_DIR, "cat_bw.pdf"),
+            text_path,
+        ]
+        output_path = os.path.join(tmp_dir, "output.pdf")
+
+        for input_path in inputs:
+            input_size = os.path.getsize(input_path)
+            print(f"{os.path.basename(input_path)} ({input_size / 1024:.0f} КБ):")
+            for engine in ("raster", "vector"):
+                seconds, output_size = measure(engine, input_path, output_path, args.repeat)
+                print(f"  {engine:>6}: {seconds * 1000:8.1f} мс, {output_size / 1024:8.1f} КБ "
+                      f"({output_size / input_size:.2f} от исходного)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк улучшений изображения: цепочка ImageEnhance против таблицы Image.point
+
+Страницы примеров рендерятся в оттенках серого в масштабе 2.0, как при
+конвертации. Для каждого варианта выводится время на страницу и число и
+объем промежуточных изображений полного размера (подсчет вызовов
+Image.Image._new, через который Pillow создает каждое новое изображение).
+
+Запуск:
+    python benchmarks/bench_enhance.py [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+from PIL import Image, ImageEnhance
+
+from src.converter import enhance_grayscale, pixmap_to_image
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+SETTINGS = [
+    ("яркость+контраст", (1.2, 1.3, 1.0)),
+    ("все три", (1.2, 1.3, 1.5)),
+]
+
+
+def legacy_enhance(image, brightness, contrast, sharpness):
+    """Прежняя цепочка ImageEnhance"""
+    if image.mode != 'L':
+        image = image.convert('L')
+    if brightness != 1.0:
+        image = ImageEnhance.Brightness(image).enhance(brightness)
+    if contrast != 1.0:
+        image = ImageEnhance.Contrast(image).enhance(contrast)
+    if sharpness != 1.0:
+        image = ImageEnhance.Sharpness(image).enhance(sharpness)
+    return image
+
+
+class AllocationCounter:
+    """Считает новые изображения Pillow заданного размера"""
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.original_new = Image.Image._new
+
+    def __enter__(self):
+        counter = self
+
+        def counting_new(image, im):
+            if im.size == counter.size:
+                counter.count += 1
+            return counter.original_new(image, im)
+
+        Image.Image._new = counting_new
+        return self
+
+    def __exit__(self, *exc_info):
+        Image.Image._new = self.original_new
+
+
+def measure(function, image, settings, repeat):
+    """Возвращает лучшее время в мс и число промежуточных изображений"""
+    with AllocationCounter(image.size) as counter:
+        function(image, *settings)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(image, *settings)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, counter.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name in ("cat_color.pdf", "cat_bw.pdf"):
+        doc = fitz.open(os.path.join(EXAMPLES_DIR, name))
+        pix = doc[0].get_pixmap(matrix=fitz.Matrix(2.0, 2.0), colorspace=fitz.csGRAY)
+        image = pixmap_to_image(pix).copy()
+        megabytes = image.width * image.height / 1024 / 1024
+        print(f"{name} ({image.width}x{image.height}):")
+        for title, settings in SETTINGS:
+            for variant, function in (("ImageEnhance", legacy_enhance), ("LUT", enhance_grayscale)):
+                ms, count = measure(function, image, settings, args.repeat)
+                print(f"  {title:>16} {variant:>12}: {ms:6.1f} мс, "
+                      f"{count} промежуточных изображений ({count * megabytes:.1f} МБ)")
+        doc.close()
+
+
+if __name__ == "__main__":
+    main()
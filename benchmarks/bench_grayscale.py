@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк определения черно-белых изображений
+
+Сравнивает прежний детектор (list(image.getdata()) и цикл на Python по
+каждому 10-му пикселю) с детектором на операциях PIL с прореживанием и
+досрочным выходом. Изображения рендерятся из примеров так же, как при
+проверке PDF, и дополнительно в разрешении конвертации.
+
+Запуск:
+    python benchmarks/bench_grayscale.py [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from src.converter import PDFToBWConverter, pixmap_to_image
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+
+
+def legacy_is_grayscale(image, threshold=0.95):
+    """Прежний детектор с построчным перебором пикселей"""
+    if image.mode == 'L':
+        return True
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    sample_pixels = list(image.getdata())[::10]
+    grayscale_count = sum(1 for r, g, b in sample_pixels if r == g == b)
+    return grayscale_count / len(sample_pixels) >= threshold
+
+
+def measure(function, image, repeat):
+    """Возвращает результат и лучшее время вызова в миллисекундах"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(image)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    converter = PDFToBWConverter()
+    for name in ("cat_color.pdf", "cat_bw.pdf"):
+        doc = fitz.open(os.path.join(EXAMPLES_DIR, name))
+        for zoom in (0.5, 2.0):
+            pix = doc[0].get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            image = pixmap_to_image(pix)
+            legacy_result, legacy_ms = measure(legacy_is_grayscale, image, args.repeat)
+            new_result, new_ms = measure(converter.is_already_grayscale, image, args.repeat)
+            print(f"{name:>14} x{zoom}: {image.width}x{image.height}, "
+                  f"прежний {legacy_ms:8.1f} мс ({legacy_result}), "
+                  f"новый {new_ms:6.1f} мс ({new_result}), ускорение {legacy_ms / new_ms:5.1f}x")
+        doc.close()
+
+
+if __name__ == "__main__":
+    main()
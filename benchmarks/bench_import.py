@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк времени импорта модулей конвертера
+
+Запускает `python -X importtime -c "import <модуль>"` в отдельных процессах
+с прогретым кэшем байт-кода и выводит медианное суммарное время импорта и
+самые тяжелые импорты процесса. Для сравнения измеряются и сами PyMuPDF и
+Pillow, которые конвертер загружает только при первом использовании.
+
+Запуск:
+    python benchmarks/bench_import.py [--repeat 5] [--top 5]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MODULES = ["src.converter", "src.cli", "fitz", "PIL.Image"]
+
+
+def import_times(module, pycache_dir):
+    """
+    Импортирует модуль в новом процессе с -X importtime
+
+    Returns:
+        dict: имя модуля -> суммарное время импорта в микросекундах
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-X", f"pycache_prefix={pycache_dir}", "-c", f"import {module}"],
+        cwd=REPO_DIR, env=env, check=True, capture_output=True, text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pycache_dir:
+        for module in MODULES:
+            import_times(module, pycache_dir)
+            runs = [import_times(module, pycache_dir) for _ in range(args.repeat)]
+            totals = sorted(run[module] for run in runs)
+            print(f"{module:>14}: {totals[len(totals) // 2] / 1000:7.1f} мс")
+            heaviest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)
+            for name, micros in [item for item in heaviest if item[0] != module][:args.top]:
+                print(f"{'':>16}{name:<32} {micros / 1000:6.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк инкрементальной повторной конвертации
+
+Большой цветной документ конвертируется целиком, после чего для небольшого
+диапазона страниц меняется контрастность. Сравнивается время полной
+повторной конвертации и инкрементальной (set_incremental), при которой
+рендерятся только страницы диапазона, а остальные переносятся из прежнего
+результата, а также повторного запуска без изменений.
+
+Запуск:
+    python benchmarks/bench_incremental.py [--pages 500] [--changed 10] [--workers 1]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from src.converter import PDFToBWConverter
+
+
+def make_document(path, pages):
+    """Создает цветной документ с текстом и заливками на каждой странице"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.draw_rect(fitz.Rect(50, 60, 545, 260), color=(0.8, 0.1, 0.1), fill=(0.2, 0.5, 0.9))
+        body = f"{page_num} Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 25
+        page.insert_textbox(fitz.Rect(50, 300, 545, 780), body, fontsize=11, color=(0, 0.3, 0))
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def measure(converter, input_path, output_path):
+    """Конвертирует документ и возвращает время и итоги"""
+    start = time.perf_counter()
+    summary = converter.convert_pdf_to_bw(input_path, output_path)
+    return time.perf_counter() - start, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--changed", type=int, default=10, help="размер диапазона с новыми настройками")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "input.pdf")
+        output_path = os.path.join(tmp_dir, "output.pdf")
+        make_document(input_path, args.pages)
+        first = args.pages // 2
+        overrides = [(first, first + args.changed - 1, {"contrast": 1.4})]
+
+        converter = PDFToBWConverter()
+        converter.set_workers(args.workers)
+        converter.set_incremental()
+        seconds, _ = measure(converter, input_path, output_path)
+        print(f"{args.pages} страниц, первая конвертация: {seconds:.2f} с")
+
+        full = PDFToBWConverter()
+        full.set_workers(args.workers)
+        full.set_page_overrides(overrides)
+        seconds, _ = measure(full, input_path, os.path.join(tmp_dir, "full.pdf"))
+        print(f"  полная повторная, контраст на {args.changed} страницах: {seconds:.2f} с")
+
+        converter.set_page_overrides(overrides)
+        seconds, summary = measure(converter, input_path, output_path)
+        print(f"  инкрементальная: {seconds:.2f} с, отрендерено {summary.rendered_pages}, "
+              f"перенесено {summary.reused_pages}")
+
+        seconds, summary = measure(converter, input_path, output_path)
+        print(f"  без изменений: {seconds:.2f} с, перенесено {summary.reused_pages}")
+
+
+if __name__ == "__main__":
+    main()
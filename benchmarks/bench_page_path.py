@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пути обработки страницы: задержка на страницу и пиковый RSS
+
+Сравнивает прежний путь (RGB pixmap -> PPM -> PIL -> временный JPEG файл ->
+insert_image(filename=...)) с путем в памяти (pixmap в оттенках серого ->
+PIL без копирования -> JPEG в буфер -> insert_image(stream=...)).
+Каждый вариант запускается в отдельном процессе, чтобы пиковый RSS
+не смешивался.
+
+Запуск:
+    python benchmarks/bench_page_path.py [--input examples/cat_color.pdf] [--pages 20]
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+from PIL import Image
+
+from src.converter import PDFToBWConverter
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples", "cat_color.pdf")
+
+
+def legacy_page(converter, page, output_doc):
+    """Прежний путь страницы через PPM и временный файл"""
+    output_width, output_height = converter.get_page_dimensions(page)
+    mat = fitz.Matrix(2.0 * output_width / page.rect.width, 2.0 * output_height / page.rect.height)
+    pix = page.get_pixmap(matrix=mat)
+    img = Image.open(io.BytesIO(pix.tobytes("ppm")))
+    bw_img = converter.apply_image_enhancements(img)
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as temp_file:
+        temp_path = temp_file.name
+        bw_img.save(temp_path, "JPEG", quality=converter.quality, optimize=True)
+    new_page = output_doc.new_page(width=output_width, height=output_height)
+    new_page.insert_image(fitz.Rect(0, 0, output_width, output_height), filename=temp_path)
+    os.unlink(temp_path)
+
+
+def memory_page(converter, page, output_doc):
+    """Путь страницы в памяти"""
+    output_width, output_height, image_data = converter.render_page(page)
+    new_page = output_doc.new_page(width=output_width, height=output_height)
+    new_page.insert_image(fitz.Rect(0, 0, output_width, output_height), stream=image_data)
+
+
+def run_variant(variant, input_path, pages):
+    """Выполняет один вариант и возвращает метрики"""
+    process_page = {"legacy": legacy_page, "memory": memory_page}[variant]
+    converter = PDFToBWConverter()
+    input_doc = fitz.open(input_path)
+    output_doc = fitz.open()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings = []
+    for index in range(pages):
+        start = time.perf_counter()
+        process_page(converter, input_doc[index % len(input_doc)], output_doc)
+        timings.append(time.perf_counter() - start)
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings.sort()
+    return {
+        "variant": variant,
+        "pages": pages,
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "median_ms": timings[len(timings) // 2] * 1000,
+        "peak_rss_kb": rss_after,
+        "rss_growth_kb": rss_after - rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--input", default=DEFAULT_INPUT)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--variant", choices=["legacy", "memory"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.input, args.pages)))
+        return
+
+    for variant in ("legacy", "memory"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--variant", variant, "--input", args.input, "--pages", str(args.pages)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output)
+        print(f"{variant:>7}: {result['mean_ms']:7.1f} мс/стр (медиана {result['median_ms']:.1f}), "
+              f"пиковый RSS {result['peak_rss_kb'] / 1024:.1f} МБ (+{result['rss_growth_kb'] / 1024:.1f} МБ)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк перелистывания страниц в предпросмотре
+
+Сравнивает get_preview_image (документ открывается и страница рендерится
+заново при каждом переходе) с PreviewRenderer: первый переход к странице,
+переход к уже показанной странице и последовательное перелистывание, при
+котором соседние страницы рендерятся заранее, пока пользователь смотрит
+на текущую (пауза --think мс).
+
+Затем моделируется перетаскивание ползунка (--events событий с частотой
+60 Гц) на предпросмотре размера --preview-size: обработка каждого события
+в главном потоке, как раньше, против PreviewPipeline. Выводятся время
+главного потока на событие, задержка от последнего события до готового
+изображения и сколько промежуточных изображений показано.
+
+Запуск:
+    python benchmarks/bench_preview.py [--pages 500] [--flips 20] [--think 150]
+        [--events 60] [--preview-size 900x1200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from src.converter import PDFToBWConverter, PreviewPipeline, PreviewRenderer
+
+EVENT_INTERVAL = 1 / 60
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+
+
+def make_document(path, pages):
+    """Создает большой документ: сканы из примеров и текстовые страницы"""
+    doc = fitz.open()
+    scans = [fitz.open(os.path.join(EXAMPLES_DIR, name)) for name in ("cat_color.pdf", "cat_bw.pdf")]
+    for page_num in range(pages):
+        if page_num % 3 == 0:
+            doc.insert_pdf(scans[page_num % 2])
+        else:
+            page = doc.new_page()
+            body = f"Страница {page_num + 1}. " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 40
+            page.insert_textbox(fitz.Rect(50, 50, 545, 790), body, fontname="helv", fontsize=11)
+    # Без garbage=4, чтобы копии сканов не объединялись и файл был большим
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def timed(function, *args):
+    """Возвращает время вызова в мс"""
+    start = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def report(name, timings):
+    """Выводит медиану и максимум времени перехода"""
+    print(f"  {name:>36}: медиана {statistics.median(timings):7.2f} мс, максимум {max(timings):7.2f} мс")
+
+
+def slider_settings(events):
+    """Настройки (яркость, контрастность, резкость) при перетаскивании ползунка"""
+    return [(1.0 + index / events, 1.2, 1.5) for index in range(events)]
+
+
+def drag_synchronous(converter, image, events):
+    """
+    Обработка каждого события в главном потоке: события ждут друг друга
+
+    Returns:
+        tuple: (время главного потока на событие в мс, задержка последнего события в мс)
+    """
+    start = time.perf_counter()
+    busy_until = start
+    busy = 0.0
+    for index, settings in enumerate(slider_settings(events)):
+        arrival = start + index * EVENT_INTERVAL
+        now = time.perf_counter()
+        if now < arrival:
+            time.sleep(arrival - now)
+        began = time.perf_counter()
+        converter.apply_preview_enhancements(image, *settings)
+        busy_until = time.perf_counter()
+        busy += busy_until - began
+    return busy / events * 1000, (busy_until - arrival) * 1000
+
+
+def drag_pipeline(converter, image, events):
+    """Те же события через PreviewPipeline: главный поток только ставит запрос"""
+    delivered = {}
+    finished = threading.Event()
+
+    def deliver(generation, result, submitted):
+        delivered[generation] = time.perf_counter()
+        if generation == events:
+            finished.set()
+
+    pipeline = PreviewPipeline(converter.apply_preview_enhancements, deliver, cancellable=True)
+    start = time.perf_counter()
+    busy = 0.0
+    for index, settings in enumerate(slider_settings(events)):
+        arrival = start + index * EVENT_INTERVAL
+        now = time.perf_counter()
+        if now < arrival:
+            time.sleep(arrival - now)
+        began = time.perf_counter()
+        pipeline.submit(image, *settings)
+        busy += time.perf_counter() - began
+    finished.wait()
+    pipeline.close()
+    return busy / events * 1000, (delivered[events] - arrival) * 1000, len(delivered)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--flips", type=int, default=20)
+    parser.add_argument("--think", type=float, default=150, help="пауза между переходами, мс")
+    parser.add_argument("--events", type=int, default=60)
+    parser.add_argument("--preview-size", default="900x1200")
+    args = parser.parse_args()
+    preview_size = tuple(int(part) for part in args.preview_size.split("x"))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "big.pdf")
+        make_document(path, args.pages)
+        print(f"{args.pages} страниц, {os.path.getsize(path) / 1024 / 1024:.1f} МБ")
+        pages = list(range(args.pages // 2, args.pages // 2 + args.flips))
+
+        converter = PDFToBWConverter()
+        report("get_preview_image", [timed(converter.get_preview_image, path, page_num) for page_num in pages])
+
+        preview = PreviewRenderer(prefetch=0)
+        preview.open(path)
+        report("PreviewRenderer, первый переход", [timed(preview.get_page, page_num) for page_num in pages])
+        report("PreviewRenderer, повторный переход", [timed(preview.get_page, page_num) for page_num in pages])
+        preview.close()
+
+        preview = PreviewRenderer(prefetch=2)
+        preview.open(path)
+        timings = []
+        for page_num in pages:
+            timings.append(timed(preview.get_page, page_num))
+            time.sleep(args.think / 1000)
+        report("PreviewRenderer, перелистывание", timings)
+        preview.close()
+
+        preview = PreviewRenderer(prefetch=0, preview_size=preview_size)
+        preview.open(path)
+        image = preview.get_page(0)
+        preview.close()
+        print(f"Перетаскивание ползунка, {args.events} событий, предпросмотр {image.width}x{image.height}:")
+        busy, latency = drag_synchronous(converter, image, args.events)
+        print(f"  {'в главном потоке':>36}: {busy:6.2f} мс на событие, задержка {latency:7.1f} мс")
+        busy, latency, processed = drag_pipeline(converter, image, args.events)
+        print(f"  {'PreviewPipeline':>36}: {busy:6.2f} мс на событие, задержка {latency:7.1f} мс, "
+              f"показано {processed} из {args.events}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк подбора качества JPEG под размер файла и под PSNR
+
+На синтетическом «скане» (страницы-изображения с текстом на желтоватой
+бумаге) и фотографии из примеров сравниваются конвертация с обычным
+качеством и с ограничениями set_quality_target: время, размер, уложился ли
+результат в ограничение и разброс выбранного качества по страницам.
+
+Запуск:
+    python benchmarks/bench_quality.py [--pages 10] [--workers 1]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from src.converter import PDFToBWConverter
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+
+
+def make_scanned_document(path, pages):
+    """Создает «скан»: текстовые страницы JPEG 150 dpi и фотография из примеров"""
+    doc = fitz.open()
+    for page_num in range(pages - 1):
+        text_doc = fitz.open()
+        text_page = text_doc.new_page()
+        text_page.insert_text((60, 72), f"Глава {page_num + 1}", fontname="helv", fontsize=20)
+        body = f"{page_num} Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (20 + page_num * 4)
+        text_page.insert_textbox(fitz.Rect(50, 110, 545, 780), body, fontsize=11)
+        pix = text_page.get_pixmap(matrix=fitz.Matrix(150 / 72, 150 / 72))
+        pix.tint_with(0x000000, 0xF4EBD0)
+        page = doc.new_page(width=text_page.rect.width, height=text_page.rect.height)
+        page.insert_image(page.rect, stream=pix.tobytes("jpeg", jpg_quality=85))
+        text_doc.close()
+    doc.insert_pdf(fitz.open(os.path.join(EXAMPLES_DIR, "cat_color.pdf")))
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def measure(input_path, output_path, workers, max_bytes=None, min_psnr=None):
+    """Конвертирует с ограничением и возвращает время, размер и итоги"""
+    converter = PDFToBWConverter()
+    converter.set_workers(workers)
+    converter.set_quality_target(max_bytes, min_psnr)
+    start = time.perf_counter()
+    summary = converter.convert_pdf_to_bw(input_path, output_path)
+    return time.perf_counter() - start, os.path.getsize(output_path), summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "scan.pdf")
+        output_path = os.path.join(tmp_dir, "output.pdf")
+        make_scanned_document(input_path, args.pages)
+
+        seconds, full_size, _ = measure(input_path, output_path, args.workers)
+        print(f"{args.pages} страниц, качество 75: {seconds * 1000:.0f} мс, {full_size / 1024:.0f} КБ")
+
+        targets = [("размер", {"max_bytes": int(full_size * fraction)}) for fraction in (0.75, 0.5, 0.25)]
+        targets += [("PSNR", {"min_psnr": value}) for value in (40, 35, 30)]
+        for name, target in targets:
+            seconds, size, summary = measure(input_path, output_path, args.workers, **target)
+            qualities = sorted(summary.page_qualities.values())
+            value = target.get("max_bytes", 0) / 1024 or target.get("min_psnr")
+            unit = "КБ" if "max_bytes" in target else "дБ"
+            print(f"  {name:>6} {value:6.0f} {unit}: {seconds * 1000:6.0f} мс, {size / 1024:6.0f} КБ, "
+                  f"уложился: {summary.target_met}, качество {qualities[0]}..{qualities[-1]} "
+                  f"(медиана {statistics.median(qualities):.0f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк политик разрешения рендеринга: время на страницу и размер результата
+
+Сравнивает фиксированное разрешение (144 dpi - прежний масштаб 2.0, и 200 dpi)
+с политикой "native" на синтетическом скане (страницы - цветные изображения
+150 dpi) и на текстовом документе с цветным текстом.
+
+Запуск:
+    python benchmarks/bench_resolution.py [--pages 20]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from src.converter import PDFToBWConverter
+
+POLICIES = [
+    ("fixed 144", {"policy": "fixed", "dpi": 144}),
+    ("fixed 200", {"policy": "fixed", "dpi": 200}),
+    ("native", {"policy": "native", "dpi": 200}),
+]
+
+
+def make_text_page(doc, page_num):
+    """Добавляет страницу с мелким цветным текстом"""
+    page = doc.new_page()
+    body = f"Страница {page_num + 1}. " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 45
+    page.insert_textbox(fitz.Rect(50, 50, 545, 790), body, fontsize=9, color=(0.1, 0.1, 0.4))
+
+
+def make_documents(tmp_dir, pages):
+    """Создает текстовый документ и скан из его страниц в 150 dpi"""
+    text_doc = fitz.open()
+    for page_num in range(pages):
+        make_text_page(text_doc, page_num)
+    text_path = os.path.join(tmp_dir, "text.pdf")
+    text_doc.save(text_path)
+
+    scan_doc = fitz.open()
+    for page in text_doc:
+        pix = page.get_pixmap(dpi=150)
+        pix.tint_with(0x203060, 0xFFF8E8)
+        scan_page = scan_doc.new_page(width=page.rect.width, height=page.rect.height)
+        scan_page.insert_image(scan_page.rect, stream=pix.tobytes("jpeg"))
+    scan_path = os.path.join(tmp_dir, "scan.pdf")
+    scan_doc.save(scan_path)
+    return [("скан 150 dpi", scan_path), ("текст", text_path)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "output.pdf")
+        for title, input_path in make_documents(tmp_dir, args.pages):
+            print(f"{title}:")
+            for name, resolution in POLICIES:
+                converter = PDFToBWConverter()
+                converter.set_resolution(**resolution)
+                start = time.perf_counter()
+                converter.convert_pdf_to_bw(input_path, output_path)
+                elapsed = time.perf_counter() - start
+                print(f"  {name:>9}: {elapsed / args.pages * 1000:6.1f} мс/стр, "
+                      f"{os.path.getsize(output_path) / 1024:8.1f} КБ")
+
+
+if __name__ == "__main__":
+    main()
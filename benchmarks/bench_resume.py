@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк продолжения прерванной конвертации по журналу
+
+Большой цветной документ конвертируется в отдельном процессе с журналом
+(set_journal), процесс принудительно завершается (SIGKILL), когда в журнале
+набирается заданная доля страниц, и конвертация запускается заново.
+Сравнивается время конвертации без журнала и с журналом (накладные расходы
+записи страниц) и время продолжения после сбоя.
+
+Запуск:
+    python benchmarks/bench_resume.py [--pages 300] [--kill-at 0.9] [--workers 1]
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from src.converter import PDFToBWConverter
+
+
+def make_document(path, pages):
+    """Создает цветной документ с текстом и заливками на каждой странице"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.draw_rect(fitz.Rect(50, 60, 545, 260), color=(0.8, 0.1, 0.1), fill=(0.2, 0.5, 0.9))
+        body = f"{page_num} Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 25
+        page.insert_textbox(fitz.Rect(50, 300, 545, 780), body, fontsize=11, color=(0, 0.3, 0))
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def make_converter(workers, journal_dir=None):
+    """Конвертер с настройками бенчмарка"""
+    converter = PDFToBWConverter()
+    converter.set_workers(workers)
+    converter.set_resolution("fixed", 200)
+    converter.set_journal(journal_dir)
+    return converter
+
+
+def measure(converter, input_path, output_path):
+    """Конвертирует документ и возвращает время и итоги"""
+    start = time.perf_counter()
+    summary = converter.convert_pdf_to_bw(input_path, output_path)
+    return time.perf_counter() - start, summary
+
+
+def journaled_pages(journal_dir):
+    """Число страниц в журнале"""
+    if not os.path.isdir(journal_dir):
+        return 0
+    return sum(
+        len([name for name in os.listdir(os.path.join(journal_dir, key)) if name.endswith(".page")])
+        for key in os.listdir(journal_dir)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--kill-at", type=float, default=0.9, help="доля страниц в журнале к моменту сбоя")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--convert", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.convert:
+        input_path, output_path, journal_dir = args.convert
+        make_converter(args.workers, journal_dir).convert_pdf_to_bw(input_path, output_path)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "input.pdf")
+        output_path = os.path.join(tmp_dir, "output.pdf")
+        journal_dir = os.path.join(tmp_dir, "journal")
+        make_document(input_path, args.pages)
+
+        seconds, _ = measure(make_converter(args.workers), input_path, output_path)
+        print(f"{args.pages} страниц, без журнала: {seconds:.2f} с")
+        seconds, _ = measure(make_converter(args.workers, journal_dir), input_path, output_path)
+        print(f"  с журналом: {seconds:.2f} с")
+        os.remove(output_path)
+
+        process = subprocess.Popen([sys.executable, __file__, "--convert", input_path, output_path, journal_dir,
+                                    "--workers", str(args.workers)])
+        target = int(args.pages * args.kill_at)
+        while journaled_pages(journal_dir) < target and process.poll() is None:
+            time.sleep(0.01)
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+        done = journaled_pages(journal_dir)
+        print(f"  процесс завершен после {done} страниц, результат {'есть' if os.path.exists(output_path) else 'нет'}")
+
+        seconds, summary = measure(make_converter(args.workers, journal_dir), input_path, output_path)
+        print(f"  продолжение: {seconds:.2f} с, из журнала {summary.resumed_pages}, "
+              f"отрендерено заново {summary.rendered_pages - summary.resumed_pages}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сервиса конвертации на множестве небольших документов
+
+Сравнивается запуск отдельного процесса pdf-bw на каждый документ (загрузка
+Python, PyMuPDF и Pillow для каждого файла) и отправка тех же документов в
+сервис с пулом прогретых процессов (src/service.py) параллельно из
+нескольких потоков-клиентов.
+
+Запуск:
+    python benchmarks/bench_service.py [--documents 40] [--pages 2] [--workers 4] [--clients 4]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+
+import fitz
+
+from src import service
+
+
+def make_document(path, pages):
+    """Создает небольшой цветной документ"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        page.draw_rect(fitz.Rect(50, 60, 545, 260), color=(0.8, 0.1, 0.1), fill=(0.2, 0.5, 0.9))
+        page.insert_text((50, 320), f"Document page {page_num + 1}", fontsize=14, color=(0, 0.3, 0))
+    doc.save(path)
+    doc.close()
+
+
+def convert_with_service(base_url, data):
+    """Отправляет документ в сервис и ждет результата"""
+    request = urllib.request.Request(f"{base_url}/jobs?contrast=1.2", data=data, method="POST")
+    with urllib.request.urlopen(request) as response:
+        job = json.loads(response.read())
+    while job["status"] not in service.FINISHED:
+        time.sleep(0.01)
+        with urllib.request.urlopen(f"{base_url}/jobs/{job['id']}") as response:
+            job = json.loads(response.read())
+    with urllib.request.urlopen(f"{base_url}/jobs/{job['id']}/result") as response:
+        return len(response.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--pages", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="процессов сервиса и pdf-bw")
+    parser.add_argument("--clients", type=int, default=4, help="одновременных клиентов сервиса")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "input.pdf")
+        make_document(input_path, args.pages)
+        with open(input_path, "rb") as input_file:
+            data = input_file.read()
+
+        def run_cli(index):
+            subprocess.run(
+                [sys.executable, "-m", "src.cli", input_path, "-o", os.path.join(tmp_dir, f"out{index}"),
+                 "--contrast", "1.2"],
+                cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.workers) as executor:
+            list(executor.map(run_cli, range(args.documents)))
+        cli_seconds = time.perf_counter() - start
+        print(f"{args.documents} документов по {args.pages} стр.")
+        print(f"  процесс pdf-bw на документ: {cli_seconds:.2f} с, "
+              f"{args.documents / cli_seconds:.1f} документов/с")
+
+        conversion_service = service.ConversionService(workers=args.workers, per_client=args.documents)
+        started = threading.Event()
+        address = []
+
+        def ready(server_address):
+            address.extend(server_address)
+            started.set()
+
+        thread = threading.Thread(target=asyncio.run, args=(service.serve(conversion_service, port=0, ready=ready),))
+        thread.start()
+        started.wait()
+        base_url = f"http://{address[0]}:{address[1]}"
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.clients) as executor:
+                list(executor.map(lambda _: convert_with_service(base_url, data), range(args.documents)))
+            service_seconds = time.perf_counter() - start
+        finally:
+            conversion_service.shutdown()
+            thread.join()
+        print(f"  сервис, {args.workers} процессов: {service_seconds:.2f} с, "
+              f"{args.documents / service_seconds:.1f} документов/с (в {cli_seconds / service_seconds:.1f} раза быстрее)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Набор бенчмарков конвертера по этапам с сохранением результатов в JSON
+
+Для каждого документа синтетического корпуса (benchmarks/corpus.py) в
+отдельном процессе измеряются этапы пути страницы - открытие, проверка
+на черно-белый (check_pdf_is_grayscale), рендеринг, улучшение, кодирование,
+вставка и сохранение, - а также конвертация целиком (convert_pdf_to_bw) и
+предпросмотр первых страниц (PreviewRenderer). Для каждого этапа
+сохраняется наименьшее время из --repeat повторов и пиковый RSS процесса
+во время этапа (по /proc/self/statm с шагом 2 мс, без /proc - по ru_maxrss).
+
+Результаты пишутся в JSON (--output) и сравниваются с сохраненными ранее
+(--compare): этап считается регрессией, если время или пиковая память
+выросли больше чем на --threshold и время - больше чем на --min-delta-ms.
+При регрессиях команда завершается с кодом 1.
+
+Запуск:
+    python benchmarks/bench_suite.py [--output results.json] [--compare baseline.json]
+        [--threshold 0.15] [--repeat 3] [--scale 1] [--corpus ПАПКА] [--only photo_a4 ...]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+
+import fitz
+import PIL
+from PIL import Image
+
+from benchmarks.corpus import CORPUS, generate_corpus
+from src.converter import PDFToBWConverter, PreviewRenderer, _insert_page_image, current_rss
+
+STAGES = ["open", "grayscale_check", "render", "enhance", "encode", "insert", "save", "convert", "preview"]
+
+
+class RssSampler(threading.Thread):
+    """Фоновый замер RSS: пик для текущего этапа stage"""
+
+    def __init__(self, interval=0.002):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stage = None
+        self.peaks = {}
+        self.stopped = threading.Event()
+
+    def enter(self, stage):
+        """Начинает учет пика для этапа"""
+        self.stage = stage
+        self.record()
+
+    def record(self):
+        stage = self.stage
+        if stage:
+            self.peaks[stage] = max(self.peaks.get(stage, 0), current_rss() or 0)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.record()
+
+
+def run_pass(path, output_path, sampler):
+    """
+    Один проход по документу с замером каждого этапа
+
+    Этапы страниц (рендеринг, улучшение, кодирование, вставка) повторяют путь
+    PDFToBWConverter._render_page и суммируются по страницам.
+
+    Returns:
+        dict: этап -> секунды
+    """
+    converter = PDFToBWConverter()
+    # Настройки не по умолчанию, чтобы этап улучшения не был пустым
+    converter.set_image_settings(brightness=1.1, contrast=1.2)
+    seconds = dict.fromkeys(STAGES, 0.0)
+
+    def timed(stage, function, *args):
+        sampler.enter(stage)
+        start = time.perf_counter()
+        result = function(*args)
+        seconds[stage] += time.perf_counter() - start
+        sampler.record()
+        sampler.enter(None)
+        return result
+
+    doc = timed("open", fitz.open, path)
+    timed("grayscale_check", converter.check_pdf_is_grayscale, path)
+
+    output_doc = fitz.open()
+    for page in doc:
+        output_width, output_height = converter.get_page_dimensions(page)
+        scale_x = output_width / page.rect.width
+        scale_y = output_height / page.rect.height
+        zoom = converter.get_render_dpi(page, max(scale_x, scale_y)) / 72
+        matrix = fitz.Matrix(zoom * scale_x, zoom * scale_y)
+
+        pix = timed("render", lambda: page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY))
+        image = Image.frombuffer("L", (pix.width, pix.height), pix.samples_mv, "raw", "L", pix.stride, 1)
+        enhanced = timed("enhance", converter.apply_image_enhancements, image)
+        image_data, _ = timed("encode", converter.encode_page_image, enhanced)
+        del image, enhanced, pix
+
+        def insert():
+            new_page = output_doc.new_page(width=output_width, height=output_height)
+            _insert_page_image(output_doc, new_page, fitz.Rect(0, 0, output_width, output_height), image_data)
+        timed("insert", insert)
+
+    timed("save", lambda: output_doc.save(output_path, garbage=4, deflate=True, clean=True))
+    output_doc.close()
+    doc.close()
+
+    timed("convert", converter.convert_pdf_to_bw, path, output_path)
+
+    def preview():
+        renderer = PreviewRenderer(prefetch=0)
+        for page_num in range(min(3, renderer.open(path))):
+            converter.apply_preview_enhancements(renderer.get_page(page_num), 1.2, 1.1, 1.0)
+        renderer.close()
+    timed("preview", preview)
+    return seconds
+
+
+def run_document(path, repeat):
+    """Измеряет документ (выполняется в отдельном процессе)"""
+    sampler = RssSampler()
+    sampler.start()
+    best = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "output.pdf")
+        for _ in range(repeat):
+            for stage, seconds in run_pass(path, output_path, sampler).items():
+                best[stage] = min(best.get(stage, seconds), seconds)
+        output_bytes = os.path.getsize(output_path)
+    sampler.stopped.set()
+
+    with fitz.open(path) as doc:
+        pages = len(doc)
+    return {
+        "pages": pages,
+        "bytes_in": os.path.getsize(path),
+        "bytes_out": output_bytes,
+        "pages_per_second": round(pages / best["convert"], 2),
+        "stages": {
+            stage: {
+                "seconds": round(best[stage], 5),
+                "ms_per_page": round(best[stage] / pages * 1000, 3),
+                "peak_rss_mb": round(sampler.peaks.get(stage, 0) / 1024 / 1024, 1),
+            }
+            for stage in STAGES
+        },
+    }
+
+
+def git_commit():
+    """Текущий коммит репозитория или None"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, check=True, capture_output=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """
+    Сравнивает результаты с базовыми
+
+    Returns:
+        list: строки с описанием регрессий
+    """
+    regressions = []
+    for name, document in results["documents"].items():
+        base_document = baseline.get("documents", {}).get(name)
+        if not base_document:
+            continue
+        for stage, metrics in document["stages"].items():
+            base = base_document["stages"].get(stage)
+            if not base:
+                continue
+            delta_ms = (metrics["seconds"] - base["seconds"]) * 1000
+            if base["seconds"] and metrics["seconds"] > base["seconds"] * (1 + threshold) and delta_ms > min_delta_ms:
+                regressions.append(f"{name}/{stage}: время {base['seconds'] * 1000:.1f} -> "
+                                   f"{metrics['seconds'] * 1000:.1f} мс (+{delta_ms:.1f} мс)")
+            if base["peak_rss_mb"] and metrics["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+                regressions.append(f"{name}/{stage}: пиковый RSS {base['peak_rss_mb']:.1f} -> "
+                                   f"{metrics['peak_rss_mb']:.1f} МБ")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON с базовыми результатами для поиска регрессий")
+    parser.add_argument("--threshold", type=float, default=0.15, help="допустимый относительный рост (0.15 = 15%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="наименьший учитываемый рост времени, мс")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель числа страниц корпуса")
+    parser.add_argument("--corpus", help="папка корпуса (по умолчанию временная)")
+    parser.add_argument("--only", nargs="+", choices=list(CORPUS), help="измерять только эти документы")
+    parser.add_argument("--document", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.document:
+        print(json.dumps(run_document(args.document, args.repeat)))
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = generate_corpus(args.corpus or tmp_dir, args.scale, args.only)
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "pymupdf": fitz.VersionBind,
+                "pillow": PIL.__version__,
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "repeat": args.repeat,
+                "scale": args.scale,
+            },
+            "documents": {},
+        }
+        for name, path in corpus.items():
+            output = subprocess.run(
+                [sys.executable, __file__, "--document", path, "--repeat", str(args.repeat)],
+                check=True, stdout=subprocess.PIPE, text=True,
+            ).stdout
+            document = json.loads(output.splitlines()[-1])
+            results["documents"][name] = document
+            stages = " ".join(
+                f"{stage} {metrics['ms_per_page']:.1f}" for stage, metrics in document["stages"].items()
+            )
+            print(f"{name:>14} ({document['pages']} стр., {document['pages_per_second']:.1f} стр/с), "
+                  f"мс/стр: {stages}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        print(f"Сравнение с {baseline['meta'].get('commit')}: "
+              f"{len(regressions) or 'нет'} регрессий (порог {args.threshold:.0%})")
+        for line in regressions:
+            print(f"  {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк рендеринга больших страниц полосами
+
+Одностраничный «плакат» формата A0 с фотографией и текстом конвертируется
+целиком и полосами с разными бюджетами памяти (set_tiling). Для каждого
+варианта в отдельном процессе измеряются время, пиковый RSS процесса
+(и RSS до конвертации) и размер результата.
+
+Запуск:
+    python benchmarks/bench_tiling.py [--size A0] [--dpi 144] [--budgets 64 16 4]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fitz
+
+from benchmarks.corpus import add_text, jpeg_bytes, synthetic_photo
+from src.converter import PDFToBWConverter
+
+PAGE_SIZES = {"A0": (2384, 3370), "A1": (1684, 2384), "A2": (1191, 1684)}
+
+
+def make_poster(path, size):
+    """Создает плакат с фотографией на большей части страницы и текстом"""
+    width, height = PAGE_SIZES[size]
+    doc = fitz.open()
+    page = doc.new_page(width=width, height=height)
+    page.insert_image(fitz.Rect(100, height * 0.35, width - 100, height - 150),
+                      stream=jpeg_bytes(synthetic_photo(1600, 1400, 1)))
+    add_text(page, 0, fitz.Rect(100, 100, width - 100, height * 0.33))
+    doc.save(path)
+    doc.close()
+
+
+def measure(input_path, output_path, dpi, budget):
+    """Конвертирует плакат (выполняется в отдельном процессе)"""
+    converter = PDFToBWConverter()
+    converter.set_resolution("fixed", dpi)
+    converter.set_image_settings(contrast=1.2, sharpness=1.3)
+    converter.set_tiling(budget)
+    fitz.open(input_path).close()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    converter.convert_pdf_to_bw(input_path, output_path)
+    return {
+        "seconds": time.perf_counter() - start,
+        "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "before_mb": rss_before / 1024,
+        "bytes": os.path.getsize(output_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", choices=list(PAGE_SIZES), default="A0")
+    parser.add_argument("--dpi", type=float, default=144)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[64, 16, 4], help="бюджеты полосы, МБ")
+    parser.add_argument("--measure", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--budget", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(*args.measure, args.dpi, args.budget)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, "poster.pdf")
+        output_path = os.path.join(tmp_dir, "output.pdf")
+        make_poster(input_path, args.size)
+        width, height = PAGE_SIZES[args.size]
+        pixels = width * height * (args.dpi / 72) ** 2
+        print(f"{args.size} {width}x{height} пт, {args.dpi:.0f} dpi: {pixels / 1e6:.1f} Мпикс")
+
+        for budget in [None] + args.budgets:
+            command = [sys.executable, __file__, "--measure", input_path, output_path, "--dpi", str(args.dpi)]
+            if budget:
+                command += ["--budget", str(budget)]
+            output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+            result = json.loads(output.splitlines()[-1])
+            name = f"полосы {budget} МБ" if budget else "целиком"
+            print(f"  {name:>15}: {result['seconds']:.2f} с, пиковый RSS {result['peak_mb']:.0f} МБ "
+                  f"(до конвертации {result['before_mb']:.0f} МБ), {result['bytes'] / 1024:.0f} КБ")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Генератор синтетического корпуса PDF для бенчмарков
+
+Документы создаются без сети и внешних файлов и одинаковы при каждом
+запуске: «фотографии» собираются из градиентов, фрактала и шума из
+hashlib.shake_256, сканы - из отрендеренного текста. Виды документов:
+текст с цветными заголовками, фотографии на всю страницу, смешанные
+страницы (текст, графика, фото), уже черно-белые сканы и крупные страницы
+A3; число страниц и размеры различаются.
+
+Запуск:
+    python benchmarks/corpus.py ПАПКА [--scale 1]
+"""
+
+import argparse
+import hashlib
+import io
+import os
+
+import fitz
+from PIL import Image, ImageFilter
+
+PAGE_SIZES = {"A4": (595, 842), "A3": (842, 1191), "Letter": (612, 792)}
+
+LOREM = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt. "
+
+
+def synthetic_photo(width, height, seed):
+    """Фотоподобное RGB изображение, одинаковое для одного seed"""
+    red = Image.linear_gradient("L").rotate(seed * 37 % 360).resize((width, height))
+    offset = (seed % 7) * 0.1
+    green = Image.effect_mandelbrot((width, height), (-2.0 + offset, -1.2, 0.8 + offset, 1.2), 48)
+    blue = Image.radial_gradient("L").resize((width, height))
+    noise = Image.frombytes("L", (width, height), hashlib.shake_256(f"photo{seed}".encode()).digest(width * height))
+    noise = noise.filter(ImageFilter.GaussianBlur(1.5))
+    image = Image.merge("RGB", (red, green, blue)).filter(ImageFilter.GaussianBlur(2))
+    return Image.blend(image, Image.merge("RGB", (noise, noise, blue)), 0.3)
+
+
+def jpeg_bytes(image, quality=85):
+    """Кодирует изображение в JPEG"""
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def add_text(page, page_num, rect, color=(0, 0, 0), heading_color=(0.1, 0.2, 0.7)):
+    """Заголовок и абзацы текста в прямоугольнике rect"""
+    page.insert_text((rect.x0, rect.y0 + 20), f"Section {page_num + 1}", fontname="helv", fontsize=18,
+                     color=heading_color)
+    # insert_textbox не выводит текст, который не помещается целиком, поэтому
+    # объем берется с запасом по средней ширине символа Helvetica 10 pt
+    body_rect = fitz.Rect(rect.x0, rect.y0 + 40, rect.x1, rect.y1)
+    repeats = int(body_rect.width / 5.5 * body_rect.height / 13 / len(LOREM))
+    page.insert_textbox(body_rect, f"{page_num} {LOREM}" * max(1, repeats), fontsize=10, color=color)
+
+
+def make_text(path, pages, size="A4"):
+    """Текстовый документ с цветными заголовками и ссылками"""
+    doc = fitz.open()
+    width, height = PAGE_SIZES[size]
+    for page_num in range(pages):
+        page = doc.new_page(width=width, height=height)
+        add_text(page, page_num, fitz.Rect(50, 50, width - 50, height - 80))
+        page.insert_text((50, height - 50), "https://example.org/docs", fontsize=9, color=(0, 0, 0.9))
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def make_photos(path, pages, size="A4", dpi=150):
+    """Фотографии на всю страницу"""
+    doc = fitz.open()
+    width, height = PAGE_SIZES[size]
+    for page_num in range(pages):
+        page = doc.new_page(width=width, height=height)
+        photo = synthetic_photo(int(width * dpi / 72), int(height * dpi / 72), page_num)
+        page.insert_image(page.rect, stream=jpeg_bytes(photo))
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def make_mixed(path, pages, size="A4"):
+    """Смешанные страницы: текст, цветная диаграмма и фотография на части страниц"""
+    doc = fitz.open()
+    width, height = PAGE_SIZES[size]
+    for page_num in range(pages):
+        page = doc.new_page(width=width, height=height)
+        add_text(page, page_num, fitz.Rect(50, 50, width - 50, height / 2))
+        for bar in range(6):
+            value = (page_num * 7 + bar * 13) % 10 + 2
+            bar_rect = fitz.Rect(70 + bar * 40, height - 100 - value * 20, 100 + bar * 40, height - 100)
+            page.draw_rect(bar_rect, color=(0, 0, 0), fill=(0.9, 0.3 + bar * 0.1, 0.2))
+        if page_num % 2 == 0:
+            photo = synthetic_photo(480, 360, page_num)
+            page.insert_image(fitz.Rect(width - 290, height / 2 + 20, width - 50, height / 2 + 200),
+                              stream=jpeg_bytes(photo))
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+def make_gray_scan(path, pages, size="A4", dpi=150):
+    """Уже черно-белый скан: страницы - JPEG в оттенках серого"""
+    doc = fitz.open()
+    width, height = PAGE_SIZES[size]
+    for page_num in range(pages):
+        text_doc = fitz.open()
+        text_page = text_doc.new_page(width=width, height=height)
+        add_text(text_page, page_num, fitz.Rect(50, 50, width - 50, height - 50), heading_color=(0, 0, 0))
+        pix = text_page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=fitz.csGRAY)
+        page = doc.new_page(width=width, height=height)
+        page.insert_image(page.rect, stream=pix.tobytes("jpeg", jpg_quality=80))
+        text_doc.close()
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+
+
+# Документы корпуса: имя -> (функция, число страниц, размер страницы)
+CORPUS = {
+    "text_a4": (make_text, 20, "A4"),
+    "text_letter": (make_text, 60, "Letter"),
+    "photo_a4": (make_photos, 6, "A4"),
+    "photo_a3": (make_photos, 3, "A3"),
+    "mixed_a4": (make_mixed, 16, "A4"),
+    "gray_scan_a4": (make_gray_scan, 12, "A4"),
+}
+
+
+def generate_corpus(directory, scale=1.0, names=None):
+    """
+    Создает недостающие документы корпуса в папке directory
+
+    Args:
+        scale: множитель числа страниц
+        names: имена документов из CORPUS (None - все)
+
+    Returns:
+        dict: имя документа -> путь к файлу
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for name, (make, pages, size) in CORPUS.items():
+        if names and name not in names:
+            continue
+        pages = max(1, round(pages * scale))
+        path = os.path.join(directory, f"{name}_{pages}.pdf")
+        if not os.path.exists(path):
+            make(path + ".tmp", pages, size)
+            os.replace(path + ".tmp", path)
+        paths[name] = path
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory")
+    parser.add_argument("--scale", type=float, default=1.0, help="множитель числа страниц")
+    args = parser.parse_args()
+
+    for name, path in generate_corpus(args.directory, args.scale).items():
+        with fitz.open(path) as doc:
+            print(f"{name:>14}: {len(doc):4d} стр., {os.path.getsize(path) / 1024:8.0f} КБ  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
-from setuptools import setup, find_packages
+from setuptools import setup, find_namespace_packages
 
 setup(
     name="pdf_bw_converter",
     version="1.0.0",
     description="Конвертер PDF в черно-белый с графическим интерфейсом",
-    packages=find_packages(),
+    packages=find_namespace_packages(include=["src"]),
     install_requires=[
         "PyMuPDF==1.23.8",
         "Pillow==10.0.1",
     ],
     python_requires=">=3.7",
+    entry_points={
+        "console_scripts": [
+            "pdf-bw=src.cli:main",
+            "pdf-bw-service=src.service:main",
+        ],
+    },
     author="Sokolova_IP",
     author_email="Sokolova_IP@example.com",
     classifiers=[
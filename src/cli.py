@@ -0,0 +1,381 @@
+"""
+Консольный интерфейс для пакетной конвертации PDF без графического интерфейса
+
+Примеры:
+    pdf-bw scans/ -o out/ --jobs 4
+    pdf-bw "archive/**/*.pdf" --engine vector --report report.json
+
+Для каждого файла в stdout выводится строка JSON с результатом, сообщения
+об ошибках выводятся в stderr. Модуль не импортирует tkinter, а PyMuPDF и
+Pillow загружаются только при конвертации.
+"""
+
+import argparse
+# concurrent.futures.process (и multiprocessing) загружается при первом обращении к ProcessPoolExecutor
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+import time
+
+from .converter import ConversionProgress, Instrumentation, JsonLinesExporter, PDFToBWConverter, ResultCache, prometheus_text
+
+OUTPUT_SIZES = ["original", "A4", "A3", "A5", "Letter", "Legal"]
+
+
+def parse_size(value):
+    """Разбирает размер страницы: имя формата или ШИРИНАxВЫСОТА в пунктах"""
+    if value in OUTPUT_SIZES:
+        return value
+    try:
+        width, height = (float(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"ожидается один из {', '.join(OUTPUT_SIZES)} или ШИРИНАxВЫСОТА, получено {value!r}"
+        )
+    return (width, height)
+
+
+# Настройки, доступные в --page-settings, и их типы
+PAGE_SETTING_TYPES = {
+    "brightness": float,
+    "contrast": float,
+    "sharpness": float,
+    "gamma": float,
+    "dpi": float,
+    "quality": int,
+    "black_point": int,
+    "white_point": int,
+    "size": parse_size,
+}
+
+
+def parse_page_settings(value):
+    """
+    Разбирает настройки диапазона страниц: "3-5:contrast=1.4,quality=90"
+
+    Returns:
+        tuple: (первая, последняя, настройки) с номерами страниц с 0
+    """
+    try:
+        pages, assignments = value.split(":", 1)
+        first, _, last = pages.partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        settings = {}
+        for assignment in assignments.split(","):
+            name, text = assignment.split("=", 1)
+            name = name.strip().replace("-", "_")
+            settings["output_size" if name == "size" else name] = PAGE_SETTING_TYPES[name](text.strip())
+    except (ValueError, KeyError, argparse.ArgumentTypeError):
+        raise argparse.ArgumentTypeError(
+            f"ожидается СТРАНИЦЫ:ИМЯ=ЗНАЧЕНИЕ,... с именами {', '.join(PAGE_SETTING_TYPES)}, получено {value!r}"
+        )
+    if first < 1 or last < first:
+        raise argparse.ArgumentTypeError(f"неверный диапазон страниц в {value!r}")
+    return (first - 1, last - 1, settings)
+
+
+def build_parser():
+    """Создает парсер аргументов командной строки"""
+    parser = argparse.ArgumentParser(
+        prog="pdf-bw",
+        description="Пакетная конвертация PDF в черно-белый формат",
+    )
+    parser.add_argument("inputs", nargs="+", help="PDF файлы, папки или шаблоны glob")
+    parser.add_argument("-o", "--output-dir", help="папка для результатов (по умолчанию рядом с исходными)")
+    parser.add_argument("--suffix", default="_bw", help="суффикс имени результата (по умолчанию _bw)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="искать PDF во вложенных папках")
+    parser.add_argument("--size", type=parse_size, default="original", help="размер выходной страницы")
+    parser.add_argument("--no-preserve-orientation", action="store_true", help="не сохранять ориентацию страниц")
+    parser.add_argument("--brightness", type=float, default=1.0)
+    parser.add_argument("--contrast", type=float, default=1.0)
+    parser.add_argument("--sharpness", type=float, default=1.0)
+    parser.add_argument("--quality", type=int, default=75, help="качество JPEG")
+    parser.add_argument("--max-size", type=float, help="наибольший размер результата, МБ (качество JPEG подбирается)")
+    parser.add_argument("--min-psnr", type=float, help="наименьший PSNR страниц в дБ (качество JPEG подбирается)")
+    parser.add_argument("--black-point", type=int, default=0, help="уровень, ниже которого все черное")
+    parser.add_argument("--white-point", type=int, default=255, help="уровень, выше которого все белое")
+    parser.add_argument("--gamma", type=float, default=1.0, help="гамма средних тонов (> 1 осветляет)")
+    parser.add_argument("--resolution", choices=["fixed", "native"], default="fixed",
+                        help="политика разрешения рендеринга")
+    parser.add_argument("--dpi", type=float, default=144, help="разрешение рендеринга (по умолчанию 144)")
+    parser.add_argument("--max-dpi", type=float, default=300, help="наибольшее разрешение для --resolution native")
+    parser.add_argument("--engine", choices=["raster", "vector"], default="raster")
+    parser.add_argument("--format", dest="output_format", choices=["jpeg", "bilevel", "auto"],
+                        default="jpeg",
+                        help="формат отрендеренных страниц: JPEG, однобитный CCITT G4 или выбор по содержимому")
+    parser.add_argument("--binarize", choices=["otsu", "adaptive", "dither"], default="otsu",
+                        help="способ перевода в однобитное для --format bilevel")
+    parser.add_argument("--page-settings", type=parse_page_settings, action="append", metavar="СТРАНИЦЫ:НАСТРОЙКИ",
+                        help="настройки для диапазона страниц, например 3-5:contrast=1.4,quality=90 "
+                             "(можно указать несколько раз)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="при повторной конвертации обрабатывать только изменившиеся страницы")
+    parser.add_argument("--no-pass-through", action="store_true",
+                        help="рендерить и черно-белые страницы цветных документов")
+    parser.add_argument("--memory-limit", type=int, help="ограничение памяти под выходной документ, МБ")
+    parser.add_argument("--tile-memory", type=int,
+                        help="рендерить большие страницы полосами с этим бюджетом памяти на полосу, МБ")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="не искать повторяющиеся страницы и изображения")
+    parser.add_argument("--dedup-tolerance", type=int, default=0,
+                        help="допуск в уровнях серого для повторов сканов одной страницы (по умолчанию 0 - только точные)")
+    parser.add_argument("--color-management", action="store_true",
+                        help="учитывать профили ICC при рендеринге: точнее для цветных сканов, но медленнее")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="количество документов, обрабатываемых одновременно (0 - по числу ядер)")
+    parser.add_argument("--page-workers", type=int, default=1,
+                        help="количество процессов рендеринга страниц в одном документе")
+    parser.add_argument("-f", "--force", action="store_true", help="конвертировать, даже если результат актуален")
+    parser.add_argument("--cache-dir", help="папка кэша результатов: повторные файлы и страницы не конвертируются")
+    parser.add_argument("--cache-size", type=int, default=1024, help="наибольший объем кэша, МБ (по умолчанию 1024)")
+    parser.add_argument("--journal-dir",
+                        help="папка журнала: после сбоя повторный запуск рендерит только недостающие страницы")
+    parser.add_argument("--report", help="сохранить отчет по всем файлам в JSON")
+    parser.add_argument("--progress", action="store_true",
+                        help="выводить прогресс страниц и оставшееся время в stderr")
+    parser.add_argument("--metrics", metavar="ФАЙЛ",
+                        help="дописать замеры этапов по страницам в файл JSON lines")
+    parser.add_argument("--prometheus", metavar="ФАЙЛ",
+                        help="сохранить суммарные замеры этапов и счетчики в текстовом формате Prometheus")
+    return parser
+
+
+def collect_inputs(patterns, recursive=False, skip_suffix=None):
+    """
+    Раскрывает файлы, папки и шаблоны glob в список PDF файлов
+
+    Args:
+        patterns: пути и шаблоны из командной строки
+        recursive: искать PDF во вложенных папках
+        skip_suffix: пропускать найденные в папках файлы с этим суффиксом,
+            если рядом лежит исходный файл (результаты предыдущего запуска)
+
+    Returns:
+        list: пары (путь к файлу, относительное имя для результата)
+    """
+    inputs = []
+    seen = set()
+
+    def add(path, name):
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            inputs.append((path, name))
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            walker = os.walk(pattern) if recursive else [(pattern, [], os.listdir(pattern))]
+            for root, _, files in walker:
+                for filename in sorted(files):
+                    stem, ext = os.path.splitext(filename)
+                    if ext.lower() != ".pdf":
+                        continue
+                    if skip_suffix and stem.endswith(skip_suffix) and \
+                            os.path.exists(os.path.join(root, stem[:-len(skip_suffix)] + ext)):
+                        continue
+                    path = os.path.join(root, filename)
+                    add(path, os.path.relpath(path, pattern))
+        elif os.path.isfile(pattern):
+            add(pattern, os.path.basename(pattern))
+        else:
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if os.path.isfile(path) and path.lower().endswith(".pdf"):
+                    add(path, os.path.basename(path))
+
+    return inputs
+
+
+def output_path_for(input_path, name, output_dir=None, suffix="_bw"):
+    """Путь результата: в output_dir с сохранением относительного имени или рядом с исходным"""
+    stem, ext = os.path.splitext(name)
+    if output_dir:
+        return os.path.join(output_dir, stem + ext)
+    return os.path.join(os.path.dirname(input_path), os.path.basename(stem) + suffix + ext)
+
+
+def settings_path_for(output_path):
+    """Путь файла с хэшем настроек, с которыми получен результат output_path"""
+    return output_path + ".settings"
+
+
+def is_up_to_date(input_path, output_path, settings):
+    """Проверяет, что результат не старше исходного файла и получен с теми же настройками"""
+    if not os.path.exists(output_path) or os.path.getmtime(output_path) < os.path.getmtime(input_path):
+        return False
+    try:
+        with open(settings_path_for(output_path), encoding="utf-8") as settings_file:
+            return settings_file.read() == ResultCache.settings_digest(settings)
+    except OSError:
+        return False
+
+
+def print_progress(input_path, event):
+    """Выводит событие прогресса конвертации в stderr"""
+    line = f"{input_path}: {event.value:3.0f}% {event.message}"
+    if event.eta is not None:
+        line += f" (осталось {event.eta:.1f} с)"
+    print(line, file=sys.stderr, flush=True)
+
+
+def convert_job(input_path, output_path, settings, page_workers=1, show_progress=False, cache_dir=None,
+                cache_size=1024, metrics=False, journal_dir=None):
+    """
+    Конвертирует один документ и возвращает строку отчета
+
+    Выполняется в рабочем процессе пула, поэтому принимает только
+    сериализуемые аргументы. С metrics отчет содержит суммы этапов
+    ("stages") и замеры целиком ("metrics", см. Instrumentation.as_dict).
+    """
+    converter = PDFToBWConverter()
+    converter.apply_settings(settings)
+    converter.set_workers(page_workers)
+    converter.set_cache(cache_dir, cache_size)
+    converter.set_journal(journal_dir)
+    instrumentation = Instrumentation() if metrics else None
+    converter.set_instrumentation(instrumentation)
+
+    listener = (lambda event: print_progress(input_path, event)) if show_progress else None
+    progress = ConversionProgress(max_rate=2, listener=listener)
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    summary = converter.convert_pdf_to_bw(input_path, output_path, progress=progress)
+
+    report = {
+        "input": input_path,
+        "output": output_path,
+        "seconds": round(time.perf_counter() - start, 3),
+        "bytes_in": os.path.getsize(input_path),
+    }
+    if instrumentation is not None:
+        report["stages"] = {
+            stage: {"seconds": round(totals["seconds"], 4), "count": totals["count"]}
+            for stage, totals in instrumentation.stages.items()
+        }
+        report["metrics"] = instrumentation.as_dict()
+    final_event = progress.final_event
+    if not summary:
+        report.update(status="error", error=final_event.error if final_event else None)
+        return report
+
+    # Хэш настроек рядом с результатом: с другими настройками файл не считается актуальным
+    with open(settings_path_for(output_path), "w", encoding="utf-8") as settings_file:
+        settings_file.write(ResultCache.settings_digest(settings))
+    report.update(
+        status="copied" if summary.file_copied else "converted",
+        pages=summary.total_pages,
+        copied_pages=summary.copied_pages,
+        rewritten_pages=summary.rewritten_pages,
+        rendered_pages=summary.rendered_pages,
+        bytes_out=os.path.getsize(output_path),
+        codecs={codec: {"pages": pages, "bytes": size} for codec, (pages, size) in summary.codec_totals().items()},
+    )
+    if cache_dir:
+        report.update(cache="hit" if summary.from_cache else "miss", cached_pages=summary.cached_pages)
+    if settings.get("incremental"):
+        report.update(reused_pages=summary.reused_pages)
+    if journal_dir:
+        report.update(resumed_pages=summary.resumed_pages)
+    if settings.get("deduplicate") and summary.rendered_pages:
+        report.update(
+            duplicate_pages=summary.duplicate_pages,
+            dedup_bytes_saved=summary.dedup_bytes,
+            dedup_ratio=round(summary.dedup_ratio(), 4),
+        )
+    if progress.page_times:
+        slowest = max(range(len(progress.page_times)), key=progress.page_times.__getitem__)
+        report.update(
+            seconds_per_page=round(sum(progress.page_times) / len(progress.page_times), 4),
+            slowest_page={"page": slowest + 1, "seconds": round(progress.page_times[slowest], 4)},
+        )
+    if settings.get("max_output_bytes") or settings.get("min_psnr"):
+        report.update(
+            target_met=summary.target_met,
+            page_qualities={str(page_num + 1): quality for page_num, quality in summary.page_qualities.items()},
+        )
+    return report
+
+
+def main(argv=None):
+    """Точка входа консольной команды pdf-bw"""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    converter = PDFToBWConverter()
+    converter.set_output_size(args.size, not args.no_preserve_orientation)
+    converter.set_image_settings(args.brightness, args.contrast, args.sharpness, args.quality)
+    converter.set_levels(args.black_point, args.white_point, args.gamma)
+    converter.set_quality_target(args.max_size and args.max_size * 1024 * 1024, args.min_psnr)
+    converter.set_resolution(args.resolution, args.dpi, max_dpi=args.max_dpi)
+    converter.set_engine(args.engine)
+    converter.set_output_format(args.output_format, args.binarize)
+    converter.set_pass_through(not args.no_pass_through)
+    converter.set_memory_limit(args.memory_limit)
+    converter.set_tiling(args.tile_memory)
+    converter.set_deduplication(not args.no_dedup, args.dedup_tolerance)
+    converter.set_color_management(args.color_management)
+    if not converter.set_page_overrides(args.page_settings):
+        parser.error("недопустимые значения в --page-settings")
+    converter.set_incremental(args.incremental)
+    settings = converter.get_settings()
+
+    skip_suffix = None if args.output_dir else args.suffix
+    inputs = collect_inputs(args.inputs, args.recursive, skip_suffix)
+    if not inputs:
+        parser.error("не найдено ни одного PDF файла")
+
+    reports = []
+    jobs = []
+    totals = Instrumentation(keep_spans=False)
+    for input_path, name in inputs:
+        output_path = output_path_for(input_path, name, args.output_dir, args.suffix)
+        # В инкрементальном режиме актуальность страниц проверяется по манифесту
+        if not args.force and not args.incremental and is_up_to_date(input_path, output_path, settings):
+            reports.append({"input": input_path, "output": output_path, "status": "skipped"})
+            print(json.dumps(reports[-1], ensure_ascii=False), flush=True)
+        else:
+            jobs.append((input_path, output_path))
+
+    workers = args.jobs or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs) or 1))) as executor:
+        futures = {
+            executor.submit(
+                convert_job, input_path, output_path, settings, args.page_workers, args.progress,
+                args.cache_dir, args.cache_size, bool(args.metrics or args.prometheus), args.journal_dir,
+            ): (input_path, output_path)
+            for input_path, output_path in jobs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                report = future.result()
+            except Exception as e:
+                input_path, output_path = futures[future]
+                report = {"input": input_path, "output": output_path, "status": "error", "error": str(e)}
+            metrics = report.pop("metrics", None)
+            if metrics:
+                # Замеры страниц пишутся в отдельный файл, а не в строку отчета
+                totals.merge(metrics)
+                if args.metrics:
+                    exporter = JsonLinesExporter(args.metrics, input=report["input"])
+                    document = Instrumentation(listener=exporter, keep_spans=False)
+                    document.merge(metrics)
+                    exporter.finish(document)
+            reports.append(report)
+            print(json.dumps(report, ensure_ascii=False), flush=True)
+            if report["status"] == "error":
+                print(f"{report['input']}: {report['error']}", file=sys.stderr)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            json.dump(reports, report_file, ensure_ascii=False, indent=2)
+    if args.prometheus:
+        with open(args.prometheus, "w", encoding="utf-8") as prometheus_file:
+            prometheus_file.write(prometheus_text(totals))
+
+    return 1 if any(report["status"] == "error" for report in reports) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
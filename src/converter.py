@@ -3,11 +3,1870 @@
 """
 
 import os
-import fitz  # PyMuPDF
-from PIL import Image, ImageEnhance
+import importlib
 import io
-import tempfile
-import shutil
+import math
+import re
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+
+class _LazyModule:
+    """
+    Модуль, который импортируется при первом обращении к его атрибуту
+    
+    PyMuPDF, Pillow, multiprocessing и shutil занимают большую часть времени запуска,
+    но не нужны для импорта конвертера, разбора аргументов и настройки,
+    поэтому загружаются только при первой работе с PDF или изображениями.
+    """
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+fitz = _LazyModule("fitz")  # PyMuPDF
+Image = _LazyModule("PIL.Image")
+ImageChops = _LazyModule("PIL.ImageChops")
+ImageEnhance = _LazyModule("PIL.ImageEnhance")
+ImageFilter = _LazyModule("PIL.ImageFilter")
+features = _LazyModule("PIL.features")
+multiprocessing = _LazyModule("multiprocessing")
+shutil = _LazyModule("shutil")
+queue = _LazyModule("queue")
+hashlib = _LazyModule("hashlib")
+json = _LazyModule("json")
+traceback = _LazyModule("traceback")
+
+# Число выполняющихся участков рендеринга без ICC (_without_icc) и его блокировка
+_icc_users = 0
+_icc_lock = threading.Lock()
+
+# Состояние рабочего процесса параллельной конвертации
+_worker_doc = None
+_worker_converter = None
+
+
+def pixmap_to_image(pix):
+    """
+    Оборачивает сэмплы pixmap в PIL изображение без копирования
+    
+    Изображение ссылается на память pixmap, поэтому pixmap должен
+    существовать, пока используется изображение.
+    """
+    mode = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}[pix.n]
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+
+
+@contextmanager
+def _without_icc():
+    """
+    Отключает цветовое управление (ICC) MuPDF на время рендеринга
+    
+    Без ICC рендеринг в DeviceGray выполняется почти вдвое быстрее, но
+    цвета ICCBased, CMYK и Lab переводятся в серый по упрощенным формулам,
+    без профилей: яркость цветных областей может отличаться на несколько
+    уровней. ICC - общая настройка MuPDF для всего процесса, поэтому она
+    отключается только на время рендеринга конвертера и включается снова
+    (как в MuPDF по умолчанию), когда завершается последний из
+    одновременных участков. Пока участок выполняется, ICC отключено и для
+    рендеринга в других потоках процесса.
+    """
+    global _icc_users
+    tools = fitz.TOOLS
+    with _icc_lock:
+        if _icc_users == 0:
+            tools.set_icc(False)
+        _icc_users += 1
+    try:
+        yield
+    finally:
+        with _icc_lock:
+            _icc_users -= 1
+            if _icc_users == 0:
+                tools.set_icc(True)
+
+
+def _release_frames(error):
+    """
+    Очищает локальные переменные кадров, через которые прошло исключение
+    
+    Кадры трассировки держат изображения из pixmap_to_image, а сам pixmap
+    освобождается раньше них, и MuPDF не может освободить его память
+    (BufferError в Pixmap.__del__). Выполняющийся кадр не очищается.
+    """
+    traceback.clear_frames(error.__traceback__)
+
+
+# Лексемы потока содержимого: комментарии, имена, словари, шестнадцатеричные
+# строки, скобки массивов, начало литеральной строки и прочие слова
+_CONTENT_TOKEN = re.compile(
+    rb"[\s\x00]+|%[^\r\n]*|/[^\s\x00/\[\]()<>{}%]*|<<|>>|<[0-9A-Fa-f\s]*>|[\[\]{}]|\(|[^\s\x00/\[\]()<>{}%]+"
+)
+_STRING_PART = re.compile(rb"\\.|[()]|[^\\()]+", re.S)
+_INLINE_IMAGE_END = re.compile(rb"[\s\x00]EI(?=[\s\x00/\[<(%]|$)")
+_XREF_REF = re.compile(r"(\d+)\s+\d+\s+R")
+_PDF_NAME = re.compile(r"/([^\s/\[\]<>()]+)")
+
+# Допустимое расхождение компонент цвета (0..1), при котором цвет считается серым
+_NEUTRAL_TOLERANCE = 0.02
+
+# Операторы задания цвета: (оператор, обводка или заливка, цветовое пространство)
+_COLOR_OPERATORS = {
+    b"g": (False, "gray"), b"G": (True, "gray"),
+    b"rg": (False, "rgb"), b"RG": (True, "rgb"),
+    b"k": (False, "cmyk"), b"K": (True, "cmyk"),
+}
+_INLINE_COLORSPACES = {"G": "DeviceGray", "RGB": "DeviceRGB", "CMYK": "DeviceCMYK", "I": "Indexed"}
+
+
+def _iter_content_operations(data):
+    """
+    Разбирает поток содержимого PDF на операторы с операндами
+    
+    Для каждого оператора возвращается (оператор, операнды, начало, конец),
+    где начало и конец - границы оператора вместе с операндами в data.
+    Числовые операнды возвращаются как float, имена - как строки без '/',
+    true и false - как bool, остальные операнды - как None. Данные встроенных
+    изображений пропускаются, а оператор BI возвращается со словарем
+    параметров изображения.
+    """
+    operands = []
+    start = None
+    pos = 0
+    length = len(data)
+    while pos < length:
+        match = _CONTENT_TOKEN.match(data, pos)
+        if match is None:
+            pos += 1
+            continue
+        token = match.group()
+        pos = match.end()
+        first = token[:1]
+        if first.isspace() or first in b"\x00%":
+            continue
+        if start is None:
+            start = match.start()
+        if first in b"[]{}" or token in (b"<<", b">>"):
+            continue
+        if first == b"(":
+            depth = 1
+            while depth and pos < length:
+                part = _STRING_PART.match(data, pos)
+                pos = part.end()
+                if part.group() == b"(":
+                    depth += 1
+                elif part.group() == b")":
+                    depth -= 1
+            operands.append(None)
+        elif first == b"/":
+            operands.append(token[1:].decode("latin-1"))
+        elif first == b"<":
+            operands.append(None)
+        else:
+            try:
+                operands.append(float(token))
+                continue
+            except ValueError:
+                pass
+            if token in (b"true", b"false", b"null"):
+                operands.append({b"true": True, b"false": False}.get(token))
+                continue
+            if token == b"ID":
+                params = dict(zip(operands[::2], operands[1::2]))
+                end = _INLINE_IMAGE_END.search(data, pos + 1)
+                pos = end.end() if end else length
+                yield b"BI", [params], start, pos
+                start = None
+            elif token != b"BI":
+                yield token, operands, start, pos
+                start = None
+            operands = []
+
+
+def _colorspace_kind(doc, kind, value):
+    """
+    Определяет вид цветового пространства по значению ключа PDF
+    
+    Returns:
+        str: "gray", "rgb", "cmyk" или None, если по пространству нельзя
+        судить о цвете без рендеринга
+    """
+    if kind == "xref":
+        xref = int(_XREF_REF.match(value).group(1))
+        value = doc.xref_object(xref, compressed=True)
+    family = _PDF_NAME.search(value)
+    family = family.group(1) if family else ""
+    if family in ("DeviceGray", "CalGray"):
+        return "gray"
+    if family in ("DeviceRGB", "CalRGB"):
+        return "rgb"
+    if family == "DeviceCMYK":
+        return "cmyk"
+    if family == "ICCBased":
+        icc = _XREF_REF.search(value)
+        if icc:
+            components = doc.xref_get_key(int(icc.group(1)), "N")[1]
+            return {"1": "gray", "3": "rgb", "4": "cmyk"}.get(components)
+    return None
+
+
+def _resource_owners(doc, xref):
+    """Возвращает xref объекта и его предков по /Parent для поиска наследуемых ресурсов"""
+    owners = []
+    while xref and xref not in owners:
+        owners.append(xref)
+        kind, value = doc.xref_get_key(xref, "Parent")
+        xref = int(_XREF_REF.match(value).group(1)) if kind == "xref" else 0
+    return owners
+
+
+def _named_colorspace_kind(doc, owners, name):
+    """Определяет вид цветового пространства по имени из /Resources/ColorSpace"""
+    family = _INLINE_COLORSPACES.get(name, name)
+    if family in ("DeviceGray", "DeviceRGB", "DeviceCMYK"):
+        return _colorspace_kind(doc, "name", "/" + family)
+    for owner in owners:
+        kind, value = doc.xref_get_key(owner, f"Resources/ColorSpace/{name}")
+        if kind != "null":
+            return _colorspace_kind(doc, kind, value)
+    return None
+
+
+def _is_neutral(space, values):
+    """
+    Проверяет, является ли цвет серым в заданном цветовом пространстве
+    
+    Returns:
+        bool или None, если цвет нельзя оценить
+    """
+    if space == "gray":
+        return True
+    if any(not isinstance(value, float) for value in values):
+        return None
+    if space == "rgb" and len(values) == 3:
+        return max(values) - min(values) <= _NEUTRAL_TOLERANCE
+    if space == "cmyk" and len(values) == 4:
+        return max(values[:3]) - min(values[:3]) <= _NEUTRAL_TOLERANCE
+    return None
+
+
+def _classify_content_stream(doc, data, owners, inherited):
+    """
+    Классифицирует поток содержимого по операторам цвета
+    
+    Args:
+        doc: документ fitz
+        data: байты потока содержимого
+        owners: xref объектов, в ресурсах которых ищутся именованные пространства
+        inherited: True для форм, которые наследуют цветовое пространство
+            от вызывающего потока
+    
+    Returns:
+        str: "gray", "color" или "unknown"
+    """
+    # Текущие цветовые пространства заливки и обводки
+    spaces = [None, None] if inherited else ["gray", "gray"]
+    result = "gray"
+    for operator, operands, _, _ in _iter_content_operations(data):
+        neutral = True
+        if operator in _COLOR_OPERATORS:
+            stroke, space = _COLOR_OPERATORS[operator]
+            spaces[stroke] = space
+            neutral = _is_neutral(space, operands[-{"gray": 1, "rgb": 3, "cmyk": 4}[space]:])
+        elif operator in (b"cs", b"CS"):
+            stroke = operator == b"CS"
+            name = operands[-1] if operands else None
+            spaces[stroke] = _named_colorspace_kind(doc, owners, name) if isinstance(name, str) else None
+            neutral = True if spaces[stroke] else None
+        elif operator in (b"sc", b"scn", b"SC", b"SCN"):
+            space = spaces[operator[:1] == b"S"]
+            neutral = _is_neutral(space, operands) if space else None
+        elif operator == b"sh":
+            neutral = None
+        elif operator == b"BI":
+            params = operands[0]
+            if not (params.get("IM") or params.get("ImageMask")):
+                name = params.get("CS", params.get("ColorSpace"))
+                space = _named_colorspace_kind(doc, owners, name) if isinstance(name, str) else None
+                neutral = True if space == "gray" else None
+        if neutral is False:
+            return "color"
+        if neutral is None:
+            result = "unknown"
+    return result
+
+
+def _format_number(value):
+    """Форматирует число для потока содержимого PDF"""
+    text = f"{value:.4f}".rstrip("0").rstrip(".")
+    return "0" if text in ("", "-0") else text
+
+
+def _parse_number_array(value):
+    """Разбирает массив чисел PDF, например '[0 0.5 1]'"""
+    return [float(item) for item in value.strip("[] ").split()]
+
+
+def _gray_level(space, values):
+    """
+    Яркость цвета (0..1) по формуле ITU-R 601, как при преобразовании PIL в режим L
+    
+    Returns:
+        float или None, если значения не соответствуют пространству
+    """
+    if any(not isinstance(value, float) for value in values):
+        return None
+    values = [max(0.0, min(1.0, value)) for value in values]
+    if space == "gray" and len(values) == 1:
+        return values[0]
+    if space == "rgb" and len(values) == 3:
+        red, green, blue = values
+    elif space == "cmyk" and len(values) == 4:
+        cyan, magenta, yellow, black = values
+        red, green, blue = ((1 - cyan) * (1 - black), (1 - magenta) * (1 - black), (1 - yellow) * (1 - black))
+    else:
+        return None
+    return 0.299 * red + 0.587 * green + 0.114 * blue
+
+
+def _rewrite_content_stream(doc, data, owners, inherited):
+    """
+    Переписывает операторы цвета потока содержимого в DeviceGray
+    
+    Args:
+        doc: документ fitz
+        data: байты потока содержимого
+        owners: xref объектов, в ресурсах которых ищутся именованные пространства
+        inherited: True для форм, которые наследуют цветовое пространство
+    
+    Returns:
+        tuple: (новые байты потока, имена шейдингов из операторов sh) или None,
+        если поток содержит цвета, которые нельзя перевести в оттенки серого
+        без рендеринга (узоры, Separation, DeviceN, Lab, цветные встроенные
+        изображения)
+    """
+    # Исходные цветовые пространства заливки и обводки
+    spaces = [None, None] if inherited else ["gray", "gray"]
+    shadings = []
+    parts = []
+    last = 0
+    for operator, operands, start, end in _iter_content_operations(data):
+        replacement = None
+        if operator in _COLOR_OPERATORS:
+            stroke, space = _COLOR_OPERATORS[operator]
+            spaces[stroke] = space
+            if space != "gray":
+                level = _gray_level(space, operands[-{"rgb": 3, "cmyk": 4}[space]:])
+                if level is None:
+                    return None
+                replacement = f"{_format_number(level)} {'G' if stroke else 'g'}"
+        elif operator in (b"cs", b"CS"):
+            stroke = operator == b"CS"
+            name = operands[-1] if operands else None
+            space = _named_colorspace_kind(doc, owners, name) if isinstance(name, str) else None
+            if space is None:
+                return None
+            spaces[stroke] = space
+            if space != "gray":
+                replacement = f"/DeviceGray {operator.decode()}"
+        elif operator in (b"sc", b"scn", b"SC", b"SCN"):
+            space = spaces[operator[:1] == b"S"]
+            if space is None:
+                space = {1: "gray", 3: "rgb", 4: "cmyk"}.get(len(operands))
+            level = _gray_level(space, operands)
+            if level is None:
+                return None
+            if space != "gray" or len(operands) != 1:
+                replacement = f"{_format_number(level)} {operator.decode()}"
+        elif operator == b"sh":
+            if not operands or not isinstance(operands[-1], str):
+                return None
+            shadings.append(operands[-1])
+        elif operator == b"BI":
+            params = operands[0]
+            if not (params.get("IM") or params.get("ImageMask")):
+                name = params.get("CS", params.get("ColorSpace"))
+                if not isinstance(name, str) or _named_colorspace_kind(doc, owners, name) != "gray":
+                    return None
+        
+        if replacement is not None:
+            parts.append(data[last:start])
+            parts.append(replacement.encode())
+            last = end
+    
+    parts.append(data[last:])
+    return b"".join(parts), shadings
+
+
+def _convert_function_to_gray(doc, xref, prefix, space, converted):
+    """
+    Переводит функцию шейдинга (типы 2 и 3) в одну компоненту серого
+    
+    Args:
+        doc: документ fitz
+        xref, prefix: объект и путь к словарю функции в нем
+        space: исходное цветовое пространство "rgb" или "cmyk"
+        converted: множество уже переведенных объектов
+    
+    Returns:
+        bool: True если функция переведена
+    """
+    if (xref, prefix) in converted:
+        return True
+    function_type = doc.xref_get_key(xref, prefix + "FunctionType")[1]
+    
+    if function_type == "2":
+        levels = []
+        for key in ("C0", "C1"):
+            kind, value = doc.xref_get_key(xref, prefix + key)
+            if kind != "array":
+                return False
+            level = _gray_level(space, _parse_number_array(value))
+            if level is None:
+                return False
+            levels.append(level)
+        for key, level in zip(("C0", "C1"), levels):
+            doc.xref_set_key(xref, prefix + key, f"[{_format_number(level)}]")
+    elif function_type == "3":
+        kind, value = doc.xref_get_key(xref, prefix + "Functions")
+        references = [int(number) for number in _XREF_REF.findall(value)] if kind == "array" else []
+        if not references or len(references) != value.count(" R"):
+            return False
+        for reference in references:
+            if not _convert_function_to_gray(doc, reference, "", space, converted):
+                return False
+    else:
+        return False
+    
+    converted.add((xref, prefix))
+    return True
+
+
+def _convert_shading_to_gray(doc, owners, name, converted):
+    """
+    Переводит шейдинг из ресурсов в DeviceGray
+    
+    Поддерживаются шейдинги типов 1-3 с функциями типов 2 и 3 в
+    пространствах RGB и CMYK.
+    
+    Returns:
+        bool: True если шейдинг уже серый или переведен
+    """
+    for owner in owners:
+        kind, value = doc.xref_get_key(owner, f"Resources/Shading/{name}")
+        if kind == "xref":
+            xref, prefix = int(_XREF_REF.match(value).group(1)), ""
+            break
+        if kind == "dict":
+            xref, prefix = owner, f"Resources/Shading/{name}/"
+            break
+    else:
+        return False
+    
+    if (xref, prefix) in converted:
+        return True
+    
+    kind, value = doc.xref_get_key(xref, prefix + "ColorSpace")
+    space = _colorspace_kind(doc, kind, value)
+    if space is None:
+        return False
+    if space != "gray":
+        if doc.xref_get_key(xref, prefix + "ShadingType")[1] not in ("1", "2", "3"):
+            return False
+        kind, value = doc.xref_get_key(xref, prefix + "Function")
+        if kind == "xref":
+            function = (int(_XREF_REF.match(value).group(1)), "")
+        elif kind == "dict":
+            function = (xref, prefix + "Function/")
+        else:
+            return False
+        if not _convert_function_to_gray(doc, *function, space, converted):
+            return False
+        doc.xref_set_key(xref, prefix + "ColorSpace", "/DeviceGray")
+        doc.xref_set_key(xref, prefix + "Background", "null")
+    
+    converted.add((xref, prefix))
+    return True
+
+
+def _float32(value):
+    """Округляет число до одинарной точности, как float в C"""
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+def build_enhancement_lut(histogram, brightness=1.0, contrast=1.0, black_point=0, white_point=255, gamma=1.0):
+    """
+    Строит таблицу из 256 значений, объединяющую яркость, контрастность и уровни
+    
+    Яркость и контрастность вычисляются так же, как в ImageEnhance: яркость
+    смешивает пиксель с черным, контрастность - со средним значением
+    изображения после изменения яркости (оно считается по гистограмме, без
+    промежуточного изображения). Затем уровни растягивают диапазон
+    [black_point, white_point] до [0, 255] и применяют гамму: значения
+    gamma > 1 осветляют средние тона.
+    
+    Арифметика повторяет Image.blend с одинарной точностью, поэтому результат
+    совпадает с цепочкой ImageEnhance.Brightness и ImageEnhance.Contrast.
+    
+    Args:
+        histogram: гистограмма исходного изображения в режиме L (нужна
+            только при contrast != 1.0)
+    
+    Returns:
+        list: 256 значений для Image.point
+    """
+    def blend(base, value, alpha):
+        # Image.blend: base + alpha * (value - base) во float с отсечением
+        result = _float32(base + _float32(alpha * (value - base)))
+        return 0 if result <= 0 else 255 if result >= 255 else int(result)
+    
+    alpha = _float32(brightness)
+    lut = [blend(0, value, alpha) for value in range(256)]
+    
+    if contrast != 1.0:
+        total = sum(histogram) or 1
+        mean = int(sum(count * lut[value] for value, count in enumerate(histogram)) / total + 0.5)
+        alpha = _float32(contrast)
+        lut = [blend(mean, value, alpha) for value in lut]
+    
+    if (black_point, white_point, gamma) != (0, 255, 1.0):
+        span = max(1, white_point - black_point)
+        lut = [
+            int(round(255 * min(1.0, max(0.0, (value - black_point) / span)) ** (1 / gamma)))
+            for value in lut
+        ]
+    
+    return lut
+
+
+def enhance_grayscale(image, brightness=1.0, contrast=1.0, sharpness=1.0, black_point=0, white_point=255, gamma=1.0,
+                      histogram=None, check=None):
+    """
+    Переводит изображение в оттенки серого и применяет улучшения
+    
+    Яркость, контрастность и уровни применяются одним проходом Image.point
+    по таблице из build_enhancement_lut, резкость - отдельной сверткой
+    ImageEnhance.Sharpness. Если улучшения не заданы, изображение
+    возвращается без копирования. histogram - гистограмма для
+    контрастности, если изображение - полоса страницы (по умолчанию
+    гистограмма самого изображения). check вызывается перед каждым
+    проходом и может прервать обработку исключением (см. PreviewPipeline).
+    """
+    if check:
+        check()
+    if image.mode != 'L':
+        image = image.convert('L')
+    
+    if check:
+        check()
+    if (brightness, contrast, black_point, white_point, gamma) != (1.0, 1.0, 0, 255, 1.0):
+        if contrast == 1.0:
+            histogram = None
+        elif histogram is None:
+            histogram = image.histogram()
+        image = image.point(build_enhancement_lut(histogram, brightness, contrast, black_point, white_point, gamma))
+    
+    if sharpness != 1.0:
+        if check:
+            check()
+        image = ImageEnhance.Sharpness(image).enhance(sharpness)
+    
+    return image
+
+
+def otsu_threshold(histogram):
+    """
+    Порог Оцу по гистограмме изображения в режиме L
+    
+    Выбирает уровень, который лучше всего разделяет гистограмму на два
+    класса (максимум межклассовой дисперсии). Пиксели не светлее порога
+    считаются черными.
+    """
+    total = sum(histogram)
+    total_sum = sum(value * count for value, count in enumerate(histogram))
+    
+    threshold = 127
+    best = -1.0
+    dark_weight = 0
+    dark_sum = 0
+    for value, count in enumerate(histogram):
+        dark_weight += count
+        if dark_weight == 0:
+            continue
+        light_weight = total - dark_weight
+        if light_weight == 0:
+            break
+        dark_sum += value * count
+        difference = dark_sum / dark_weight - (total_sum - dark_sum) / light_weight
+        variance = dark_weight * light_weight * difference * difference
+        if variance > best:
+            best = variance
+            threshold = value
+    return threshold
+
+
+def binarize(image, method="otsu", radius=None, offset=10, threshold=None):
+    """
+    Переводит изображение в оттенках серого в однобитное (режим "1")
+    
+    Args:
+        image: изображение в режиме L
+        method: "otsu" - глобальный порог Оцу, "adaptive" - порог по среднему
+            в окрестности radius (для сканов с неравномерным фоном),
+            "dither" - рассеивание ошибки Флойда-Стейнберга (для фотографий)
+        radius: радиус окрестности для "adaptive", по умолчанию 1/40 меньшей
+            стороны изображения
+        offset: насколько пиксель должен быть темнее среднего окрестности,
+            чтобы стать черным
+        threshold: глобальный порог, если изображение - полоса страницы (по
+            умолчанию порог Оцу по гистограмме изображения)
+    
+    Returns:
+        Image: изображение в режиме "1"
+    """
+    if method == "dither":
+        return image.convert("1")
+    
+    if threshold is None:
+        threshold = otsu_threshold(image.histogram())
+    if method != "adaptive":
+        return image.point([0 if value <= threshold else 255 for value in range(256)], "1")
+    
+    # Локальный порог - среднее окрестности минус offset, но не ниже половины
+    # глобального: иначе внутри больших темных областей среднее совпадает с
+    # пикселем и они становятся белыми
+    radius = radius or max(4, min(image.size) // 40)
+    floor = threshold // 2
+    local = image.filter(ImageFilter.BoxBlur(radius))
+    local = local.point([max(value - offset, floor) for value in range(256)])
+    darker = ImageChops.subtract(local, image)
+    return darker.point([255] + [0] * 255, "1")
+
+
+def encode_bilevel(image):
+    """
+    Кодирует однобитное изображение без потерь
+    
+    Если Pillow собран с libtiff, изображение сжимается CCITT Group 4 в TIFF
+    с одной полосой, которую _insert_page_image затем встраивает в PDF
+    без перекодирования. Иначе используется PNG.
+    
+    Returns:
+        bytes: файл TIFF или PNG
+    """
+    buffer = io.BytesIO()
+    if features.check("libtiff"):
+        image.save(buffer, "TIFF", compression="group4", strip_size=1 << 30)
+    else:
+        image.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+
+# Выбор кодека страницы в режиме "auto": доля полутонов (48..207), при
+# которой страница еще считается текстовой, и число заметных уровней серого,
+# при котором имеет смысл пробовать сжатие без потерь
+_BILEVEL_MAX_MIDTONES = 0.08
+_FLATE_MAX_LEVELS = 64
+
+
+def select_codec(histogram):
+    """
+    Выбирает кодек для отрендеренной страницы по ее гистограмме
+    
+    Страница почти без полутонов (текст и линии на бумаге) кодируется
+    однобитным изображением, страница с небольшим числом уровней серого
+    (заливки, графики) - без потерь через Flate, если это не больше JPEG,
+    остальные (фотографии, сканы с полутонами) - в JPEG.
+    
+    Args:
+        histogram: гистограмма страницы в режиме L после улучшений
+    
+    Returns:
+        str: "bilevel", "flate" или "jpeg"
+    """
+    total = sum(histogram) or 1
+    if sum(histogram[48:208]) / total <= _BILEVEL_MAX_MIDTONES:
+        return "bilevel"
+    levels = sum(1 for count in histogram if count > total * 0.0005)
+    if levels <= _FLATE_MAX_LEVELS:
+        return "flate"
+    return "jpeg"
+
+
+# Страница, отрендеренная полосами (set_tiling): сигнатура, высота страницы в
+# пикселях и число полос, затем для каждой полосы верхняя строка, число строк
+# и длина данных, за которыми следует сама полоса в JPEG, TIFF или PNG
+_TILES_SIGNATURE = b"PBWTILES"
+_TILES_HEADER = struct.Struct("<8sII")
+_TILE_HEADER = struct.Struct("<III")
+
+
+def pack_tiles(tiles, height):
+    """
+    Собирает закодированные полосы страницы в один результат
+    
+    Args:
+        tiles: список (верхняя строка, число строк, байты изображения)
+        height: высота страницы в пикселях
+    
+    Returns:
+        bytes: результат, который понимают image_codec и _insert_page_image
+    """
+    parts = [_TILES_HEADER.pack(_TILES_SIGNATURE, height, len(tiles))]
+    for top, rows, data in tiles:
+        parts.append(_TILE_HEADER.pack(top, rows, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def unpack_tiles(image_data):
+    """
+    Разбирает результат pack_tiles
+    
+    Returns:
+        tuple: (высота страницы в пикселях, список (верхняя строка, число
+        строк, байты)) или None, если изображение не разбито на полосы
+    """
+    if image_data[:8] != _TILES_SIGNATURE:
+        return None
+    _, height, count = _TILES_HEADER.unpack_from(image_data)
+    tiles = []
+    pos = _TILES_HEADER.size
+    for _ in range(count):
+        top, rows, length = _TILE_HEADER.unpack_from(image_data, pos)
+        pos += _TILE_HEADER.size
+        tiles.append((top, rows, image_data[pos:pos + length]))
+        pos += length
+    return height, tiles
+
+
+def image_codec(image_data):
+    """
+    Определяет кодек закодированной страницы по сигнатуре: jpeg, flate или bilevel
+    
+    Для страницы из полос возвращается кодек самой большой полосы.
+    """
+    tiled = unpack_tiles(image_data)
+    if tiled is not None:
+        return image_codec(max((data for _, _, data in tiled[1]), key=len))
+    if image_data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "bilevel"
+    if image_data[:8] == b"\x89PNG\r\n\x1a\n":
+        # PNG в режиме "1" - запасной вариант encode_bilevel без libtiff
+        return "bilevel" if image_data[24] == 1 else "flate"
+    return "jpeg"
+
+
+def _add_image_xobject(doc, width, height, bits, stream, filter_name, decode_parms):
+    """Создает объект изображения в оттенках серого из уже сжатого потока"""
+    xref = doc.get_new_xref()
+    doc.update_object(
+        xref,
+        f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+        f"/ColorSpace /DeviceGray /BitsPerComponent {bits} >>",
+    )
+    doc.update_stream(xref, stream, compress=False)
+    doc.xref_set_key(xref, "Filter", filter_name)
+    doc.xref_set_key(xref, "DecodeParms", decode_parms)
+    return xref
+
+
+def _tiff_g4_xobject(doc, image_data):
+    """Встраивает однополосный TIFF Group 4 как поток CCITTFaxDecode"""
+    tiff = Image.open(io.BytesIO(image_data))
+    tags = tiff.tag_v2
+    width, height = tiff.size
+    if tags.get(259) != 4 or len(tags[273]) != 1:
+        tiff.close()
+        return None
+    
+    offset, length = tags[273][0], tags[279][0]
+    black_is_1 = "true" if tags.get(262) == 1 else "false"
+    tiff.close()
+    return _add_image_xobject(
+        doc, width, height, 1, image_data[offset:offset + length], "/CCITTFaxDecode",
+        f"<< /K -1 /Columns {width} /Rows {height} /BlackIs1 {black_is_1} >>",
+    )
+
+
+def _png_xobject(doc, image_data):
+    """
+    Встраивает PNG в оттенках серого как поток FlateDecode
+    
+    Данные IDAT - это поток zlib со строками, фильтрованными по правилам PNG,
+    что в PDF соответствует /Predictor 15, поэтому сжатие не повторяется.
+    """
+    width, height, bits, color_type, _, _, interlace = struct.unpack(">IIBBBBB", image_data[16:29])
+    if color_type != 0 or interlace:
+        return None
+    
+    chunks = []
+    pos = 8
+    while pos < len(image_data):
+        length, kind = struct.unpack(">I4s", image_data[pos:pos + 8])
+        if kind == b"IDAT":
+            chunks.append(image_data[pos + 8:pos + 8 + length])
+        elif kind == b"IEND":
+            break
+        pos += length + 12
+    
+    return _add_image_xobject(
+        doc, width, height, bits, b"".join(chunks), "/FlateDecode",
+        f"<< /Predictor 15 /Colors 1 /BitsPerComponent {bits} /Columns {width} >>",
+    )
+
+
+def _insert_page_image(doc, page, rect, image_data, keep_proportion=True, images=None):
+    """
+    Вставляет отрендеренное изображение страницы
+    
+    JPEG вставляется через insert_image. Однополосный TIFF Group 4 из
+    encode_bilevel и PNG в оттенках серого встраиваются напрямую, потоками
+    CCITTFaxDecode и FlateDecode: MuPDF распаковал бы их при вставке.
+    Полосы из pack_tiles вставляются отдельными изображениями одна под
+    другой.
+    
+    images - словарь {хэш данных: xref} изображений, уже встроенных в doc:
+    изображение с теми же данными не встраивается повторно, а страница
+    ссылается на прежний xref. Новые изображения добавляются в словарь.
+    
+    Returns:
+        tuple: (байт изображений, взятых из уже встроенных, байт встроенных заново)
+    """
+    tiled = unpack_tiles(image_data)
+    if tiled is not None:
+        height, tiles = tiled
+        reused = embedded = 0
+        for top, rows, data in tiles:
+            tile_rect = fitz.Rect(rect.x0, rect.y0 + rect.height * top / height,
+                                  rect.x1, rect.y0 + rect.height * (top + rows) / height)
+            tile_reused, tile_embedded = _insert_page_image(
+                doc, page, tile_rect, data, keep_proportion=False, images=images
+            )
+            reused += tile_reused
+            embedded += tile_embedded
+        return reused, embedded
+    
+    digest = None
+    if images is not None:
+        digest = hashlib.sha256(image_data).digest()
+        xref = images.get(digest)
+        if xref is not None:
+            page.insert_image(rect, xref=xref, keep_proportion=keep_proportion)
+            return len(image_data), 0
+    
+    xref = None
+    if image_data[:4] in (b"II*\x00", b"MM\x00*"):
+        xref = _tiff_g4_xobject(doc, image_data)
+    elif image_data[:8] == b"\x89PNG\r\n\x1a\n":
+        xref = _png_xobject(doc, image_data)
+    
+    if xref is None:
+        xref = page.insert_image(rect, stream=image_data, keep_proportion=keep_proportion)
+    else:
+        page.insert_image(rect, xref=xref, keep_proportion=keep_proportion)
+    if digest is not None:
+        images[digest] = xref
+    return 0, len(image_data)
+
+
+# Память на пиксель при рендеринге полосами (set_tiling): pixmap, улучшенная
+# копия, свертка резкости и буферы кодека, и наибольшее число пикселей
+# уменьшенной копии страницы для общей гистограммы
+_TILE_BYTES_PER_PIXEL = 6
+_TILE_ANALYSIS_PIXELS = 1 << 22
+
+# Уменьшение страницы для сравнения повторов с допуском (set_deduplication)
+_DEDUP_REDUCE = 4
+
+
+# Оценка накладных расходов PDF при подборе качества под размер файла, байт:
+# на файл (xref, каталог и профиль ICC, который MuPDF добавляет к JPEG) и на
+# страницу (объект страницы и поток содержимого)
+_PDF_FILE_OVERHEAD = 4096
+_PDF_PAGE_OVERHEAD = 400
+
+
+def psnr(original, encoded):
+    """
+    Пиковое отношение сигнал/шум (дБ) между изображениями в режиме L
+    
+    Среднеквадратичная ошибка считается по гистограмме разности, без
+    поэлементных вычислений в Python. Для одинаковых изображений
+    возвращается math.inf.
+    """
+    histogram = ImageChops.difference(original, encoded).histogram()
+    mse = sum(count * value * value for value, count in enumerate(histogram)) / (original.width * original.height)
+    return math.inf if mse == 0 else 10 * math.log10(255 * 255 / mse)
+
+
+def allocate_page_budgets(sizes, budget):
+    """
+    Распределяет бюджет байт между страницами
+    
+    Страницы, которые меньше равной доли бюджета, остаются без ограничения,
+    а освобожденный ими объем делится между остальными (заполнение уровня).
+    
+    Args:
+        sizes: {номер страницы: размер без ограничения}
+        budget: общий объем для этих страниц
+    
+    Returns:
+        dict: {номер страницы: наибольший размер} для страниц, которые нужно
+        сжать сильнее; пустой, если все страницы помещаются
+    """
+    pending = dict(sizes)
+    remaining = budget
+    while pending:
+        share = max(0, remaining) / len(pending)
+        fitting = [page_num for page_num, size in pending.items() if size <= share]
+        if not fitting:
+            return {page_num: int(share) for page_num in pending}
+        for page_num in fitting:
+            remaining -= pending.pop(page_num)
+    return {}
+
+
+def _init_worker(pdf_path, settings, instrumented=False):
+    """Инициализация рабочего процесса: открывает собственную копию документа"""
+    global _worker_doc, _worker_converter
+    _worker_doc = fitz.open(pdf_path)
+    _worker_converter = PDFToBWConverter()
+    _worker_converter.apply_settings(settings)
+    _worker_converter.page_images = _worker_converter._new_page_index()
+    if instrumented:
+        _worker_converter.set_instrumentation(Instrumentation())
+
+
+def _render_worker_page(task):
+    """
+    Рендеринг одной страницы в рабочем процессе: task - (номер страницы, наибольший размер)
+    
+    Returns:
+        tuple: (результат _render_page, замеры страницы из Instrumentation.as_dict или None)
+    """
+    page_num, max_bytes = task
+    result = _worker_converter.page_converter(page_num)._render_page(_worker_doc[page_num], max_bytes)
+    instrumentation = _worker_converter.instrumentation
+    if instrumentation is None:
+        return result, None
+    measurements = instrumentation.as_dict()
+    instrumentation.reset()
+    return result, measurements
+
+
+# Ссылки на родительские объекты: не влияют на вид страницы, но ведут ко
+# всему дереву страниц
+_PARENT_REF = re.compile(r"/(?:Parent|P)\s+\d+\s+\d+\s+R")
+
+
+def page_fingerprint(doc, page, stream_digests=None):
+    """
+    Хэш содержимого страницы, не зависящий от номеров объектов
+    
+    Обходятся объекты, достижимые из /Contents, /Resources (с учетом
+    наследования) и /Annots страницы; ссылки в их тексте заменяются
+    порядковыми номерами обхода, а потоки хэшируются в исходном сжатом виде.
+    Поэтому одинаковые страницы разных файлов (пересохраненных, собранных
+    из частей) дают одинаковый хэш.
+    
+    Args:
+        stream_digests: словарь {xref: хэш потока} для повторного
+            использования при обходе нескольких страниц одного документа
+    """
+    if stream_digests is None:
+        stream_digests = {}
+    digest = hashlib.sha256()
+    digest.update(repr((tuple(page.mediabox), tuple(page.cropbox), page.rotation)).encode())
+    ordinals = {}
+    pending = deque()
+    
+    def add_text(text):
+        def replace(match):
+            xref = int(match.group(1))
+            if xref not in ordinals:
+                ordinals[xref] = len(ordinals)
+                pending.append(xref)
+            return f"@{ordinals[xref]}"
+        digest.update(_XREF_REF.sub(replace, _PARENT_REF.sub("", text)).encode())
+    
+    for key in ("Contents", "Resources", "Annots"):
+        owners = _resource_owners(doc, page.xref) if key == "Resources" else [page.xref]
+        for owner in owners:
+            kind, value = doc.xref_get_key(owner, key)
+            if kind != "null":
+                break
+        add_text(f"/{key} {kind} {value}\n")
+    
+    while pending:
+        xref = pending.popleft()
+        add_text(doc.xref_object(xref, compressed=True))
+        if doc.xref_is_stream(xref):
+            if xref not in stream_digests:
+                stream_digests[xref] = hashlib.sha256(doc.xref_stream_raw(xref)).digest()
+            digest.update(stream_digests[xref])
+    
+    return digest.hexdigest()
+
+
+def _page_stream_bytes(doc, page):
+    """Оценка объема страницы по длинам ее потоков содержимого, форм и изображений"""
+    xrefs = set(page.get_contents())
+    xrefs.update(image[0] for image in page.get_images(full=True))
+    xrefs.update(xobject[0] for xobject in page.get_xobjects())
+    total = 0
+    for xref in xrefs:
+        kind, value = doc.xref_get_key(xref, "Length")
+        if kind == "int":
+            total += int(value)
+    return total
+
+
+class _StreamingOutput:
+    """
+    Выходной документ с ограничением памяти
+    
+    Пока объем добавленных страниц не превышает memory_limit байт, документ
+    целиком находится в памяти и сохраняется в конце как обычно. После
+    превышения готовые страницы дописываются инкрементальным сохранением во
+    временный файл рядом с результатом, документ открывается заново, а кэш
+    MuPDF очищается, так что память не растет с числом страниц. В конце
+    временный файл переименовывается в результат без повторного прохода.
+    Документ в памяти тоже сохраняется через временный файл, поэтому
+    прежний результат заменяется атомарно и недописанный файл на месте
+    результата не остается.
+    """
+    
+    def __init__(self, output_path, memory_limit=None):
+        self.output_path = output_path
+        self.part_path = output_path + ".part"
+        self.memory_limit = memory_limit
+        self.doc = fitz.open()
+        self.pending_bytes = 0
+        self.streaming = False
+
+    def page_added(self, size):
+        """Учитывает добавленную страницу размером size байт"""
+        self.pending_bytes += size
+        if self.memory_limit and self.pending_bytes >= self.memory_limit:
+            self.flush()
+
+    def flush(self):
+        """Дописывает готовые страницы во временный файл и освобождает память"""
+        if self.streaming:
+            self.doc.saveIncr()
+        else:
+            self.doc.save(self.part_path, deflate=True, no_new_id=True)
+            self.streaming = True
+        self.doc.close()
+        fitz.TOOLS.store_shrink(100)
+        self.doc = fitz.open(self.part_path)
+        self.pending_bytes = 0
+
+    def save(self):
+        """Сохраняет результат в output_path"""
+        if self.streaming:
+            self.doc.saveIncr()
+        else:
+            self.doc.save(self.part_path, garbage=4, deflate=True, clean=True, no_new_id=True)
+        self.doc.close()
+        os.replace(self.part_path, self.output_path)
+
+    def discard(self):
+        """Закрывает документ и удаляет временный файл после ошибки"""
+        if not self.doc.is_closed:
+            self.doc.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+
+class PageImageIndex:
+    """
+    Недавно отрендеренные страницы для пропуска повторного кодирования
+    
+    Для страницы хранится готовый результат _render_page, и страница с теми
+    же размером pixmap, пикселями (до улучшения) и ограничением размера JPEG
+    получает его без улучшения и кодирования. Без допуска страницы
+    сравниваются по хэшу пикселей. При tolerance > 0 повтором считается
+    страница, копия которой, уменьшенная в _DEDUP_REDUCE раз по каждой
+    стороне, отличается не больше чем на tolerance уровней в каждой точке:
+    шум сканирования при уменьшении усредняется, а отличие в несколько
+    символов (например, номер страницы) дает разницу в десятки уровней.
+    Копии сравниваются со всеми хранимыми страницами, поэтому с допуском их
+    хранится меньше.
+    
+    Args:
+        tolerance: допуск в уровнях серого, 0 - только точные повторы
+        max_entries: сколько последних различных страниц хранить
+            (по умолчанию 64 без допуска и 16 с допуском)
+    """
+    
+    def __init__(self, tolerance=0, max_entries=None):
+        self.tolerance = tolerance
+        self.max_entries = max_entries or (16 if tolerance else 64)
+        self.entries = OrderedDict()
+        self.pages = 0
+
+    def lookup(self, pix, max_bytes=None):
+        """
+        Ищет среди сохраненных страницу с теми же пикселями
+        
+        Returns:
+            tuple: (ключ для add, сохраненный результат или None)
+        """
+        size = (pix.width, pix.height, max_bytes)
+        self.pages += 1
+        if not self.tolerance:
+            key = size + (hashlib.sha256(pix.samples_mv).digest(),)
+            entry = self.entries.get(key)
+            thumbnails = None
+        else:
+            key = size + (self.pages,)
+            entry = None
+            thumbnail = pixmap_to_image(pix).reduce(_DEDUP_REDUCE)
+            # Средние по блокам отличаются не больше, чем отдельные точки,
+            # поэтому еще меньшая копия быстро отсеивает явно другие страницы
+            thumbnails = (thumbnail, thumbnail.reduce(_DEDUP_REDUCE))
+            for other_key, other in reversed(self.entries.items()):
+                if other_key[:3] == size and \
+                        ImageChops.difference(thumbnails[1], other[0][1]).getextrema()[1] <= self.tolerance + 1 and \
+                        ImageChops.difference(thumbnails[0], other[0][0]).getextrema()[1] <= self.tolerance:
+                    key, entry = other_key, other
+                    break
+        if entry is None:
+            return (key, thumbnails), None
+        self.entries.move_to_end(key)
+        return (key, thumbnails), entry[1]
+
+    def add(self, key, result):
+        """Сохраняет результат страницы под ключом из lookup"""
+        key, thumbnails = key
+        self.entries[key] = (thumbnails, result)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class ConversionCancelled(Exception):
+    """Конвертация отменена через ConversionProgress.cancel"""
+
+
+class ProgressEvent:
+    """
+    Событие прогресса конвертации
+    
+    page - номер обрабатываемой страницы с 1, page_seconds - время обработки
+    предыдущей страницы, eta - оценка оставшегося времени по среднему
+    времени страницы, elapsed - время с начала конвертации (секунды).
+    final отмечает последнее событие: завершение, ошибку или отмену, error -
+    текст ошибки, если конвертация не удалась.
+    """
+    
+    def __init__(self, value, message, page=None, total_pages=None, page_seconds=None, elapsed=0.0,
+                 eta=None, final=False, error=None):
+        self.value = value
+        self.message = message
+        self.page = page
+        self.total_pages = total_pages
+        self.page_seconds = page_seconds
+        self.elapsed = elapsed
+        self.eta = eta
+        self.final = final
+        self.error = error
+
+    def __repr__(self):
+        return (f"ProgressEvent(value={self.value:.1f}, message={self.message!r}, page={self.page}, "
+                f"total_pages={self.total_pages}, eta={self.eta}, final={self.final})")
+
+
+class ConversionProgress:
+    """
+    Прогресс и отмена конвертации, безопасные для разных потоков
+    
+    Конвертер (convert_pdf_to_bw(..., progress=...)) передает события через
+    report, а ConversionProgress добавляет к ним время страниц и оценку
+    оставшегося времени и кладет в очередь не чаще max_rate раз в секунду:
+    промежуточное событие, пришедшее раньше, заменяется следующим, итоговые
+    передаются всегда. Интерфейс забирает события через poll в своем
+    потоке, например по таймеру Tk; listener, если задан, вызывается для
+    каждого события из очереди в потоке конвертации.
+    
+    cancel можно вызвать из любого потока. Конвертер проверяет отмену между
+    страницами, закрывает документы, удаляет частичный результат и
+    возвращает False.
+    """
+    
+    def __init__(self, max_rate=10, listener=None):
+        self.interval = 1 / max_rate if max_rate else 0.0
+        self.listener = listener
+        self.events = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.lock = threading.Lock()
+        self.latest = None
+        self.last_put = None
+        self.started = time.perf_counter()
+        self.page_started = None
+        self.page_times = []
+        self.final_event = None
+
+    def cancel(self):
+        """Запрашивает отмену конвертации"""
+        self.cancel_event.set()
+
+    @property
+    def cancelled(self):
+        """True, если запрошена отмена"""
+        return self.cancel_event.is_set()
+
+    def check(self):
+        """Вызывает ConversionCancelled, если запрошена отмена"""
+        if self.cancel_event.is_set():
+            raise ConversionCancelled()
+
+    def report(self, value, message, page=None, total_pages=None, final=False, error=None):
+        """
+        Добавляет событие (вызывается конвертером)
+        
+        Вызов с номером страницы или итоговый завершает отсчет времени
+        предыдущей страницы. Итоговое событие также сохраняется в final_event.
+        """
+        now = time.perf_counter()
+        page_seconds = None
+        if (page is not None or final) and self.page_started is not None:
+            page_seconds = now - self.page_started
+            self.page_times.append(page_seconds)
+            self.page_started = None
+        if page is not None:
+            self.page_started = now
+        
+        eta = None
+        if page is not None and total_pages and self.page_times:
+            average = sum(self.page_times) / len(self.page_times)
+            eta = average * (total_pages - page + 1)
+        
+        event = ProgressEvent(value, message, page, total_pages, page_seconds, now - self.started, eta, final, error)
+        if final:
+            self.final_event = event
+        with self.lock:
+            if not final and self.last_put is not None and now - self.last_put < self.interval:
+                self.latest = event
+                return
+            self.latest = None
+            self.last_put = now
+            self.events.put(event)
+        if self.listener:
+            self.listener(event)
+
+    def poll(self):
+        """Возвращает накопленные события без ожидания, включая последнее отложенное"""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        with self.lock:
+            if self.latest is not None:
+                events.append(self.latest)
+                self.latest = None
+        return events
+
+
+def current_rss():
+    """Резидентная память процесса в байтах (без /proc - пиковая) или None"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+# Пустой интервал этапа, когда замеры выключены
+_NO_SPAN = nullcontext()
+
+
+class Instrumentation:
+    """
+    Замеры этапов конвертации: интервалы, счетчики и пиковая память
+    
+    Конвертер (set_instrumentation) отмечает интервалы этапов: open,
+    cache_lookup, fingerprint, grayscale_check, rewrite, budget, render
+    (page.get_pixmap), decode (pixmap в PIL), enhance, encode, cache_read,
+    insert, copy, reuse, save, а также convert для конвертации целиком. Интервал - словарь
+    {"stage", "page", "start", "seconds", "rss"}: page - номер страницы с 0
+    или None, start - время начала по time.time, rss - память процесса после
+    этапа в байтах. Для каждого этапа копятся число интервалов, суммарное и
+    наибольшее время и пиковая память, для документа - счетчики страниц,
+    байтов и пикселей (count).
+    
+    listener вызывается для каждого интервала, в том числе полученного из
+    процессов рендеринга (см. merge), например JsonLinesExporter. Без
+    set_instrumentation конвертер использует общий пустой контекст и
+    замеры не стоят ничего, кроме проверки атрибута.
+    """
+    
+    def __init__(self, listener=None, keep_spans=True, sample_memory=True):
+        """
+        Args:
+            listener: функция, вызываемая с каждым интервалом
+            keep_spans: хранить интервалы в spans (иначе только суммы по этапам)
+            sample_memory: замерять память процесса после каждого интервала
+        """
+        self.listener = listener
+        self.keep_spans = keep_spans
+        self.sample_memory = sample_memory
+        self.reset()
+
+    def reset(self):
+        """Удаляет накопленные замеры"""
+        self.spans = []
+        self.stages = {}
+        self.counters = {}
+        self.errors = []
+
+    @contextmanager
+    def span(self, stage, page=None):
+        """Контекст, время выполнения которого учитывается как этап stage"""
+        start_time = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            rss = current_rss() if self.sample_memory else None
+            self.add_span({"stage": stage, "page": page, "start": start_time, "seconds": seconds, "rss": rss})
+
+    def add_span(self, span):
+        """Учитывает готовый интервал"""
+        self._add_totals(span["stage"], 1, span["seconds"], span["seconds"], span["rss"])
+        if self.keep_spans:
+            self.spans.append(span)
+        if self.listener:
+            self.listener(span)
+
+    def _add_totals(self, stage, count, seconds, max_seconds, peak_rss):
+        totals = self.stages.get(stage)
+        if totals is None:
+            totals = self.stages[stage] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "peak_rss": None}
+        totals["count"] += count
+        totals["seconds"] += seconds
+        totals["max_seconds"] = max(totals["max_seconds"], max_seconds)
+        if peak_rss is not None:
+            totals["peak_rss"] = max(totals["peak_rss"] or 0, peak_rss)
+
+    def count(self, name, value=1):
+        """Увеличивает счетчик name"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def error(self, message):
+        """Учитывает неудачную конвертацию"""
+        self.count("conversions_failed")
+        self.errors.append(message)
+
+    @property
+    def peak_rss(self):
+        """Пиковая память по всем этапам в байтах или None"""
+        peaks = [totals["peak_rss"] for totals in self.stages.values() if totals["peak_rss"] is not None]
+        return max(peaks) if peaks else None
+
+    def as_dict(self, spans=True):
+        """Замеры в виде словаря для JSON и передачи между процессами (см. merge)"""
+        data = {
+            "stages": {stage: dict(totals) for stage, totals in self.stages.items()},
+            "counters": dict(self.counters),
+            "errors": list(self.errors),
+        }
+        if spans:
+            data["spans"] = list(self.spans)
+        return data
+
+    def merge(self, data):
+        """
+        Добавляет замеры из as_dict другого объекта, например процесса рендеринга
+        
+        Интервалы передаются listener; если их нет, суммы этапов
+        складываются без них.
+        """
+        if data.get("spans"):
+            for span in data["spans"]:
+                self.add_span(span)
+        else:
+            for stage, totals in data["stages"].items():
+                self._add_totals(stage, totals["count"], totals["seconds"], totals["max_seconds"], totals["peak_rss"])
+        for name, value in data["counters"].items():
+            self.count(name, value)
+        self.errors.extend(data["errors"])
+
+
+class JsonLinesExporter:
+    """
+    Экспорт замеров в JSON lines: listener для Instrumentation
+    
+    Каждый интервал записывается строкой {"type": "span", ...} сразу по
+    окончании, finish дописывает строку {"type": "summary", ...} с суммами
+    этапов и счетчиками. extra добавляется в каждую строку, например имя
+    входного файла.
+    """
+    
+    def __init__(self, output, **extra):
+        """
+        Args:
+            output: путь к файлу (дописывается) или открытый текстовый файл
+        """
+        self.own_file = isinstance(output, str)
+        self.file = open(output, "a", encoding="utf-8") if self.own_file else output
+        self.extra = extra
+
+    def __call__(self, span):
+        self.write(dict(self.extra, type="span", **span))
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def finish(self, instrumentation):
+        """Записывает итоговую строку и закрывает собственный файл"""
+        self.write(dict(self.extra, type="summary", **instrumentation.as_dict(spans=False)))
+        if self.own_file:
+            self.file.close()
+        else:
+            self.file.flush()
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+               for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def prometheus_text(instrumentation, prefix="pdf_bw", labels=None):
+    """
+    Замеры в текстовом формате Prometheus
+    
+    Для этапов выводятся pdf_bw_stage_seconds_total, pdf_bw_stage_spans_total,
+    pdf_bw_stage_max_seconds и pdf_bw_stage_peak_rss_bytes с меткой stage,
+    каждый счетчик - как pdf_bw_<имя>_total.
+    
+    Args:
+        labels: метки, добавляемые ко всем значениям
+    """
+    labels = dict(labels or {})
+    metrics = [
+        ("stage_seconds_total", "counter", "Суммарное время этапа конвертации, секунды", "seconds"),
+        ("stage_spans_total", "counter", "Число выполнений этапа конвертации", "count"),
+        ("stage_max_seconds", "gauge", "Наибольшее время одного выполнения этапа, секунды", "max_seconds"),
+        ("stage_peak_rss_bytes", "gauge", "Пиковая память процесса на этапе, байты", "peak_rss"),
+    ]
+    lines = []
+    for name, kind, description, key in metrics:
+        lines.append(f"# HELP {prefix}_{name} {description}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        for stage, totals in sorted(instrumentation.stages.items()):
+            if totals[key] is not None:
+                lines.append(f"{prefix}_{name}{_prometheus_labels(dict(labels, stage=stage))} {totals[key]}")
+    for name, value in sorted(instrumentation.counters.items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total{_prometheus_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class ConversionSummary:
+    """Итоги конвертации: сколько страниц скопировано, перезаписано и отрендерено"""
+    
+    def __init__(self, total_pages):
+        self.total_pages = total_pages
+        self.copied_pages = 0
+        self.rewritten_pages = 0
+        self.rendered_pages = 0
+        self.file_copied = False
+        # Кодек каждой отрендеренной страницы: номер страницы -> (кодек, байт)
+        self.page_codecs = {}
+        # Качество JPEG отрендеренных страниц: номер страницы -> качество
+        self.page_qualities = {}
+        # Уложился ли результат в max_output_bytes (None - ограничения нет)
+        self.target_met = None
+        # Результат взят из кэша целиком; число страниц, взятых из кэша страниц
+        self.from_cache = False
+        self.cached_pages = 0
+        # Страниц, перенесенных из прежнего результата (set_incremental)
+        self.reused_pages = 0
+        # Отрендеренных страниц, взятых из журнала прерванной конвертации (set_journal)
+        self.resumed_pages = 0
+        # Отрендеренных страниц, целиком ссылающихся на уже встроенные
+        # изображения, и байт, которые не пришлось встраивать (set_deduplication)
+        self.duplicate_pages = 0
+        self.dedup_bytes = 0
+
+    def add_manifest_entry(self, page_num, entry):
+        """Учитывает кодек и качество страницы, перенесенной из прежнего результата по манифесту"""
+        if entry["path"] == "render":
+            self.page_codecs[page_num] = (entry["codec"], entry["bytes"])
+            if entry["quality"] is not None:
+                self.page_qualities[page_num] = entry["quality"]
+
+    def dedup_ratio(self):
+        """Доля байт изображений отрендеренных страниц, взятых из уже встроенных"""
+        total = sum(size for _, size in self.page_codecs.values())
+        return self.dedup_bytes / total if total else 0.0
+
+    def codec_totals(self):
+        """Число страниц и объем по кодекам: {кодек: [страниц, байт]}"""
+        totals = {}
+        for codec, size in self.page_codecs.values():
+            total = totals.setdefault(codec, [0, 0])
+            total[0] += 1
+            total[1] += size
+        return totals
+
+    def as_dict(self):
+        """Итоги в виде словаря для сохранения в JSON"""
+        data = dict(vars(self))
+        data["page_codecs"] = {str(page_num): list(codec) for page_num, codec in self.page_codecs.items()}
+        data["page_qualities"] = {str(page_num): quality for page_num, quality in self.page_qualities.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Восстанавливает итоги, сохраненные через as_dict"""
+        summary = cls(data["total_pages"])
+        for name, value in data.items():
+            setattr(summary, name, value)
+        summary.page_codecs = {int(page_num): tuple(codec) for page_num, codec in data["page_codecs"].items()}
+        summary.page_qualities = {int(page_num): quality for page_num, quality in data["page_qualities"].items()}
+        return summary
+
+    def __repr__(self):
+        return (f"ConversionSummary(total_pages={self.total_pages}, copied_pages={self.copied_pages}, "
+                f"rewritten_pages={self.rewritten_pages}, rendered_pages={self.rendered_pages}, "
+                f"file_copied={self.file_copied})")
+
+
+# Версия формата кэша результатов: увеличивается при изменении конвертации,
+# чтобы старые записи не использовались
+_CACHE_VERSION = 1
+
+# Версия формата манифеста инкрементальной конвертации
+_MANIFEST_VERSION = 1
+
+# Версия формата журнала конвертации (set_journal)
+_JOURNAL_VERSION = 1
+
+# Настройки, которые можно переопределить для отдельных страниц (set_page_overrides)
+PAGE_SETTINGS = (
+    "brightness", "contrast", "sharpness", "quality", "black_point", "white_point", "gamma",
+    "output_size", "preserve_orientation", "dpi", "output_format", "binarization",
+)
+
+
+def manifest_path_for(output_path):
+    """Путь манифеста инкрементальной конвертации для результата output_path"""
+    return output_path + ".manifest.json"
+
+
+def _file_signature(path):
+    """Время изменения и размер файла для проверки, что его не подменили"""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _write_atomic(path, data):
+    """
+    Атомарная запись: временный файл процесса и os.replace
+    
+    Файл виден целиком или не виден совсем, даже если процесс завершится
+    посреди записи. Возвращает False при ошибке записи.
+    """
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as output_file:
+            output_file.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+# Заголовок сохраненной страницы: ширина, высота и качество JPEG (-1 - нет)
+_PAGE_HEADER = struct.Struct("<ddi")
+
+
+def _pack_page_result(result):
+    """Результат _render_page в виде байтов для кэша страниц и журнала"""
+    width, height, image_data, quality = result
+    return _PAGE_HEADER.pack(width, height, -1 if quality is None else quality) + image_data
+
+
+def _unpack_page_result(data):
+    """Восстанавливает результат _render_page, сохраненный через _pack_page_result"""
+    width, height, quality = _PAGE_HEADER.unpack_from(data)
+    return width, height, data[_PAGE_HEADER.size:], None if quality < 0 else quality
+
+
+class ResultCache:
+    """
+    Кэш результатов конвертации на диске с адресацией по содержимому
+    
+    Документы хранятся под ключом из хэша входного файла и настроек
+    (document_key), отрендеренные страницы - под ключом из хэша содержимого
+    страницы и настроек (page_key), так что повторно присланные и похожие
+    документы используют общие страницы. Записи пишутся во временный файл и
+    переименовываются через os.replace, поэтому кэш можно использовать из
+    нескольких процессов одновременно: запись видна целиком или не видна
+    совсем. При попадании время изменения записи обновляется, и при
+    превышении max_size удаляются давно не использованные записи.
+    
+    Счетчики hits/misses считают документы, page_hits/page_misses - страницы
+    (промах страницы - отрендеренная и сохраненная страница) в этом процессе.
+    """
+    
+    def __init__(self, directory, max_size=1024):
+        """
+        Args:
+            directory: папка кэша (создается при необходимости)
+            max_size: наибольший объем кэша, МБ
+        """
+        self.directory = directory
+        self.max_bytes = max_size * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.page_hits = 0
+        self.page_misses = 0
+        self.added_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def settings_key(settings):
+        """Строка настроек для ключей: настройки, версия кэша, MuPDF и Pillow"""
+        settings = dict(settings, cache_version=_CACHE_VERSION, mupdf=fitz.VersionBind, pillow=Image.__version__)
+        # Ограничение памяти и инкрементальный режим влияют только на способ записи результата
+        settings.pop("memory_limit", None)
+        settings.pop("incremental", None)
+        # Повторы без допуска встраиваются один раз, но выглядят так же
+        settings.pop("deduplicate", None)
+        return json.dumps(settings, sort_keys=True)
+
+    @classmethod
+    def settings_digest(cls, settings):
+        """Хэш строки настроек (settings_key) для манифестов и проверки актуальности"""
+        return hashlib.sha256(cls.settings_key(settings).encode()).hexdigest()
+
+    @classmethod
+    def document_key(cls, input_path, settings):
+        """Ключ документа: хэш содержимого файла и настроек"""
+        digest = hashlib.sha256(cls.settings_key(settings).encode())
+        with open(input_path, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def page_key(self, fingerprint, settings, max_bytes=None):
+        """Ключ страницы: хэш содержимого (page_fingerprint), настроек и ограничения размера"""
+        text = f"{fingerprint}\n{self.settings_key(settings)}\n{max_bytes}"
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def _write(self, path, data):
+        """
+        Атомарная запись (_write_atomic) с учетом добавленного объема
+        
+        Ошибки записи (например, нет места) не прерывают конвертацию: запись
+        просто не попадает в кэш.
+        """
+        if not _write_atomic(path, data):
+            return False
+        self.added_bytes += len(data)
+        return True
+
+    def get_document(self, key, output_path):
+        """
+        Копирует сохраненный результат в output_path
+        
+        Returns:
+            ConversionSummary или None, если записи нет
+        """
+        pdf_path = self._path(key, ".pdf")
+        meta_path = self._path(key, ".json")
+        try:
+            with open(meta_path, encoding="utf-8") as meta_file:
+                summary = ConversionSummary.from_dict(json.load(meta_file))
+            temp_path = f"{output_path}.{os.getpid()}.tmp"
+            shutil.copyfile(pdf_path, temp_path)
+            os.replace(temp_path, output_path)
+            os.utime(pdf_path)
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        summary.from_cache = True
+        return summary
+
+    def put_document(self, key, output_path, summary):
+        """Сохраняет результат конвертации и его итоги"""
+        with open(output_path, "rb") as output_file:
+            data = output_file.read()
+        # Итоги пишутся первыми: запись документа видна только вместе с ними
+        if self._write(self._path(key, ".json"), json.dumps(summary.as_dict()).encode("utf-8")):
+            self._write(self._path(key, ".pdf"), data)
+        self.evict()
+
+    def has_page(self, key):
+        """Проверяет наличие страницы без загрузки"""
+        return os.path.exists(self._path(key, ".page"))
+
+    def get_page(self, key):
+        """Возвращает результат рендеринга страницы (ширина, высота, данные, качество) или None"""
+        path = self._path(key, ".page")
+        try:
+            with open(path, "rb") as page_file:
+                data = page_file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        self.page_hits += 1
+        return _unpack_page_result(data)
+
+    def put_page(self, key, result):
+        """Сохраняет результат рендеринга страницы"""
+        self._write(self._path(key, ".page"), _pack_page_result(result))
+        self.page_misses += 1
+        # Каталог просматривается не после каждой страницы, а по мере роста
+        if self.added_bytes >= self.max_bytes // 16:
+            self.evict()
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока объем кэша больше max_size"""
+        self.added_bytes = 0
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, entry.path, stat.st_size))
+            total += stat.st_size
+        
+        entries.sort()
+        for _, path, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        """Статистика: попадания и промахи этого процесса, число записей и объем кэша"""
+        entries = [entry for entry in os.scandir(self.directory) if not entry.name.endswith(".tmp")]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "page_hits": self.page_hits,
+            "page_misses": self.page_misses,
+            "entries": len(entries),
+            "bytes": sum(entry.stat().st_size for entry in entries),
+        }
+
+
+class ConversionJournal:
+    """
+    Журнал конвертации для продолжения после сбоя (set_journal)
+    
+    Журнал документа ведется в отдельной папке, названной по ключу входного
+    файла и настроек (ResultCache.document_key). В journal.json записаны
+    ключ и число страниц, а каждая отрендеренная страница сохраняется сразу
+    после рендеринга в файл <номер>.page в формате кэша страниц. Записи
+    атомарные, поэтому после аварийного завершения процесса в журнале
+    остаются только целые страницы, и повторная конвертация того же файла с
+    теми же настройками рендерит лишь недостающие. Измененный файл или
+    другие настройки дают другой ключ, так что чужие страницы не берутся.
+    
+    page_hits - страниц, взятых из журнала, page_misses - записанных в него.
+    """
+    
+    def __init__(self, directory, input_path, settings, total_pages):
+        """
+        Args:
+            directory: папка журналов (создается при необходимости)
+            input_path: входной PDF
+            settings: настройки конвертации (get_settings)
+            total_pages: число страниц документа
+        """
+        self.key = ResultCache.document_key(input_path, settings)
+        self.directory = os.path.join(directory, self.key)
+        self.page_hits = 0
+        self.page_misses = 0
+        
+        manifest = {"version": _JOURNAL_VERSION, "key": self.key, "pages": total_pages}
+        manifest_path = os.path.join(self.directory, "journal.json")
+        try:
+            with open(manifest_path, encoding="utf-8") as manifest_file:
+                valid = json.load(manifest_file) == manifest
+        except (OSError, ValueError):
+            valid = False
+        if not valid:
+            # Журнал другой версии или без манифеста начинается заново
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+            if not _write_atomic(manifest_path, json.dumps(manifest).encode("utf-8")):
+                raise OSError(f"не удалось создать журнал {manifest_path}")
+
+    @staticmethod
+    def page_key(page_num, max_bytes=None):
+        """Ключ страницы: номер и ограничение размера, с которым она рендерилась"""
+        return str(page_num) if max_bytes is None else f"{page_num}-{max_bytes}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".page")
+
+    def has_page(self, key):
+        """Проверяет наличие страницы без загрузки"""
+        return os.path.exists(self._path(key))
+
+    def get_page(self, key):
+        """Возвращает результат рендеринга страницы или None"""
+        try:
+            with open(self._path(key), "rb") as page_file:
+                data = page_file.read()
+        except OSError:
+            return None
+        self.page_hits += 1
+        return _unpack_page_result(data)
+
+    def put_page(self, key, result):
+        """Сохраняет результат рендеринга страницы; ошибка записи не прерывает конвертацию"""
+        if _write_atomic(self._path(key), _pack_page_result(result)):
+            self.page_misses += 1
+
+    def remove(self):
+        """Удаляет журнал после успешного сохранения результата"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
 
 class PDFToBWConverter:
     """Класс для конвертации PDF в черно-белый формат"""
@@ -19,6 +1878,32 @@ class PDFToBWConverter:
         self.sharpness = 1.0
         self.quality = 75
         self.preserve_orientation = True
+        self.workers = 1
+        self.pass_through = True
+        self.engine = "raster"
+        self.memory_limit = None
+        self.black_point = 0
+        self.white_point = 255
+        self.gamma = 1.0
+        self.resolution_policy = "fixed"
+        self.dpi = 144
+        self.min_dpi = 72
+        self.max_dpi = 300
+        self.output_format = "jpeg"
+        self.binarization = "otsu"
+        self.max_output_bytes = None
+        self.min_psnr = None
+        self.cache = None
+        self.cache_pages = True
+        self.journal_dir = None
+        self.page_overrides = []
+        self.incremental = False
+        self.tile_memory = None
+        self.deduplicate = True
+        self.dedup_tolerance = 0
+        self.color_management = False
+        self.page_images = None
+        self.instrumentation = None
 
     def set_output_size(self, size="original", preserve_orientation=True):
         """Установка размера выходной страницы"""
@@ -42,51 +1927,536 @@ class PDFToBWConverter:
         else:
             return False
 
-    def set_image_settings(self, brightness=1.0, contrast=1.0, sharpness=1.0, quality=75):
-        """Настройка параметров изображения"""
-        self.brightness = max(0.1, min(3.0, brightness))
-        self.contrast = max(0.1, min(3.0, contrast))
-        self.sharpness = max(0.1, min(3.0, sharpness))
-        self.quality = max(10, min(100, quality))
+    def set_image_settings(self, brightness=1.0, contrast=1.0, sharpness=1.0, quality=75):
+        """Настройка параметров изображения"""
+        self.brightness = max(0.1, min(3.0, brightness))
+        self.contrast = max(0.1, min(3.0, contrast))
+        self.sharpness = max(0.1, min(3.0, sharpness))
+        self.quality = max(10, min(100, quality))
+
+    def set_levels(self, black_point=0, white_point=255, gamma=1.0):
+        """
+        Настройка уровней: точки черного и белого и гамма средних тонов
+        
+        Значения ниже black_point становятся черными, выше white_point -
+        белыми; gamma > 1 осветляет средние тона.
+        """
+        self.black_point = max(0, min(254, int(black_point)))
+        self.white_point = max(self.black_point + 1, min(255, int(white_point)))
+        self.gamma = max(0.1, min(10.0, gamma))
+
+    def set_workers(self, workers=1):
+        """
+        Настройка количества процессов для конвертации
+        
+        Args:
+            workers: количество процессов (None или 0 - по числу ядер)
+        """
+        if not workers:
+            workers = os.cpu_count() or 1
+        self.workers = max(1, int(workers))
+
+    def set_pass_through(self, enabled=True):
+        """
+        Включение копирования черно-белых страниц без рендеринга
+        
+        Args:
+            enabled: если False, рендерятся все страницы цветного документа
+        """
+        self.pass_through = bool(enabled)
+
+    def set_engine(self, engine="raster"):
+        """
+        Выбор способа конвертации цветных страниц
+        
+        Args:
+            engine: "raster" - рендеринг страницы в JPEG, "vector" - перезапись
+                операторов цвета и изображений в оттенки серого с сохранением
+                векторов и шрифтов (см. rewrite_page_colors)
+        
+        Returns:
+            bool: True если способ поддерживается
+        """
+        if engine not in ("raster", "vector"):
+            return False
+        self.engine = engine
+        return True
+
+    def set_resolution(self, policy="fixed", dpi=144, min_dpi=72, max_dpi=300):
+        """
+        Настройка разрешения рендеринга страниц
+        
+        Разрешение задается относительно выходной страницы; 144 dpi
+        соответствуют прежнему масштабу 2.0.
+        
+        Args:
+            policy: "fixed" - всегда dpi, "native" - разрешение основного
+                изображения страницы (см. get_render_dpi)
+            dpi: разрешение для "fixed" и для страниц без сканов в "native"
+            min_dpi, max_dpi: границы разрешения для "native"
+        
+        Returns:
+            bool: True если политика поддерживается
+        """
+        if policy not in ("fixed", "native"):
+            return False
+        self.resolution_policy = policy
+        self.min_dpi = max(18, min(600, min_dpi))
+        self.max_dpi = max(self.min_dpi, min(1200, max_dpi))
+        self.dpi = max(18, min(1200, dpi))
+        return True
+
+    def set_output_format(self, output_format="jpeg", binarization="otsu"):
+        """
+        Выбор формата отрендеренных страниц
+        
+        Args:
+            output_format: "jpeg" - оттенки серого в JPEG с качеством quality,
+                "bilevel" - однобитное изображение без потерь (CCITT Group 4,
+                см. encode_bilevel); для текстовых документов в разы меньше,
+                "auto" - выбор для каждой страницы по ее содержимому
+                (см. encode_page_image)
+            binarization: способ перевода в однобитное для "bilevel":
+                "otsu", "adaptive" или "dither" (см. binarize)
+        
+        Returns:
+            bool: True если формат и способ поддерживаются
+        """
+        if output_format not in ("jpeg", "bilevel", "auto") or binarization not in ("otsu", "adaptive", "dither"):
+            return False
+        self.output_format = output_format
+        self.binarization = binarization
+        return True
+
+    def set_quality_target(self, max_bytes=None, min_psnr=None):
+        """
+        Подбор качества JPEG под размер файла или под качество изображения
+        
+        Качество каждой страницы ищется двоичным поиском между 10 и quality
+        по уже отрендеренному изображению (см. search_jpeg_quality).
+        
+        Args:
+            max_bytes: наибольший размер выходного файла; бюджет делится между
+                страницами через allocate_page_budgets
+            min_psnr: наименьший PSNR (дБ) относительно отрендеренной страницы;
+                выбирается самое низкое качество, которое его обеспечивает
+        """
+        self.max_output_bytes = max(1, int(max_bytes)) if max_bytes else None
+        self.min_psnr = float(min_psnr) if min_psnr else None
+
+    def set_memory_limit(self, megabytes=None):
+        """
+        Ограничение памяти под выходной документ
+        
+        Args:
+            megabytes: объем в МБ, после которого готовые страницы дописываются
+                на диск (None - документ целиком собирается в памяти); допустимы
+                дробные значения не меньше 1 КБ
+        """
+        self.memory_limit = max(1 / 1024, float(megabytes)) if megabytes else None
+
+    def set_tiling(self, megabytes=None):
+        """
+        Рендеринг больших страниц полосами
+        
+        Страница, изображение которой вместе с промежуточными копиями не
+        помещается в megabytes, рендерится горизонтальными полосами через
+        get_pixmap(clip=...). Каждая полоса улучшается и кодируется отдельно
+        и вставляется на страницу своим изображением (pack_tiles), поэтому
+        память на страницу ограничена бюджетом полосы при любом размере
+        страницы. Контрастность, кодек и порог Оцу берутся из общей
+        гистограммы уменьшенной копии страницы, чтобы полосы не отличались
+        по тону.
+        
+        Args:
+            megabytes: бюджет памяти на полосу в МБ (None - страницы рендерятся целиком)
+        """
+        self.tile_memory = max(1, int(megabytes)) if megabytes else None
+
+    def set_deduplication(self, enabled=True, tolerance=0):
+        """
+        Повторяющиеся страницы и изображения в результате
+        
+        Изображение страницы или полосы с теми же данными, что уже встроенное
+        в результат, не встраивается заново: страница ссылается на прежний
+        объект. Кроме того, страница, пиксели которой после рендеринга
+        совпадают с одной из недавних страниц (см. PageImageIndex), берет ее
+        готовый результат без улучшения и кодирования. При tolerance > 0
+        совпадением считается и отличие уменьшенной копии страницы не больше
+        чем на tolerance уровней серого (повторные сканы одного бланка).
+        Страницы с переопределенными настройками (set_page_overrides) и
+        рендеринг полосами сравниваются только по данным изображений.
+        
+        Args:
+            enabled: искать повторы (по умолчанию включено: без допуска
+                результат выглядит так же)
+            tolerance: допуск в уровнях серого, 0 - только точные повторы
+        """
+        self.deduplicate = enabled
+        self.dedup_tolerance = tolerance
+
+    def set_color_management(self, enabled=False):
+        """
+        Цветовое управление (ICC) при рендеринге страниц
+        
+        По умолчанию ICC отключается на время рендеринга конвертера
+        (_without_icc): это почти вдвое быстрее, но цвета с профилями ICC и
+        CMYK переводятся в серый приближенно. С enabled рендеринг учитывает
+        профили, и яркость цветных областей точнее передается в серый.
+        """
+        self.color_management = enabled
+
+    def _render_scope(self):
+        """Контекст рендеринга страниц с учетом set_color_management"""
+        return nullcontext() if self.color_management else _without_icc()
+
+    def _new_page_index(self):
+        """Пустой PageImageIndex для новой конвертации или None, если повторы не ищутся"""
+        return PageImageIndex(self.dedup_tolerance) if self.deduplicate else None
+
+    def set_page_overrides(self, overrides=None):
+        """
+        Настройки для отдельных диапазонов страниц
+        
+        Страницы с переопределенными настройками всегда рендерятся, даже если
+        они черно-белые или могли бы быть переведены векторно. Для страницы
+        из нескольких диапазонов настройки объединяются по порядку.
+        
+        Значения проверяются и ограничиваются теми же методами, что и общие
+        настройки (set_image_settings, set_levels, set_output_size,
+        set_resolution, set_output_format), и сохраняются уже ограниченными.
+        
+        Args:
+            overrides: список (первая, последняя, настройки) с номерами страниц
+                с 0 включительно; настройки - словарь с ключами из
+                PAGE_SETTINGS, например {"contrast": 1.4}
+        
+        Returns:
+            bool: True если диапазоны и настройки допустимы; иначе
+                переопределения не меняются
+        """
+        normalized = []
+        for first, last, settings in overrides or []:
+            if first < 0 or last < first or not set(settings) <= set(PAGE_SETTINGS):
+                return False
+            settings = self._checked_page_settings(settings)
+            if settings is None:
+                return False
+            normalized.append((first, last, settings))
+        self.page_overrides = normalized
+        return True
+
+    def _checked_page_settings(self, settings):
+        """
+        Переопределение, пропущенное через методы настройки
+        
+        Returns:
+            dict: значения после ограничения или None, если значение недопустимо
+        """
+        converter = PDFToBWConverter()
+        converter.apply_settings(self.get_settings())
+        converter.apply_settings(settings)
+        try:
+            converter.set_image_settings(converter.brightness, converter.contrast, converter.sharpness,
+                                         converter.quality)
+            converter.set_levels(converter.black_point, converter.white_point, converter.gamma)
+            valid = (
+                converter.set_output_size(converter.output_size, converter.preserve_orientation)
+                and converter.set_resolution(converter.resolution_policy, converter.dpi, converter.min_dpi,
+                                             converter.max_dpi)
+                and converter.set_output_format(converter.output_format, converter.binarization)
+            )
+        except (TypeError, ValueError):
+            return None
+        if not valid:
+            return None
+        return {name: getattr(converter, name) for name in settings}
+
+    def page_override(self, page_num):
+        """Объединенные переопределения настроек страницы page_num (пустой словарь, если их нет)"""
+        override = {}
+        for first, last, settings in self.page_overrides:
+            if first <= page_num <= last:
+                override.update(settings)
+        return override
+
+    def page_settings(self, page_num):
+        """Действующие настройки страницы page_num с учетом переопределений"""
+        settings = self.get_settings()
+        del settings["page_overrides"]
+        override = self.page_override(page_num)
+        settings.update(override)
+        settings["page_override"] = override
+        return settings
+
+    def page_converter(self, page_num):
+        """Конвертер с настройками страницы page_num (сам конвертер, если переопределений нет)"""
+        override = self.page_override(page_num)
+        if not override:
+            return self
+        converter = PDFToBWConverter()
+        converter.apply_settings(self.get_settings())
+        converter.apply_settings(override)
+        converter.page_overrides = []
+        converter.instrumentation = self.instrumentation
+        return converter
+
+    def set_incremental(self, enabled=True):
+        """
+        Инкрементальная повторная конвертация
+        
+        Рядом с результатом сохраняется манифест (manifest_path_for) с хэшем
+        содержимого и настроек каждой страницы. Повторная конвертация в тот же
+        файл заново обрабатывает только страницы, у которых изменились
+        содержимое или действующие настройки (в том числе из
+        set_page_overrides), а остальные переносятся из прежнего результата.
+        При подборе качества под размер файла (set_quality_target) бюджет
+        общий для всех страниц, поэтому документ всегда конвертируется
+        целиком.
+        """
+        self.incremental = enabled
+
+    def set_cache(self, directory=None, max_size=1024, pages=True):
+        """
+        Кэш результатов конвертации на диске (см. ResultCache)
+        
+        Args:
+            directory: папка кэша (None - кэш выключен)
+            max_size: наибольший объем кэша, МБ
+            pages: кэшировать также отдельные отрендеренные страницы
+        """
+        self.cache = ResultCache(directory, max_size) if directory else None
+        self.cache_pages = pages
+
+    def set_journal(self, directory=None):
+        """
+        Журнал конвертации для продолжения после сбоя (см. ConversionJournal)
+        
+        Отрендеренные страницы сохраняются в журнал по мере готовности. Если
+        процесс завершится аварийно или конвертация будет отменена или
+        прервется ошибкой, повторная конвертация того же файла с теми же
+        настройками берет готовые страницы из журнала и рендерит только
+        недостающие. Результат собирается во временном файле и заменяет
+        прежний атомарно, после чего журнал удаляется. Скопированные и
+        перезаписанные страницы в журнал не попадают: они не рендерятся и
+        обрабатываются быстро.
+        
+        Args:
+            directory: папка журналов (None - журнал выключен)
+        """
+        self.journal_dir = directory
+
+    def set_instrumentation(self, instrumentation=None):
+        """
+        Замеры этапов конвертации (см. Instrumentation)
+        
+        Замеры не входят в настройки (get_settings) и не влияют на ключи
+        кэша; процессы рендеринга при workers > 1 ведут собственные замеры
+        и передают их вместе со страницами.
+        
+        Args:
+            instrumentation: Instrumentation или None, чтобы выключить замеры
+        """
+        self.instrumentation = instrumentation
+
+    def _span(self, stage, page=None):
+        """Интервал этапа stage или пустой контекст, если замеры выключены"""
+        if self.instrumentation is None:
+            return _NO_SPAN
+        return self.instrumentation.span(stage, page)
+
+    def get_settings(self):
+        """Возвращает текущие настройки конвертации в виде словаря"""
+        return {
+            "output_size": self.output_size,
+            "preserve_orientation": self.preserve_orientation,
+            "brightness": self.brightness,
+            "contrast": self.contrast,
+            "sharpness": self.sharpness,
+            "quality": self.quality,
+            "black_point": self.black_point,
+            "white_point": self.white_point,
+            "gamma": self.gamma,
+            "pass_through": self.pass_through,
+            "engine": self.engine,
+            "memory_limit": self.memory_limit,
+            "resolution_policy": self.resolution_policy,
+            "dpi": self.dpi,
+            "min_dpi": self.min_dpi,
+            "max_dpi": self.max_dpi,
+            "output_format": self.output_format,
+            "binarization": self.binarization,
+            "max_output_bytes": self.max_output_bytes,
+            "min_psnr": self.min_psnr,
+            "page_overrides": self.page_overrides,
+            "incremental": self.incremental,
+            "tile_memory": self.tile_memory,
+            "deduplicate": self.deduplicate,
+            "dedup_tolerance": self.dedup_tolerance,
+            "color_management": self.color_management,
+        }
+
+    def apply_settings(self, settings):
+        """Применяет настройки, полученные из get_settings"""
+        for name, value in settings.items():
+            setattr(self, name, value)
 
-    def is_already_grayscale(self, image, threshold=0.95):
+    def is_already_grayscale(self, image, threshold=0.95, tolerance=8, max_pixels=250000, band_height=64):
         """
         Проверяет, является ли изображение уже черно-белым
         
+        Пиксель считается серым, если его каналы отличаются не более чем на
+        tolerance (допуск на шум JPEG). Большие изображения прореживаются до
+        max_pixels, разность каналов считается средствами PIL полосами по
+        band_height строк, и проверка прерывается, как только доля цветных
+        пикселей превышает допустимую.
+        
         Args:
             image: PIL Image объект
             threshold: порог для определения черно-белого
+            tolerance: допустимое расхождение каналов для серого пикселя
+            max_pixels: максимальное количество проверяемых пикселей
+            band_height: высота полосы для досрочного выхода
         
         Returns:
             bool: True если изображение уже черно-белое
         """
-        if image.mode == 'L':
+        if image.mode in ('1', 'L', 'LA'):
             return True
         
         if image.mode != 'RGB':
             image = image.convert('RGB')
         
-        pixels = list(image.getdata())
-        sample_pixels = pixels[::10]
+        width, height = image.size
+        step = math.ceil(math.sqrt(width * height / max_pixels))
+        if step > 1:
+            width, height = max(1, width // step), max(1, height // step)
+            image = image.resize((width, height), Image.NEAREST)
+        
+        allowed_colour = width * height * (1 - threshold)
+        colour_count = 0
+        
+        for top in range(0, height, band_height):
+            band = image.crop((0, top, width, min(height, top + band_height)))
+            r, g, b = band.split()
+            spread = ImageChops.lighter(
+                ImageChops.lighter(ImageChops.difference(r, g), ImageChops.difference(g, b)),
+                ImageChops.difference(r, b)
+            )
+            colour_count += sum(spread.histogram()[tolerance + 1:])
+            if colour_count > allowed_colour:
+                return False
+        
+        return True
+
+    def is_page_grayscale(self, page, threshold=0.95):
+        """
+        Проверяет страницу по ее растровому изображению в масштабе 0.5
+        
+        Args:
+            page: страница fitz
+            threshold: порог для определения черно-белого
+        
+        Returns:
+            bool: True если страница черно-белая
+        """
+        zoom = 0.5
+        if self.tile_memory:
+            # Проверка цвета не должна требовать больше памяти, чем полоса рендеринга
+            pixels = page.rect.width * page.rect.height * zoom * zoom
+            zoom *= min(1.0, math.sqrt(self.tile_memory * 1024 * 1024 / 3 / pixels))
+        with self._render_scope():
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        return self.is_already_grayscale(pixmap_to_image(pix), threshold)
+
+    def analyze_page_colors(self, page):
+        """
+        Классифицирует страницу по потокам содержимого без рендеринга
+        
+        Разбираются операторы цвета в содержимом страницы и ее формах,
+        цветовые пространства изображений и именованные пространства
+        ресурсов. Изображения в RGB/CMYK, заливки шейдингом и узорами,
+        аннотации и шрифты Type3 дают "unknown": по ним нельзя судить
+        о цвете без рендеринга.
+        
+        Args:
+            page: страница fitz
+        
+        Returns:
+            str: "gray", "color" или "unknown"
+        """
+        doc = page.parent
+        result = "gray"
+        
+        if page.first_annot or page.first_widget:
+            result = "unknown"
+        if any(font[2] == "Type3" for font in page.get_fonts(full=True)):
+            result = "unknown"
+        
+        for image in page.get_images(full=True):
+            xref = image[0]
+            if doc.xref_get_key(xref, "ImageMask")[1] == "true":
+                continue
+            kind, value = doc.xref_get_key(xref, "ColorSpace")
+            if kind == "null" or _colorspace_kind(doc, kind, value) != "gray":
+                result = "unknown"
+        
+        page_owners = _resource_owners(doc, page.xref)
+        streams = [(page.read_contents(), page_owners, False)]
+        for xobject in page.get_xobjects():
+            streams.append((doc.xref_stream(xobject[0]), [xobject[0]] + page_owners, True))
+        
+        for data, owners, inherited in streams:
+            label = _classify_content_stream(doc, data, owners, inherited)
+            if label == "color":
+                return "color"
+            if label == "unknown":
+                result = "unknown"
+        
+        return result
+
+    def classify_pages(self, doc, threshold=0.95, pages=None):
+        """
+        Классифицирует все страницы документа как черно-белые или цветные
         
-        grayscale_count = 0
-        total_sample = len(sample_pixels)
+        Сначала используется analyze_page_colors, и только страницы с
+        результатом "unknown" проверяются по растровому изображению.
+        
+        Args:
+            doc: документ fitz
+            threshold: порог для определения черно-белого при растровой проверке
+            pages: номера проверяемых страниц (None - все)
         
-        for r, g, b in sample_pixels:
-            if r == g == b:
-                grayscale_count += 1
+        Returns:
+            list: "gray" или "color" для каждой страницы, None для непроверенных
+        """
+        labels = []
+        for page_num, page in enumerate(doc):
+            if pages is not None and page_num not in pages:
+                labels.append(None)
+                continue
+            try:
+                label = self.analyze_page_colors(page)
+            except Exception:
+                label = "unknown"
+            
+            if label == "unknown":
+                label = "gray" if self.is_page_grayscale(page, threshold) else "color"
+            labels.append(label)
         
-        grayscale_ratio = grayscale_count / total_sample
-        return grayscale_ratio >= threshold
+        return labels
 
-    def check_pdf_is_grayscale(self, pdf_path, sample_pages=3, threshold=0.95):
+    def check_pdf_is_grayscale(self, pdf_path, sample_pages=3, threshold=0.95, analysis="content"):
         """
         Проверяет, является ли PDF уже черно-белым
         
         Args:
             pdf_path: путь к PDF файлу
-            sample_pages: количество страниц для проверки
+            sample_pages: количество страниц для проверки в режиме "raster"
             threshold: порог для определения черно-белого
+            analysis: "content" - все страницы по потокам содержимого с
+                растровой проверкой неясных страниц (см. classify_pages),
+                "raster" - растровая проверка выборки страниц
         
         Returns:
             tuple: (is_grayscale, grayscale_pages, total_checked)
@@ -95,6 +2465,12 @@ class PDFToBWConverter:
             doc = fitz.open(pdf_path)
             total_pages = len(doc)
             
+            if analysis == "content":
+                labels = self.classify_pages(doc, threshold)
+                doc.close()
+                grayscale_pages = labels.count("gray")
+                return grayscale_pages == len(labels), grayscale_pages, len(labels)
+            
             if sample_pages == 0 or sample_pages >= total_pages:
                 pages_to_check = range(total_pages)
             else:
@@ -113,15 +2489,8 @@ class PDFToBWConverter:
             for page_num in pages_to_check:
                 if page_num >= total_pages:
                     continue
-                    
-                page = doc[page_num]
-                mat = fitz.Matrix(0.5, 0.5)
-                pix = page.get_pixmap(matrix=mat)
                 
-                img_data = pix.tobytes("ppm")
-                img = Image.open(io.BytesIO(img_data))
-                
-                if self.is_already_grayscale(img, threshold):
+                if self.is_page_grayscale(doc[page_num], threshold):
                     grayscale_pages += 1
                 
                 checked_pages += 1
@@ -135,24 +2504,12 @@ class PDFToBWConverter:
             print(f"Ошибка при проверке PDF: {e}")
             return False, 0, 0
 
-    def apply_image_enhancements(self, image):
-        """Применение улучшений к изображению"""
-        if image.mode != 'L':
-            image = image.convert('L')
-        
-        if self.brightness != 1.0:
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(self.brightness)
-        
-        if self.contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(self.contrast)
-        
-        if self.sharpness != 1.0:
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(self.sharpness)
-        
-        return image
+    def apply_image_enhancements(self, image, histogram=None):
+        """Применение улучшений к изображению или полосе страницы (см. enhance_grayscale)"""
+        return enhance_grayscale(
+            image, self.brightness, self.contrast, self.sharpness, self.black_point, self.white_point, self.gamma,
+            histogram,
+        )
 
     def get_page_dimensions(self, page):
         """Получение размеров страницы с учетом настроек"""
@@ -188,84 +2545,842 @@ class PDFToBWConverter:
         
         return base_size
 
-    def convert_pdf_to_bw(self, input_pdf_path, output_pdf_path, progress_callback=None):
+    def get_render_dpi(self, page, scale=1.0):
+        """
+        Разрешение рендеринга страницы относительно выходной страницы
+        
+        В политике "native" страница, большую часть которой (от 75%) занимает
+        одно изображение, рендерится с разрешением этого изображения, чтобы
+        скан не пересчитывался в лишние пиксели. На остальных страницах
+        изображения могут только повысить разрешение относительно dpi.
+        Результат ограничивается min_dpi и max_dpi.
+        
+        Args:
+            page: страница fitz
+            scale: наибольший из коэффициентов масштабирования страницы
+                до выходного размера
+        
+        Returns:
+            float: разрешение в точках на дюйм
+        """
+        if self.resolution_policy != "native":
+            return self.dpi
+        
+        page_area = abs(page.rect) or 1
+        scan_dpi = None
+        image_dpi = 0
+        for info in page.get_image_info():
+            a, b, c, d = info["transform"][:4]
+            shown_width, shown_height = math.hypot(a, b), math.hypot(c, d)
+            if not shown_width or not shown_height:
+                continue
+            # Разрешение изображения на выходной странице: пиксели на дюйм показа
+            native = max(info["width"] / shown_width, info["height"] / shown_height) * 72 / scale
+            coverage = abs(fitz.Rect(info["bbox"]) & page.rect) / page_area
+            if coverage >= 0.75:
+                scan_dpi = max(scan_dpi or 0, native)
+            image_dpi = max(image_dpi, native)
+        
+        dpi = scan_dpi if scan_dpi is not None else max(self.dpi, image_dpi)
+        return max(self.min_dpi, min(self.max_dpi, dpi))
+
+    def render_page(self, page):
+        """
+        Рендеринг страницы в черно-белый JPEG или однобитное изображение
+        
+        Страница рендерится сразу в оттенках серого с разрешением из
+        get_render_dpi, сэмплы pixmap оборачиваются в PIL изображение без
+        копирования, а изображение кодируется в память через encode_page_image.
+        
+        Args:
+            page: страница fitz
+        
+        Returns:
+            tuple: (ширина, высота, байты изображения)
+        """
+        return self._render_page(page)[:3]
+
+    def _render_page(self, page, max_bytes=None):
+        """render_page с ограничением размера JPEG; возвращает также выбранное качество"""
+        output_width, output_height = self.get_page_dimensions(page)
+        
+        original_rect = page.rect
+        original_width = original_rect.width
+        original_height = original_rect.height
+        
+        scale_x = output_width / original_width
+        scale_y = output_height / original_height
+        
+        zoom = self.get_render_dpi(page, max(scale_x, scale_y)) / 72
+        mat = fitz.Matrix(zoom * scale_x, zoom * scale_y)
+        if self.tile_memory:
+            bounds = (page.rect * mat).irect
+            if bounds.width * bounds.height * _TILE_BYTES_PER_PIXEL > self.tile_memory * 1024 * 1024:
+                return self._render_tiled(page, mat, output_width, output_height, max_bytes)
+        
+        page_num = page.number
+        with self._span("render", page_num), self._render_scope():
+            pix = page.get_pixmap(matrix=mat, colorspace=fitz.csGRAY)
+        if self.instrumentation is not None:
+            self.instrumentation.count("pixels_processed", pix.width * pix.height)
+        
+        page_images = self.page_images
+        if page_images is not None:
+            with self._span("dedup", page_num):
+                key, result = page_images.lookup(pix, max_bytes)
+            if result is not None:
+                if self.instrumentation is not None:
+                    self.instrumentation.count("encodes_skipped")
+                return output_width, output_height, result[2], result[3]
+        
+        img = bw_img = None
+        try:
+            with self._span("decode", page_num):
+                img = pixmap_to_image(pix)
+            
+            with self._span("enhance", page_num):
+                bw_img = self.apply_image_enhancements(img)
+            
+            with self._span("encode", page_num):
+                image_data, quality = self.encode_page_image(bw_img, max_bytes)
+        except BaseException as e:
+            _release_frames(e)
+            raise
+        finally:
+            # Изображения ссылаются на память pixmap и освобождаются раньше него
+            del img, bw_img
+        
+        result = output_width, output_height, image_data, quality
+        if page_images is not None:
+            page_images.add(key, result)
+        return result
+
+    def _render_tiled(self, page, mat, output_width, output_height, max_bytes=None):
+        """
+        _render_page полосами по бюджету tile_memory (см. set_tiling)
+        
+        Полосы рендерятся с запасом строк для свертки резкости и адаптивного
+        порога, который обрезается после обработки, поэтому на стыках нет
+        швов. Каждая полоса, кроме последней, сохраняется с одной лишней
+        строкой, которую перекрывает следующая: иначе при сглаживании на
+        дробных границах между изображениями видна светлая линия. Бюджет
+        max_bytes делится между полосами по числу строк.
+        """
+        page_num = page.number
+        bounds = page.rect * mat
+        pixel_bounds = bounds.irect
+        width, height = pixel_bounds.width, pixel_bounds.height
+        budget = self.tile_memory * 1024 * 1024
+        
+        # Общая гистограмма страницы по уменьшенной копии в пределах бюджета
+        analysis_pixels = min(_TILE_ANALYSIS_PIXELS, budget / _TILE_BYTES_PER_PIXEL)
+        scale = min(1.0, math.sqrt(analysis_pixels / (width * height)))
+        with self._span("render", page_num), self._render_scope():
+            pix = page.get_pixmap(matrix=mat * fitz.Matrix(scale, scale), colorspace=fitz.csGRAY)
+        histogram = pixmap_to_image(pix).histogram()
+        del pix
+        
+        lut = build_enhancement_lut(histogram, self.brightness, self.contrast, self.black_point,
+                                    self.white_point, self.gamma)
+        enhanced_histogram = [0] * 256
+        for value, count in enumerate(histogram):
+            enhanced_histogram[lut[value]] += count
+        codec = self.output_format
+        if codec == "auto":
+            codec = select_codec(enhanced_histogram)
+        
+        threshold = otsu_threshold(enhanced_histogram)
+        radius = max(4, min(width, height) // 40)
+        margin = radius if codec == "bilevel" and self.binarization == "adaptive" else 0
+        if self.sharpness != 1.0:
+            margin = max(margin, 2)
+        rows = max(16, int(budget // (width * _TILE_BYTES_PER_PIXEL)) - 2 * margin)
+        
+        tiles = []
+        qualities = []
+        for top in range(0, height, rows):
+            bottom = min(height, top + rows)
+            overlap = 1 if bottom < height else 0
+            first, last = max(0, top - margin), min(height, bottom + max(margin, overlap))
+            clip = fitz.Rect(bounds.x0, pixel_bounds.y0 + first, bounds.x1, pixel_bounds.y0 + last) * ~mat
+            with self._span("render", page_num), self._render_scope():
+                pix = page.get_pixmap(matrix=mat, clip=clip, colorspace=fitz.csGRAY)
+            img = band = None
+            try:
+                with self._span("decode", page_num):
+                    img = pixmap_to_image(pix)
+                with self._span("enhance", page_num):
+                    band = self.apply_image_enhancements(img, histogram)
+                    if codec == "bilevel":
+                        band = binarize(band, self.binarization, radius, threshold=threshold)
+                
+                # Строки полосы без запаса; MuPDF может округлить границы отсечения
+                offset = pix.y - pixel_bounds.y0
+                crop_top, crop_bottom = max(0, top - offset), min(pix.height, bottom + overlap - offset)
+                if (crop_top, crop_bottom) != (0, pix.height):
+                    band = band.crop((0, crop_top, band.width, crop_bottom))
+                
+                with self._span("encode", page_num):
+                    if codec == "bilevel":
+                        data, quality = encode_bilevel(band), None
+                    else:
+                        share = max_bytes * band.height / height if max_bytes else None
+                        data, quality = self.encode_page_image(band, share, codec)
+                tiles.append((offset + crop_top, band.height, data))
+            except BaseException as e:
+                _release_frames(e)
+                raise
+            finally:
+                del img, band
+            if quality is not None:
+                qualities.append(quality)
+            del pix
+        
+        if self.instrumentation is not None:
+            self.instrumentation.count("pixels_processed", width * height)
+            self.instrumentation.count("tiles", len(tiles))
+        return output_width, output_height, pack_tiles(tiles, height), min(qualities) if qualities else None
+
+    def encode_page_image(self, image, max_bytes=None, codec=None):
+        """
+        Кодирует отрендеренную страницу в формате output_format
+        
+        При output_format == "auto" кодек выбирается через select_codec:
+        текстовые страницы кодируются однобитными, для страниц с небольшим
+        числом уровней серого пробуются Flate и JPEG и остается меньший
+        результат, остальные кодируются в JPEG. Выбранный кодек можно
+        определить по результату через image_codec. Качество JPEG подбирается
+        через search_jpeg_quality.
+        
+        Args:
+            image: страница в режиме L
+            max_bytes: наибольший размер JPEG для этой страницы
+            codec: кодек вместо output_format, например выбранный для всей
+                страницы при рендеринге полосами
+        
+        Returns:
+            tuple: (JPEG, однобитный TIFF Group 4 или PNG; качество JPEG или None)
+        """
+        codec = codec or self.output_format
+        if codec == "auto":
+            codec = select_codec(image.histogram())
+        
+        if codec == "bilevel":
+            return encode_bilevel(binarize(image, self.binarization)), None
+        
+        jpeg_data, quality = self.search_jpeg_quality(image, max_bytes, self.min_psnr)
+        if codec != "flate":
+            return jpeg_data, quality
+        
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        png_data = buffer.getvalue()
+        if len(png_data) <= len(jpeg_data):
+            return png_data, None
+        return jpeg_data, quality
+
+    def search_jpeg_quality(self, image, max_bytes=None, min_psnr=None):
+        """
+        Двоичный поиск качества JPEG для страницы
+        
+        Без ограничений страница кодируется с качеством quality. С min_psnr
+        выбирается наименьшее качество не выше quality, при котором PSNR
+        относительно image не ниже min_psnr; с max_bytes качество снижается,
+        пока JPEG не поместится (но не ниже 10). Размер важнее PSNR.
+        Каждое качество кодируется не более одного раза.
+        
+        Returns:
+            tuple: (байты JPEG, качество)
+        """
+        encoded = {}
+        
+        def encode(quality):
+            if quality not in encoded:
+                buffer = io.BytesIO()
+                image.save(buffer, 'JPEG', quality=quality, optimize=True)
+                encoded[quality] = buffer.getvalue()
+            return encoded[quality]
+        
+        quality = self.quality
+        if min_psnr:
+            low, high = 10, self.quality
+            while low < high:
+                middle = (low + high) // 2
+                if psnr(image, Image.open(io.BytesIO(encode(middle)))) >= min_psnr:
+                    high = middle
+                else:
+                    low = middle + 1
+            quality = high
+        
+        if max_bytes is not None and len(encode(quality)) > max_bytes:
+            low, high = 10, max(10, quality - 1)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if len(encode(middle)) <= max_bytes:
+                    low = middle
+                else:
+                    high = middle - 1
+            quality = low
+        
+        return encode(quality), quality
+
+    def convert_image_to_gray(self, doc, xref):
+        """
+        Перекодирует изображение документа в DeviceGray на месте
+        
+        Изображения в JPEG и JPEG 2000 сохраняются в JPEG с текущим качеством,
+        остальные - без потерь во FlateDecode. Маски (/SMask) сохраняются.
+        """
+        if doc.xref_get_key(xref, "ImageMask")[1] == "true":
+            return
+        kind, value = doc.xref_get_key(xref, "ColorSpace")
+        if kind != "null" and _colorspace_kind(doc, kind, value) == "gray":
+            return
+        
+        pix = fitz.Pixmap(doc, xref)
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
+        if pix.n != 3:
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        image = pixmap_to_image(pix).convert('L')
+        
+        image_filter = doc.xref_get_key(xref, "Filter")[1]
+        if "DCTDecode" in image_filter or "JPXDecode" in image_filter:
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=self.quality, optimize=True)
+            doc.update_stream(xref, buffer.getvalue(), compress=False)
+            doc.xref_set_key(xref, "Filter", "/DCTDecode")
+        else:
+            doc.update_stream(xref, image.tobytes(), compress=True)
+        
+        doc.xref_set_key(xref, "ColorSpace", "/DeviceGray")
+        doc.xref_set_key(xref, "BitsPerComponent", "8")
+        doc.xref_set_key(xref, "DecodeParms", "null")
+        doc.xref_set_key(xref, "Decode", "null")
+        if doc.xref_get_key(xref, "Mask")[0] == "array":
+            doc.xref_set_key(xref, "Mask", "null")
+
+    def rewrite_page_colors(self, doc, page, converted):
+        """
+        Переводит страницу в оттенки серого без рендеринга
+        
+        Операторы цвета в содержимом страницы и ее формах заменяются на
+        DeviceGray, шейдинги и изображения перекодируются на месте. Документ
+        изменяется, даже если страницу перевести не удалось, поэтому его
+        следует открывать отдельно от исходного.
+        
+        Args:
+            doc: документ fitz, который изменяется
+            page: страница doc
+            converted: множество уже переведенных объектов, общее для документа
+        
+        Returns:
+            bool: False если на странице есть цвета, которые нельзя перевести
+            без рендеринга (узоры, спецпространства, аннотации)
+        """
+        if page.first_annot or page.first_widget:
+            return False
+        
+        page_owners = _resource_owners(doc, page.xref)
+        streams = [(page.get_contents(), page_owners, False)]
+        for xobject in page.get_xobjects():
+            streams.append(([xobject[0]], [xobject[0]] + page_owners, True))
+        
+        updates = []
+        for xrefs, owners, inherited in streams:
+            if all(xref in converted for xref in xrefs):
+                continue
+            data = b"\n".join(doc.xref_stream(xref) for xref in xrefs)
+            result = _rewrite_content_stream(doc, data, owners, inherited)
+            if result is None:
+                return False
+            new_data, shadings = result
+            for name in shadings:
+                if not _convert_shading_to_gray(doc, owners, name, converted):
+                    return False
+            updates.append((xrefs, data, new_data))
+        
+        for image in page.get_images(full=True):
+            if image[0] not in converted:
+                self.convert_image_to_gray(doc, image[0])
+                converted.add(image[0])
+        
+        for xrefs, data, new_data in updates:
+            if new_data != data:
+                doc.update_stream(xrefs[0], new_data)
+                for xref in xrefs[1:]:
+                    doc.update_stream(xref, b"")
+            converted.update(xrefs)
+        
+        return True
+
+    def _render_pages(self, input_pdf_path, input_doc, page_numbers, limits=None, journal=None):
+        """
+        Генератор отрендеренных страниц page_numbers в порядке следования
+        
+        limits задает наибольший размер JPEG для отдельных страниц. При
+        включенном кэше страниц (set_cache) готовые результаты берутся из
+        него по page_fingerprint, а рендерятся и сохраняются только остальные.
+        Страницы из журнала journal (ConversionJournal) берутся в первую
+        очередь, а остальные записываются в него по мере готовности.
+        """
+        limits = limits or {}
+        render = self._render_uncached
+        if self.cache is not None and self.cache_pages:
+            stream_digests = {}
+            try:
+                keys = {
+                    page_num: self.cache.page_key(
+                        page_fingerprint(input_doc, input_doc[page_num], stream_digests),
+                        self.page_settings(page_num), limits.get(page_num)
+                    )
+                    for page_num in page_numbers
+                }
+            except Exception:
+                # Поврежденную структуру страниц MuPDF может отрендерить, но не обойти
+                pass
+            else:
+                render = partial(self._render_stored, self.cache, keys, render)
+        if journal is not None:
+            keys = {page_num: journal.page_key(page_num, limits.get(page_num)) for page_num in page_numbers}
+            render = partial(self._render_stored, journal, keys, render)
+        yield from render(input_pdf_path, input_doc, page_numbers, limits)
+
+    def _render_stored(self, store, keys, render, input_pdf_path, input_doc, page_numbers, limits):
+        """
+        Рендеринг с хранилищем готовых страниц (ResultCache или ConversionJournal)
+        
+        Страницы, сохраненные под ключами keys, читаются из store, остальные
+        рендерятся через render и сохраняются в store.
+        """
+        missing = [page_num for page_num in page_numbers if not store.has_page(keys[page_num])]
+        fresh = render(input_pdf_path, input_doc, missing, limits)
+        missing = set(missing)
+        try:
+            for page_num in page_numbers:
+                if page_num in missing:
+                    result = next(fresh)
+                else:
+                    with self._span("cache_read", page_num):
+                        result = store.get_page(keys[page_num])
+                    if result is not None:
+                        yield result
+                        continue
+                    # Запись удалена другим процессом после проверки
+                    result = self.page_converter(page_num)._render_page(input_doc[page_num], limits.get(page_num))
+                store.put_page(keys[page_num], result)
+                yield result
+        finally:
+            fresh.close()
+
+    def _render_uncached(self, input_pdf_path, input_doc, page_numbers, limits):
+        """
+        Рендеринг страниц page_numbers без кэша
+        
+        При workers > 1 страницы рендерятся в пуле процессов, каждый из которых
+        открывает собственную копию документа; результаты выдаются по порядку.
+        В демоническом процессе страницы рендерятся последовательно.
+        """
+        # Демонический процесс (рабочий multiprocessing.Pool, а до Python 3.9 и
+        # ProcessPoolExecutor, например pdf-bw --jobs) не может запускать дочерние
+        if self.workers <= 1 or len(page_numbers) < 2 or multiprocessing.current_process().daemon:
+            for page_num in page_numbers:
+                yield self.page_converter(page_num)._render_page(input_doc[page_num], limits.get(page_num))
+            return
+        
+        workers = min(self.workers, len(page_numbers))
+        chunksize = max(1, min(8, len(page_numbers) // (workers * 4)))
+        
+        with multiprocessing.Pool(
+            workers, initializer=_init_worker,
+            initargs=(input_pdf_path, self.get_settings(), self.instrumentation is not None)
+        ) as pool:
+            tasks = [(page_num, limits.get(page_num)) for page_num in page_numbers]
+            for result, measurements in pool.imap(_render_worker_page, tasks, chunksize):
+                if measurements is not None:
+                    self.instrumentation.merge(measurements)
+                yield result
+
+    def _page_records(self, doc):
+        """Хэши содержимого и действующих настроек страниц для манифеста"""
+        stream_digests = {}
+        records = []
+        for page_num, page in enumerate(doc):
+            records.append({
+                "fingerprint": page_fingerprint(doc, page, stream_digests),
+                "settings": ResultCache.settings_digest(self.page_settings(page_num)),
+            })
+        return records
+
+    def _load_manifest(self, output_path):
+        """Страницы манифеста прежнего результата или None, если его нельзя использовать"""
+        try:
+            with open(manifest_path_for(output_path), encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+            # Результат, измененный после конвертации, не используется
+            if manifest["version"] != _MANIFEST_VERSION or manifest["output"] != _file_signature(output_path):
+                return None
+            return manifest["pages"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save_manifest(self, output_path, pages):
+        """Сохраняет манифест результата: подпись файла и записи страниц"""
+        manifest = {"version": _MANIFEST_VERSION, "output": _file_signature(output_path), "pages": pages}
+        path = manifest_path_for(output_path)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_path, path)
+
+    def _plan_page_budgets(self, input_pdf_path, input_doc, page_numbers, budget, progress=None, journal=None):
+        """
+        Первый проход подбора качества под max_output_bytes
+        
+        Страницы рендерятся с обычным качеством, чтобы узнать их размеры, после
+        чего бюджет делится через allocate_page_budgets. Результаты страниц не
+        больше равной доли бюджета сохраняются (в сумме не больше бюджета) и
+        не рендерятся повторно, если для них не понадобилось ограничение.
+        
+        Returns:
+            tuple: (готовые результаты {номер: результат _render_page},
+                ограничения {номер: наибольший размер})
+        """
+        share = budget / len(page_numbers)
+        sizes = {}
+        kept = {}
+        rendered_pages = self._render_pages(input_pdf_path, input_doc, page_numbers, journal=journal)
+        try:
+            for page_num, result in zip(page_numbers, rendered_pages):
+                if progress:
+                    progress.check()
+                image_data = result[2]
+                if image_codec(image_data) == "jpeg":
+                    sizes[page_num] = len(image_data)
+                else:
+                    # Размер однобитных и Flate страниц не зависит от качества
+                    budget -= len(image_data)
+                if len(image_data) <= share:
+                    kept[page_num] = result
+        finally:
+            rendered_pages.close()
+        
+        limits = allocate_page_budgets(sizes, budget)
+        prepared = {page_num: result for page_num, result in kept.items() if page_num not in limits}
+        return prepared, limits
+
+    def copy_page(self, input_doc, page_num, output_doc):
+        """
+        Копирование черно-белой страницы без рендеринга
+        
+        Векторное содержимое, шрифты и текстовый слой сохраняются. Если размер
+        выходной страницы отличается от исходного, страница вписывается в
+        новый размер так же, как при рендеринге.
+        """
+        page = input_doc[page_num]
+        output_width, output_height = self.get_page_dimensions(page)
+        
+        if (output_width, output_height) == (page.rect.width, page.rect.height):
+            output_doc.insert_pdf(input_doc, from_page=page_num, to_page=page_num)
+            return
+        
+        new_page = output_doc.new_page(width=output_width, height=output_height)
+        new_page.show_pdf_page(new_page.rect, input_doc, page_num, keep_proportion=False)
+
+    def convert_pdf_to_bw(self, input_pdf_path, output_pdf_path, progress_callback=None, progress=None):
         """
         Конвертация PDF в черно-белый с сохранением оригинального разрешения
         
+        Каждая страница классифицируется через classify_pages. Если черно-белые
+        все страницы, файл копируется без изменений. Иначе при включенном
+        pass_through черно-белые страницы копируются через copy_page, а
+        цветные рендерятся или, при engine == "vector", переводятся в оттенки
+        серого через rewrite_page_colors; рендерятся только страницы, которые
+        перевести не удалось. При заданном memory_limit результат пишется на
+        диск частями (см. _StreamingOutput). При включенном кэше (set_cache)
+        результат для того же файла и настроек берется из кэша без
+        конвертации, а новый результат сохраняется в кэш.
+        
         Args:
             input_pdf_path (str): Путь к входному PDF файлу
             output_pdf_path (str): Путь для сохранения выходного PDF файла
-            progress_callback (callable): Функция для отслеживания прогресса
+            progress_callback (callable): Функция (значение, сообщение), вызывается
+                в потоке конвертации
+            progress (ConversionProgress): События прогресса для других потоков и
+                отмена; при отмене документы закрываются, частичный результат
+                удаляется
         
         Returns:
-            bool: True если конвертация успешна
+            ConversionSummary или False, если конвертация не удалась или отменена
         """
-        try:
+        with self._span("convert"):
+            summary = self._convert_document(input_pdf_path, output_pdf_path, progress_callback, progress)
+        if summary and self.instrumentation is not None:
+            self._count_summary(summary, input_pdf_path, output_pdf_path)
+        return summary
+
+    def _count_summary(self, summary, input_pdf_path, output_pdf_path):
+        """Счетчики страниц и байтов успешной конвертации для instrumentation"""
+        count = self.instrumentation.count
+        count("conversions")
+        count("documents_from_cache", int(summary.from_cache))
+        count("pages", summary.total_pages)
+        count("pages_rasterized", summary.rendered_pages)
+        count("pages_copied", summary.copied_pages)
+        count("pages_rewritten", summary.rewritten_pages)
+        count("pages_reused", summary.reused_pages)
+        count("pages_from_cache", summary.cached_pages)
+        count("pages_resumed", summary.resumed_pages)
+        count("pages_duplicate", summary.duplicate_pages)
+        count("bytes_deduplicated", summary.dedup_bytes)
+        count("bytes_in", os.path.getsize(input_pdf_path))
+        count("bytes_out", os.path.getsize(output_pdf_path))
+
+    def _convert_document(self, input_pdf_path, output_pdf_path, progress_callback, progress):
+        """Конвертация документа (см. convert_pdf_to_bw)"""
+        total_pages = None
+        
+        def report(value, message, page=None, final=False, error=None):
             if progress_callback:
-                progress_callback(0, "Проверка формата PDF...")
+                progress_callback(value, message)
+            if progress:
+                progress.report(value, message, page, total_pages, final, error)
+        
+        input_doc = work_doc = previous_doc = rendered_pages = output = None
+        try:
+            report(0, "Проверка формата PDF...")
             
-            is_grayscale, grayscale_pages, checked_pages = self.check_pdf_is_grayscale(
-                input_pdf_path, sample_pages=3, threshold=0.9
-            )
+            cache_key = None
+            if self.cache is not None:
+                with self._span("cache_lookup"):
+                    cache_key = self.cache.document_key(input_pdf_path, self.get_settings())
+                    summary = self.cache.get_document(cache_key, output_pdf_path)
+                if summary:
+                    report(100, "Результат взят из кэша", final=True)
+                    return summary
+                page_hits = self.cache.page_hits
+            
+            with self._span("open"):
+                input_doc = fitz.open(input_pdf_path)
+            total_pages = len(input_doc)
+            summary = ConversionSummary(total_pages)
+            overridden = {page_num for page_num in range(total_pages) if self.page_override(page_num)}
             
-            if is_grayscale:
-                if progress_callback:
-                    progress_callback(100, "PDF уже черно-белый - копирование без изменений")
+            # Инкрементальный режим: страницы с прежними хэшами содержимого и
+            # настроек переносятся из предыдущего результата
+            records = previous = None
+            reused = {}
+            if self.incremental and not self.max_output_bytes:
+                with self._span("fingerprint"):
+                    records = self._page_records(input_doc)
+                previous = self._load_manifest(output_pdf_path)
+                for page_num, entry in enumerate((previous or [])[:total_pages]):
+                    if (entry["fingerprint"], entry["settings"]) == \
+                            (records[page_num]["fingerprint"], records[page_num]["settings"]):
+                        reused[page_num] = entry
                 
-                shutil.copy2(input_pdf_path, output_pdf_path)
-                return True
+                if len(reused) == total_pages == len(previous):
+                    summary.reused_pages = total_pages
+                    for page_num, entry in reused.items():
+                        summary.add_manifest_entry(page_num, entry)
+                    report(100, "Результат актуален - страницы не изменились", final=True)
+                    return summary
             
-            input_doc = fitz.open(input_pdf_path)
-            output_doc = fitz.open()
+            with self._span("grayscale_check"):
+                # Страница копируется без изменений, только если в ней нет ни одного
+                # цветного пикселя: небольшой цветной логотип иначе остался бы в результате
+                labels = self.classify_pages(
+                    input_doc, threshold=1.0,
+                    pages={page_num for page_num in range(total_pages) if page_num not in reused},
+                )
+            if progress:
+                progress.check()
             
-            total_pages = len(input_doc)
+            if labels.count("gray") == total_pages and not overridden:
+                input_doc.close()
+                input_doc = None
+                with self._span("copy"):
+                    shutil.copy2(input_pdf_path, output_pdf_path)
+                summary.file_copied = True
+                if self.max_output_bytes:
+                    summary.target_met = os.path.getsize(output_pdf_path) <= self.max_output_bytes
+                summary.copied_pages = total_pages
+                if cache_key:
+                    self.cache.put_document(cache_key, output_pdf_path, summary)
+                if records is not None:
+                    self._save_manifest(output_pdf_path, [dict(record, path="copy") for record in records])
+                report(100, "PDF уже черно-белый - копирование без изменений", final=True)
+                return summary
             
-            for page_num in range(total_pages):
-                if progress_callback:
-                    progress = (page_num / total_pages) * 100
-                    progress_callback(progress, f"Обработка страницы {page_num + 1}/{total_pages}")
-                
-                page = input_doc[page_num]
-                output_width, output_height = self.get_page_dimensions(page)
-                
-                original_rect = page.rect
-                original_width = original_rect.width
-                original_height = original_rect.height
-                
-                scale_x = output_width / original_width
-                scale_y = output_height / original_height
-                
-                mat = fitz.Matrix(2.0 * scale_x, 2.0 * scale_y)
-                pix = page.get_pixmap(matrix=mat)
-                
-                img_data = pix.tobytes("ppm")
-                img = Image.open(io.BytesIO(img_data))
+            memory_limit = self.memory_limit * 1024 * 1024 if self.memory_limit else None
+            output = _StreamingOutput(output_pdf_path, memory_limit)
+            
+            page_paths = []
+            for page_num, label in enumerate(labels):
+                if page_num in reused:
+                    page_paths.append("reuse")
+                elif self.pass_through and label == "gray" and page_num not in overridden:
+                    page_paths.append("copy")
+                else:
+                    page_paths.append("render")
+            
+            previous_doc = fitz.open(output_pdf_path) if reused else None
+            
+            if self.engine == "vector":
+                work_doc = fitz.open(input_pdf_path)
+                converted = set()
+                for page_num, path in enumerate(page_paths):
+                    if path != "render" or page_num in overridden:
+                        continue
+                    if progress:
+                        progress.check()
+                    try:
+                        with self._span("rewrite", page_num):
+                            if self.rewrite_page_colors(work_doc, work_doc[page_num], converted):
+                                page_paths[page_num] = "rewrite"
+                    except Exception:
+                        pass
+            
+            render_numbers = [page_num for page_num, path in enumerate(page_paths) if path == "render"]
+            journal = None
+            if self.journal_dir and render_numbers:
+                with self._span("journal_open"):
+                    journal = ConversionJournal(self.journal_dir, input_pdf_path, self.get_settings(), total_pages)
+            self.page_images = self._new_page_index()
+            prepared, limits = {}, {}
+            if self.max_output_bytes and render_numbers:
+                budget = self.max_output_bytes - _PDF_FILE_OVERHEAD - _PDF_PAGE_OVERHEAD * total_pages
+                for page_num, path in enumerate(page_paths):
+                    if path != "render":
+                        source_doc = input_doc if path == "copy" else work_doc
+                        budget -= _page_stream_bytes(source_doc, source_doc[page_num])
+                report(0, "Подбор качества под размер файла...")
+                with self._span("budget"):
+                    prepared, limits = self._plan_page_budgets(
+                        input_pdf_path, input_doc, render_numbers, budget, progress, journal
+                    )
+            
+            rendered_pages = self._render_pages(
+                input_pdf_path, input_doc, [page_num for page_num in render_numbers if page_num not in prepared], limits,
+                journal
+            )
+            images = {} if self.deduplicate else None
+            actions = {"copy": "копирование", "rewrite": "перезапись цветов", "render": "рендеринг",
+                       "reuse": "без изменений"}
+            manifest = []
+            
+            for page_num, path in enumerate(page_paths):
+                if progress:
+                    progress.check()
+                report((page_num / total_pages) * 100,
+                       f"Обработка страницы {page_num + 1}/{total_pages} ({actions[path]})", page_num + 1)
                 
-                bw_img = self.apply_image_enhancements(img)
+                if path == "reuse":
+                    entry = reused[page_num]
+                    with self._span("reuse", page_num):
+                        output.doc.insert_pdf(previous_doc, from_page=page_num, to_page=page_num)
+                    output.page_added(_page_stream_bytes(previous_doc, previous_doc[page_num]))
+                    summary.reused_pages += 1
+                    summary.add_manifest_entry(page_num, entry)
+                    manifest.append(entry)
+                    continue
                 
-                with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_file:
-                    temp_path = temp_file.name
-                    bw_img.save(temp_path, 'JPEG', quality=self.quality, optimize=True)
+                if path in ("copy", "rewrite"):
+                    source_doc = input_doc if path == "copy" else work_doc
+                    with self._span("copy", page_num):
+                        self.copy_page(source_doc, page_num, output.doc)
+                    output.page_added(_page_stream_bytes(source_doc, source_doc[page_num]))
+                    if path == "copy":
+                        summary.copied_pages += 1
+                    else:
+                        summary.rewritten_pages += 1
+                    if records is not None:
+                        manifest.append(dict(records[page_num], path=path))
+                    continue
                 
-                new_page = output_doc.new_page(width=output_width, height=output_height)
-                rect = fitz.Rect(0, 0, output_width, output_height)
-                new_page.insert_image(rect, filename=temp_path)
+                if page_num in prepared:
+                    output_width, output_height, image_data, quality = prepared.pop(page_num)
+                else:
+                    output_width, output_height, image_data, quality = next(rendered_pages)
                 
-                os.unlink(temp_path)
+                with self._span("insert", page_num):
+                    new_page = output.doc.new_page(width=output_width, height=output_height)
+                    rect = fitz.Rect(0, 0, output_width, output_height)
+                    shared, embedded = _insert_page_image(output.doc, new_page, rect, image_data, images=images)
+                output.page_added(embedded)
+                summary.rendered_pages += 1
+                summary.dedup_bytes += shared
+                if shared and not embedded:
+                    summary.duplicate_pages += 1
+                summary.page_codecs[page_num] = (image_codec(image_data), len(image_data))
+                if quality is not None:
+                    summary.page_qualities[page_num] = quality
+                if records is not None:
+                    manifest.append(dict(records[page_num], path="render", codec=image_codec(image_data),
+                                         bytes=len(image_data), quality=quality))
             
-            output_doc.save(output_pdf_path, garbage=4, deflate=True, clean=True)
-            output_doc.close()
-            input_doc.close()
+            if progress:
+                progress.check()
+            if previous_doc is not None:
+                # Страницы уже перенесены, а результат перезаписывается поверх прежнего
+                previous_doc.close()
+                previous_doc = None
+            if previous is not None:
+                # Пока результат перезаписывается, прежний манифест недействителен
+                os.remove(manifest_path_for(output_pdf_path))
+            with self._span("save"):
+                output.save()
+            if records is not None:
+                self._save_manifest(output_pdf_path, manifest)
+            if journal is not None:
+                summary.resumed_pages = journal.page_hits
+                journal.remove()
+            if self.max_output_bytes:
+                summary.target_met = os.path.getsize(output_pdf_path) <= self.max_output_bytes
+            if cache_key:
+                summary.cached_pages = self.cache.page_hits - page_hits
+                self.cache.put_document(cache_key, output_pdf_path, summary)
             
-            if progress_callback:
-                progress_callback(100, "Конвертация завершена!")
+            message = (f"Конвертация завершена! Скопировано страниц: "
+                       f"{summary.copied_pages}, отрендерено: {summary.rendered_pages}, "
+                       f"перезаписано: {summary.rewritten_pages}")
+            if summary.reused_pages:
+                message += f", без изменений: {summary.reused_pages}"
+            if summary.resumed_pages:
+                message += f", из журнала: {summary.resumed_pages}"
+            if summary.duplicate_pages:
+                message += f", повторов: {summary.duplicate_pages}"
+            report(100, message, final=True)
             
-            return True
+            return summary
+            
+        except ConversionCancelled:
+            if output is not None:
+                output.discard()
+            if self.instrumentation is not None:
+                self.instrumentation.count("conversions_cancelled")
+            report(0, "Конвертация отменена", final=True)
+            return False
             
         except Exception as e:
-            if progress_callback:
-                progress_callback(0, f"Ошибка: {e}")
+            if output is not None:
+                output.discard()
+            if self.instrumentation is not None:
+                self.instrumentation.error(str(e))
+            report(0, f"Ошибка: {e}", final=True, error=str(e))
             return False
+            
+        finally:
+            # Закрытие генератора завершает пул рендеринга, если он был запущен
+            if rendered_pages is not None:
+                rendered_pages.close()
+            if work_doc is not None:
+                work_doc.close()
+            if previous_doc is not None:
+                previous_doc.close()
+            if input_doc is not None:
+                input_doc.close()
+            self.page_images = None
 
     def get_preview_image(self, pdf_path, page_num=0, preview_size=(300, 400)):
         """Получает изображение для предпросмотра"""
@@ -297,21 +3412,338 @@ class PDFToBWConverter:
             print(f"Ошибка при получении предпросмотра: {e}")
             return None
 
-    def apply_preview_enhancements(self, image, brightness, contrast, sharpness):
-        """Применяет настройки к изображению для предпросмотра"""
-        if image.mode != 'L':
-            image = image.convert('L')
+    def apply_preview_enhancements(self, image, brightness, contrast, sharpness, check=None):
+        """
+        Применяет настройки к изображению для предпросмотра
         
-        if brightness != 1.0:
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(brightness)
+        Используется тот же путь, что и при конвертации; уровни берутся из
+        текущих настроек конвертера. check - проверка отмены между проходами
+        (см. enhance_grayscale).
+        """
+        return enhance_grayscale(
+            image, brightness, contrast, sharpness, self.black_point, self.white_point, self.gamma, check=check
+        )
+
+
+class PreviewRenderer:
+    """
+    Рендеринг страниц для предпросмотра с кэшем
+    
+    Документ остается открытым между запросами, а отрендеренные в оттенках
+    серого страницы хранятся в LRU кэше с ограничением памяти по ключу
+    (страница, масштаб). После каждого запроса соседние страницы рендерятся
+    заранее в фоновом потоке. Если файл изменился (время изменения или
+    размер), кэш сбрасывается, а документ открывается заново. Как и при
+    конвертации по умолчанию, страницы рендерятся без ICC (_without_icc).
+    
+    Документы MuPDF нельзя использовать из нескольких потоков одновременно,
+    поэтому рендеринг выполняется под блокировкой. Запросы интерфейса имеют
+    приоритет: пока запрос ждет блокировку, фоновый поток не берет следующую
+    страницу, так что запрос ждет не больше рендеринга одной страницы.
+    """
+    
+    def __init__(self, memory_limit=64, prefetch=2, preview_size=(300, 400)):
+        """
+        Args:
+            memory_limit: объем кэша страниц, МБ
+            prefetch: сколько страниц до и после запрошенной рендерить заранее
+            preview_size: размер области предпросмотра (ширина, высота)
+        """
+        self.memory_limit = memory_limit * 1024 * 1024
+        self.prefetch = prefetch
+        self.preview_size = preview_size
+        self.path = None
+        self.doc = None
+        self.signature = None
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.waiting_lock = threading.Lock()
+        self.waiting = 0
+        self.pending = []
+        self.wakeup = threading.Condition(self.lock)
+        self.thread = None
+        self.closed = False
+
+    def open(self, path):
+        """Открывает документ для предпросмотра и возвращает количество страниц"""
+        with self._request():
+            self._close_document()
+            self.closed = False
+            self.path = path
+            self.signature = self._file_signature()
+            self.doc = fitz.open(path)
+            return len(self.doc)
+
+    @property
+    def page_count(self):
+        """Количество страниц открытого документа"""
+        with self._request():
+            self._check_file()
+            return len(self.doc) if self.doc is not None else 0
+
+    def get_page(self, page_num):
+        """
+        Возвращает страницу для предпросмотра в режиме L
         
-        if contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(contrast)
+        Изображение хранится в кэше и не должно изменяться вызывающим кодом.
+        После запроса в фоне рендерятся соседние страницы.
+        """
+        with self._request():
+            self._check_file()
+            if self.doc is None:
+                raise RuntimeError("документ для предпросмотра не открыт (нужен вызов open)")
+            page_num = min(max(0, page_num), len(self.doc) - 1)
+            image = self._cached(page_num)
+            if image is None:
+                self.misses += 1
+                image = self._render(page_num)
+            else:
+                self.hits += 1
+            self._schedule_prefetch(page_num)
+            return image
+
+    def get_cached(self, page_num):
+        """Возвращает страницу из кэша без рендеринга или None"""
+        with self._request():
+            self._check_file()
+            if self.doc is None:
+                return None
+            image = self._cached(min(max(0, page_num), len(self.doc) - 1))
+            if image is not None:
+                self.hits += 1
+                self._schedule_prefetch(page_num)
+            return image
+
+    def close(self):
+        """Закрывает документ и останавливает фоновый поток"""
+        with self._request():
+            self.closed = True
+            self._close_document()
+            self.wakeup.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    @contextmanager
+    def _request(self):
+        """Блокировка для запроса интерфейса с приоритетом над фоновым рендерингом"""
+        with self.waiting_lock:
+            self.waiting += 1
+        with self.lock:
+            with self.waiting_lock:
+                self.waiting -= 1
+            try:
+                yield
+            finally:
+                # Фоновый поток ждет окончания запроса, даже если запрос завершился ошибкой
+                self.wakeup.notify()
+
+    def _file_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _check_file(self):
+        """Сбрасывает кэш и открывает документ заново, если файл изменился"""
+        if self.path is None:
+            return
+        signature = self._file_signature()
+        if signature != self.signature:
+            self.open(self.path)
+
+    def _close_document(self):
+        if self.doc is not None:
+            self.doc.close()
+            self.doc = None
+        self.cache.clear()
+        self.cache_bytes = 0
+        self.pending = []
+
+    def _zoom(self, page):
+        """Масштаб, при котором страница помещается в область предпросмотра с отступами"""
+        scale_x = self.preview_size[0] / page.rect.width
+        scale_y = self.preview_size[1] / page.rect.height
+        return round(min(scale_x, scale_y) * 0.9, 3)
+
+    def _cached(self, page_num):
+        key = (page_num, self._zoom(self.doc[page_num]))
+        image = self.cache.get(key)
+        if image is not None:
+            self.cache.move_to_end(key)
+        return image
+
+    def _render(self, page_num):
+        page = self.doc[page_num]
+        zoom = self._zoom(page)
+        with _without_icc():
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+        image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
         
-        if sharpness != 1.0:
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(sharpness)
+        self.cache[(page_num, zoom)] = image
+        self.cache_bytes += image.width * image.height
+        while self.cache_bytes > self.memory_limit and len(self.cache) > 1:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted.width * evicted.height
+        return image
+
+    def _schedule_prefetch(self, page_num):
+        """Ставит соседние страницы в очередь фонового рендеринга, ближние первыми"""
+        if not self.prefetch:
+            return
+        pages = []
+        for distance in range(1, self.prefetch + 1):
+            pages.extend((page_num + distance, page_num - distance))
+        self.pending = [number for number in pages if 0 <= number < len(self.doc)]
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+            self.thread.start()
+        self.wakeup.notify()
+
+    def _prefetch_loop(self):
+        with self.lock:
+            while not self.closed:
+                if not self.pending or self.waiting:
+                    self.wakeup.wait()
+                    continue
+                page_num = self.pending.pop(0)
+                if self.doc is not None and page_num < len(self.doc) and self._cached(page_num) is None:
+                    self._render(page_num)
+
+
+class PreviewPipeline:
+    """
+    Фоновая обработка предпросмотра: побеждает последний запрос
+    
+    Запросы (изображение и настройки) не копятся в очереди: новый запрос
+    заменяет еще не начатый, так что при перетаскивании ползунка
+    обрабатывается только последнее положение. Обработка выполняется в
+    фоновом потоке, результат передается в deliver(поколение, изображение,
+    время запроса) из фонового потока - интерфейс переносит его в свой поток
+    сам (например, через root.after) и показывает, только если поколение
+    новее показанного.
+    
+    Результат устаревшего запроса отбрасывается, если с прошлой доставки
+    прошло меньше refresh_interval секунд: иначе при обработке медленнее
+    событий ползунка предпросмотр не обновлялся бы до его отпускания.
+    
+    С cancellable функция process получает именованный аргумент check и
+    вызывает его между проходами обработки: если пришел новый запрос, а
+    результат текущего все равно был бы отброшен, check прерывает его
+    (ConversionCancelled), и поток сразу берет новый запрос. Сам проход
+    (одна операция Pillow) не прерывается.
+    
+    Задержка от запроса до показа, переданная в displayed, копится в
+    latencies для оценки отзывчивости.
+    """
+    
+    def __init__(self, process, deliver, history=50, refresh_interval=0.1, cancellable=False):
+        """
+        Args:
+            process: функция (изображение, *настройки) -> изображение
+            deliver: функция (поколение, изображение, время запроса),
+                вызывается из фонового потока; при ошибке вместо изображения
+                передается исключение
+            history: сколько последних задержек хранить
+            refresh_interval: как часто показывать промежуточные результаты
+                при непрерывном изменении настроек, секунд
+            cancellable: передавать process проверку отмены check
+        """
+        self.process = process
+        self.deliver = deliver
+        self.refresh_interval = refresh_interval
+        self.cancellable = cancellable
+        self.last_delivery = 0.0
+        self.condition = threading.Condition()
+        self.request = None
+        self.generation = 0
+        self.dropped = 0
+        self.cancelled = 0
+        self.latencies = deque(maxlen=history)
+        self.thread = None
+        self.closed = False
+
+    def submit(self, image, *settings):
+        """
+        Ставит обработку в очередь вместо еще не начатой
         
-        return image
\ No newline at end of file
+        Returns:
+            int: поколение запроса
+        """
+        with self.condition:
+            self.generation += 1
+            if self.request is not None:
+                self.dropped += 1
+            self.request = (self.generation, image, settings, time.perf_counter())
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+            return self.generation
+
+    def is_current(self, generation):
+        """Проверяет, что после запроса generation не было новых"""
+        return generation == self.generation
+
+    def displayed(self, submitted):
+        """Отмечает показ результата запроса от момента submitted; возвращает задержку в мс"""
+        latency = (time.perf_counter() - submitted) * 1000
+        self.latencies.append(latency)
+        return latency
+
+    def latency_stats(self):
+        """Медиана и максимум последних задержек в мс или None, если их нет"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2], ordered[-1]
+
+    def _check_stale(self):
+        """Прерывает обработку, результат которой был бы отброшен (см. cancellable)"""
+        with self.condition:
+            stale = self.request is not None or self.closed
+            if stale and time.perf_counter() - self.last_delivery < self.refresh_interval:
+                raise ConversionCancelled()
+
+    def close(self):
+        """Останавливает фоновый поток; начатая обработка не доставляется"""
+        with self.condition:
+            self.closed = True
+            self.request = None
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _loop(self):
+        while True:
+            with self.condition:
+                while self.request is None and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                generation, image, settings, submitted = self.request
+                self.request = None
+            
+            try:
+                if self.cancellable:
+                    result = self.process(image, *settings, check=self._check_stale)
+                else:
+                    result = self.process(image, *settings)
+            except ConversionCancelled:
+                with self.condition:
+                    self.cancelled += 1
+                continue
+            except Exception as e:
+                result = e
+            
+            with self.condition:
+                if self.closed:
+                    return
+                now = time.perf_counter()
+                if not self.is_current(generation) and now - self.last_delivery < self.refresh_interval:
+                    self.dropped += 1
+                    continue
+                self.last_delivery = now
+            self.deliver(generation, result, submitted)
@@ -6,10 +6,8 @@ import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
-from PIL import ImageTk
-import fitz
 
-from converter import PDFToBWConverter
+from converter import ConversionProgress, PDFToBWConverter, PreviewPipeline, PreviewRenderer
 
 class PDFConverterGUI:
     """Класс графического интерфейса конвертера PDF"""
@@ -19,6 +17,14 @@ class PDFConverterGUI:
         self.root.title("Конвертер PDF в черно-белый")
         self.root.geometry("800x700")
         self.converter = PDFToBWConverter()
+        self.preview = PreviewRenderer()
+        self.preview_pipeline = PreviewPipeline(
+            self.converter.apply_preview_enhancements, self.on_preview_ready, cancellable=True
+        )
+        self.shown_generation = 0
+        self.conversion_progress = None
+        self.conversion_thread = None
+        self.conversion_result = None
         
         self.input_file = None
         self.preview_image = None
@@ -68,12 +74,16 @@ class PDFConverterGUI:
         
         self.page_var = tk.StringVar(value="1")
         self.page_spinbox = ttk.Spinbox(preview_controls, from_=1, to=1, width=5, 
-                                       textvariable=self.page_var, command=self.update_preview)
+                                       textvariable=self.page_var, command=self.load_preview)
         self.page_spinbox.grid(row=0, column=1, padx=(5, 10))
         
         ttk.Button(preview_controls, text="Обновить", 
                   command=self.update_preview).grid(row=0, column=2)
         
+        # Задержка от изменения настроек до показа предпросмотра
+        self.latency_label = ttk.Label(preview_controls, text="", foreground="gray")
+        self.latency_label.grid(row=1, column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
+        
         # Область предпросмотра
         preview_frame = ttk.LabelFrame(top_frame, text="Предпросмотр", padding="5")
         preview_frame.grid(row=0, column=1, sticky=(tk.W, tk.E, tk.N, tk.S), padx=(10, 0))
@@ -157,10 +167,17 @@ class PDFConverterGUI:
         self.status_label = ttk.Label(main_frame, text="Готов к работе")
         self.status_label.grid(row=6, column=0, columnspan=2, sticky=tk.W, pady=2)
         
-        # Кнопка конвертации
-        self.convert_button = ttk.Button(main_frame, text="Конвертировать в черно-белый", 
+        # Кнопки конвертации и отмены
+        buttons_frame = ttk.Frame(main_frame)
+        buttons_frame.grid(row=7, column=0, columnspan=3, pady=15)
+        
+        self.convert_button = ttk.Button(buttons_frame, text="Конвертировать в черно-белый", 
                                        command=self.start_conversion, state=tk.DISABLED)
-        self.convert_button.grid(row=7, column=0, columnspan=3, pady=15)
+        self.convert_button.grid(row=0, column=0, padx=5)
+        
+        self.cancel_button = ttk.Button(buttons_frame, text="Отмена",
+                                      command=self.cancel_conversion, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1, padx=5)
     
     def update_brightness_label(self, value):
         """Обновление метки яркости"""
@@ -206,12 +223,10 @@ class PDFConverterGUI:
             self.convert_button.config(state=tk.NORMAL)
             self.status_label.config(text="Файл выбран, загрузка предпросмотра...")
             
-            # Загружаем информацию о PDF
+            # Открываем PDF для предпросмотра (документ остается открытым)
             try:
-                doc = fitz.open(filename)
-                self.total_pages = len(doc)
+                self.total_pages = self.preview.open(filename)
                 self.current_page = 0
-                doc.close()
                 
                 # Обновляем спинбокс страниц
                 self.page_spinbox.config(from_=1, to=max(1, self.total_pages))
@@ -224,15 +239,25 @@ class PDFConverterGUI:
                 messagebox.showerror("Ошибка", f"Не удалось загрузить PDF: {str(e)}")
     
     def load_preview(self):
-        """Загружает предпросмотр в отдельном потоке"""
+        """Загружает предпросмотр: из кэша сразу, иначе в отдельном потоке"""
+        if not self.input_file:
+            return
+        
+        try:
+            page_num = int(self.page_var.get()) - 1
+        except ValueError:
+            return
+        
+        cached_image = self.preview.get_cached(page_num)
+        if cached_image is not None:
+            self.original_preview = cached_image
+            self.update_preview_image()
+            return
+        
         def load_thread():
             try:
-                page_num = int(self.page_var.get()) - 1
-                preview_image = self.converter.get_preview_image(self.input_file, page_num)
-                
-                if preview_image:
-                    self.original_preview = preview_image.copy()
-                    self.root.after(0, self.update_preview_image)
+                self.original_preview = self.preview.get_page(page_num)
+                self.root.after(0, self.update_preview_image)
                     
             except Exception as e:
                 self.root.after(0, lambda: self.status_label.config(text=f"Ошибка загрузки: {str(e)}"))
@@ -240,29 +265,52 @@ class PDFConverterGUI:
         threading.Thread(target=load_thread, daemon=True).start()
     
     def update_preview(self):
-        """Обновляет предпросмотр с текущими настройками"""
+        """
+        Обновляет предпросмотр с текущими настройками
+        
+        Настройки применяются в фоновом потоке PreviewPipeline: при
+        перетаскивании ползунка необработанные запросы заменяются последним,
+        а в главном потоке только создается изображение Tkinter.
+        """
         if self.original_preview is None:
             self.load_preview()
             return
         
-        try:
-            # Применяем текущие настройки к изображению
-            enhanced_image = self.converter.apply_preview_enhancements(
-                self.original_preview.copy(),
-                self.brightness_var.get(),
-                self.contrast_var.get(),
-                self.sharpness_var.get()
-            )
-            
-            # Конвертируем для Tkinter
-            photo = ImageTk.PhotoImage(enhanced_image)
-            
-            # Обновляем изображение
-            self.preview_label.configure(image=photo)
-            self.preview_label.image = photo  # Сохраняем ссылку
-            
-        except Exception as e:
-            print(f"Ошибка обновления предпросмотра: {e}")
+        # Изображение из кэша предпросмотра не изменяется, улучшения создают новое
+        self.preview_pipeline.submit(
+            self.original_preview,
+            self.brightness_var.get(),
+            self.contrast_var.get(),
+            self.sharpness_var.get()
+        )
+    
+    def on_preview_ready(self, generation, image, submitted):
+        """Передает результат фоновой обработки в главный поток"""
+        self.root.after(0, lambda: self.show_preview(generation, image, submitted))
+    
+    def show_preview(self, generation, image, submitted):
+        """Показывает обработанный предпросмотр, если он новее показанного"""
+        if generation <= self.shown_generation:
+            return
+        self.shown_generation = generation
+        
+        if isinstance(image, Exception):
+            print(f"Ошибка обновления предпросмотра: {image}")
+            return
+        
+        # Конвертируем для Tkinter (ImageTk загружается при первом предпросмотре)
+        from PIL import ImageTk
+        photo = ImageTk.PhotoImage(image)
+        
+        # Обновляем изображение
+        self.preview_label.configure(image=photo)
+        self.preview_label.image = photo  # Сохраняем ссылку
+        
+        latency = self.preview_pipeline.displayed(submitted)
+        median, worst = self.preview_pipeline.latency_stats()
+        self.latency_label.config(
+            text=f"Задержка предпросмотра: {latency:.0f} мс (медиана {median:.0f}, максимум {worst:.0f})"
+        )
     
     def update_preview_image(self):
         """Обновляет основное изображение предпросмотра"""
@@ -270,11 +318,35 @@ class PDFConverterGUI:
             self.update_preview()
             self.status_label.config(text="Предпросмотр загружен. Настройте параметры.")
     
-    def update_progress(self, value, message):
-        """Обновление прогресса конвертации"""
-        self.progress_var.set(value)
-        self.status_label.config(text=message)
-        self.root.update_idletasks()
+    def update_progress(self, event):
+        """Обновление прогресса конвертации по событию ProgressEvent (в потоке Tk)"""
+        self.progress_var.set(event.value)
+        text = event.message
+        if event.eta is not None and not event.final:
+            minutes, seconds = divmod(int(event.eta + 0.5), 60)
+            text += f" - осталось около {minutes}:{seconds:02d}"
+        self.status_label.config(text=text)
+    
+    def poll_progress(self):
+        """Забирает события прогресса по таймеру Tk, пока идет конвертация"""
+        # Поток проверяется до чтения очереди: после его завершения все события уже в ней
+        finished = not self.conversion_thread.is_alive()
+        for event in self.conversion_progress.poll():
+            self.update_progress(event)
+        
+        if not finished:
+            self.root.after(50, self.poll_progress)
+            return
+        
+        success, output_file, error_msg = self.conversion_result
+        self.conversion_finished(success, output_file, error_msg)
+    
+    def cancel_conversion(self):
+        """Запрашивает отмену текущей конвертации"""
+        if self.conversion_progress:
+            self.conversion_progress.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.status_label.config(text="Отмена конвертации...")
     
     def start_conversion(self):
         """Запуск процесса конвертации"""
@@ -307,28 +379,34 @@ class PDFConverterGUI:
         
         # Блокируем кнопку во время конвертации
         self.convert_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        
+        # Конвертация идет в отдельном потоке, а прогресс забирается из очереди
+        # событий по таймеру Tk: виджеты меняются только в потоке интерфейса
+        progress = ConversionProgress()
+        input_file = self.input_file
         
-        # Запускаем конвертацию в отдельном потоке
         def conversion_thread():
             try:
-                success = self.converter.convert_pdf_to_bw(
-                    self.input_file, 
-                    output_file,
-                    progress_callback=self.update_progress
-                )
-                
-                self.root.after(0, lambda: self.conversion_finished(success, output_file))
-                
+                summary = self.converter.convert_pdf_to_bw(input_file, output_file, progress=progress)
+                error = progress.final_event.error if progress.final_event else None
+                self.conversion_result = (bool(summary), output_file, error)
             except Exception as e:
-                self.root.after(0, lambda: self.conversion_finished(False, None, str(e)))
+                self.conversion_result = (False, None, str(e))
         
-        threading.Thread(target=conversion_thread, daemon=True).start()
+        self.conversion_progress = progress
+        self.conversion_result = None
+        self.conversion_thread = threading.Thread(target=conversion_thread, daemon=True)
+        self.conversion_thread.start()
+        self.root.after(50, self.poll_progress)
     
     def conversion_finished(self, success, output_file=None, error_msg=None):
         """Обработчик завершения конвертации"""
         if success:
             messagebox.showinfo("Успех", f"Конвертация завершена успешно!\nФайл сохранен как: {output_file}")
             self.status_label.config(text="Конвертация завершена")
+        elif self.conversion_progress and self.conversion_progress.cancelled:
+            self.status_label.config(text="Конвертация отменена")
         else:
             if error_msg:
                 messagebox.showerror("Ошибка", f"Произошла ошибка при конвертации: {error_msg}")
@@ -338,4 +416,5 @@ class PDFConverterGUI:
                 self.status_label.config(text="Ошибка конвертации")
         
         self.convert_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
         self.progress_var.set(0)
\ No newline at end of file
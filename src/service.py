@@ -0,0 +1,619 @@
+"""
+Локальный сервис конвертации PDF: очередь заданий и пул прогретых процессов
+
+Сервис принимает задания по HTTP через TCP или Unix-сокет, ставит их в
+очередь с приоритетами и ограничением одновременных заданий одного клиента
+и передает заранее запущенным рабочим процессам, в которых PyMuPDF и Pillow
+уже загружены. Прогресс приходит из процессов событиями ConversionProgress,
+задание можно отменить между страницами.
+
+HTTP API (ответы в JSON, кроме результата):
+    POST   /jobs?size=A4&contrast=1.2&priority=5&client=scan1   тело - PDF
+    GET    /jobs                  список заданий
+    GET    /jobs/<id>             состояние, прогресс, оценка времени, отчет
+    GET    /jobs/<id>/result      результат (application/pdf)
+    DELETE /jobs/<id>             отмена или удаление завершенного задания
+    GET    /health                число процессов и заданий
+    GET    /metrics               замеры этапов и счетчики в формате Prometheus
+
+Параметры задания соответствуют set_output_size и set_image_settings:
+size, preserve_orientation, brightness, contrast, sharpness, quality.
+Задания с большим priority выполняются раньше, при равном - по порядку.
+
+Запуск:
+    pdf-bw-service --port 8765 --workers 4
+    pdf-bw-service --socket /run/pdf-bw.sock
+"""
+
+import argparse
+import asyncio
+import bisect
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from urllib.parse import parse_qs, urlsplit
+
+from .cli import parse_size
+from .converter import ConversionProgress, Instrumentation, PDFToBWConverter, prometheus_text
+
+HTTP_REASONS = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+FINISHED = ("done", "error", "cancelled")
+
+
+def parse_bool(value):
+    """Разбирает логический параметр запроса"""
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise ValueError(f"ожидается true или false, получено {value!r}")
+
+
+# Параметры задания в строке запроса и их типы
+JOB_PARAMETERS = {
+    "size": parse_size,
+    "preserve_orientation": parse_bool,
+    "brightness": float,
+    "contrast": float,
+    "sharpness": float,
+    "quality": int,
+}
+
+
+def parse_job_settings(query):
+    """
+    Разбирает настройки задания из строки запроса
+
+    Returns:
+        tuple: (настройки, клиент, приоритет)
+
+    Raises:
+        ValueError: неизвестный параметр или неверное значение
+    """
+    settings = {}
+    client = "default"
+    priority = 0
+    for name, values in parse_qs(query, keep_blank_values=True).items():
+        value = values[-1]
+        if name == "client":
+            client = value
+        elif name == "priority":
+            priority = int(value)
+        elif name in JOB_PARAMETERS:
+            try:
+                settings[name] = JOB_PARAMETERS[name](value)
+            except argparse.ArgumentTypeError as e:
+                raise ValueError(str(e))
+        else:
+            raise ValueError(f"неизвестный параметр {name!r}")
+    return settings, client, priority
+
+
+def _worker_main(connection, cancel_event):
+    """
+    Рабочий процесс: загружает зависимости заранее и выполняет задания
+
+    Задание - (id, входной файл, выходной файл, настройки); в ответ
+    отправляются события ("progress", id, значение, сообщение, оценка) и
+    итоговое ("done" | "error" | "cancelled", id, отчет или ошибка).
+    """
+    import fitz
+    from PIL import Image
+
+    # Первое обращение загружает модули MuPDF и кодек JPEG
+    fitz.open().close()
+    Image.new("L", (8, 8)).save(io.BytesIO(), "JPEG")
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        job_id, input_path, output_path, settings = task
+        progress = ConversionProgress(
+            max_rate=5,
+            listener=lambda event: connection.send(("progress", job_id, event.value, event.message, event.eta)),
+        )
+        # Отмена приходит из процесса сервиса через общее событие; его сбрасывает
+        # сервис перед отправкой задания, иначе отмена до recv терялась бы
+        progress.cancel_event = cancel_event
+
+        converter = PDFToBWConverter()
+        instrumentation = Instrumentation(keep_spans=False)
+        converter.set_instrumentation(instrumentation)
+        converter.set_output_size(settings.get("size", "original"), settings.get("preserve_orientation", True))
+        converter.set_image_settings(
+            settings.get("brightness", 1.0), settings.get("contrast", 1.0),
+            settings.get("sharpness", 1.0), settings.get("quality", 75),
+        )
+        start = time.perf_counter()
+        try:
+            summary = converter.convert_pdf_to_bw(input_path, output_path, progress=progress)
+            error = progress.final_event.error if progress.final_event else None
+        except Exception as e:
+            summary, error = False, str(e)
+
+        if summary:
+            connection.send(("done", job_id, {
+                "seconds": round(time.perf_counter() - start, 3),
+                "pages": summary.total_pages,
+                "copied_pages": summary.copied_pages,
+                "rendered_pages": summary.rendered_pages,
+                "bytes_out": os.path.getsize(output_path),
+                "metrics": instrumentation.as_dict(spans=False),
+            }))
+        elif progress.cancelled:
+            connection.send(("cancelled", job_id, None))
+        else:
+            connection.send(("error", job_id, error))
+
+
+class _Worker:
+    """Рабочий процесс и поток, читающий его сообщения"""
+
+    def __init__(self, context, on_message):
+        self.connection, child_connection = context.Pipe()
+        self.cancel_event = context.Event()
+        self.process = context.Process(target=_worker_main, args=(child_connection, self.cancel_event), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.job = None
+        self.reader = threading.Thread(target=self._read, args=(on_message,), daemon=True)
+        self.reader.start()
+
+    def _read(self, on_message):
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                on_message(self, None)
+                return
+            on_message(self, message)
+
+    def stop(self):
+        """Завершает процесс после текущего задания"""
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+
+
+class Job:
+    """Задание конвертации и его состояние"""
+
+    def __init__(self, job_id, directory, settings, client="default", priority=0):
+        self.id = job_id
+        self.directory = directory
+        self.settings = settings
+        self.client = client
+        self.priority = priority
+        self.status = "queued"
+        self.progress = 0.0
+        self.message = "В очереди"
+        self.eta = None
+        self.error = None
+        self.report = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.worker = None
+
+    @property
+    def input_path(self):
+        return os.path.join(self.directory, "input.pdf")
+
+    @property
+    def output_path(self):
+        return os.path.join(self.directory, "output.pdf")
+
+    def as_dict(self):
+        """Состояние задания для ответа API"""
+        return {
+            "id": self.id,
+            "client": self.client,
+            "priority": self.priority,
+            "settings": self.settings,
+            "status": self.status,
+            "progress": round(self.progress, 1),
+            "message": self.message,
+            "eta": None if self.eta is None else round(self.eta, 1),
+            "error": self.error,
+            "report": self.report,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class ConversionService:
+    """
+    Очередь заданий и пул прогретых рабочих процессов
+
+    Все методы, кроме shutdown, вызываются в цикле событий asyncio, в котором
+    выполняется start. Сообщения процессов читаются в отдельных потоках и
+    передаются в цикл через call_soon_threadsafe. Процесс, завершившийся с
+    ошибкой, заменяется новым, а его задание отмечается как неудачное.
+    """
+
+    def __init__(self, workers=None, per_client=2, work_dir=None, max_upload=200, keep_finished=1000):
+        """
+        Args:
+            workers: число рабочих процессов (None - по числу ядер)
+            per_client: наибольшее число одновременно выполняемых заданий клиента
+            work_dir: папка для файлов заданий (None - временная)
+            max_upload: наибольший размер загружаемого PDF, МБ
+            keep_finished: сколько завершенных заданий хранить вместе с файлами
+        """
+        self.worker_count = workers or os.cpu_count() or 1
+        self.per_client = per_client
+        self.own_work_dir = work_dir is None
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="pdf-bw-service-")
+        self.max_upload = max_upload * 1024 * 1024
+        self.keep_finished = keep_finished
+        self.jobs = {}
+        self.queue = []
+        self.sequence = itertools.count()
+        self.running = {}
+        self.workers = []
+        self.idle = []
+        self.loop = None
+        self.stopped = None
+        self.context = multiprocessing.get_context()
+        # Суммарные замеры выполненных заданий для /metrics
+        self.metrics = Instrumentation(keep_spans=False)
+
+    async def start(self):
+        """Запускает рабочие процессы"""
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        os.makedirs(self.work_dir, exist_ok=True)
+        for _ in range(self.worker_count):
+            self._spawn_worker()
+
+    def _spawn_worker(self):
+        worker = _Worker(self.context, self._post_message)
+        self.workers.append(worker)
+        self.idle.append(worker)
+
+    def _post_message(self, worker, message):
+        """Передает сообщение процесса в цикл событий (вызывается из потока чтения)"""
+        try:
+            self.loop.call_soon_threadsafe(self._on_message, worker, message)
+        except RuntimeError:
+            # Цикл уже закрыт: процессы завершаются вместе с сервисом
+            pass
+
+    def submit(self, data, settings=None, client="default", priority=0):
+        """Ставит в очередь задание для PDF data и возвращает Job"""
+        job_id = secrets.token_hex(8)
+        job = Job(job_id, os.path.join(self.work_dir, job_id), settings or {}, client, priority)
+        os.makedirs(job.directory)
+        with open(job.input_path, "wb") as input_file:
+            input_file.write(data)
+        self.jobs[job_id] = job
+        self.metrics.count("jobs_submitted")
+        bisect.insort(self.queue, (-priority, next(self.sequence), job_id))
+        self._dispatch()
+        return job
+
+    def _next_job(self):
+        """Первое по приоритету задание клиента, не достигшего ограничения per_client"""
+        for index, (_, _, job_id) in enumerate(self.queue):
+            job = self.jobs[job_id]
+            if self.running.get(job.client, 0) < self.per_client:
+                del self.queue[index]
+                return job
+        return None
+
+    def _dispatch(self):
+        """Передает задания из очереди свободным процессам"""
+        while self.idle:
+            job = self._next_job()
+            if job is None:
+                return
+            worker = self.idle.pop()
+            worker.job = job
+            job.worker = worker
+            job.status = "running"
+            job.message = "Запуск"
+            job.started = time.time()
+            self.running[job.client] = self.running.get(job.client, 0) + 1
+            worker.cancel_event.clear()
+            try:
+                worker.connection.send((job.id, job.input_path, job.output_path, job.settings))
+            except (OSError, ValueError) as e:
+                # Процесс завершился раньше, чем поток чтения сообщил об этом
+                self._replace_worker(worker)
+                self._finish(worker, "error", error=f"рабочий процесс недоступен: {e}")
+
+    def _replace_worker(self, worker):
+        """Убирает процесс из пула и запускает вместо него новый"""
+        self.workers.remove(worker)
+        if worker in self.idle:
+            self.idle.remove(worker)
+        if worker.process.is_alive():
+            worker.process.terminate()
+        if not self.stopped.is_set():
+            self._spawn_worker()
+
+    def _on_message(self, worker, message):
+        job = worker.job
+        if message is None:
+            # Процесс завершился: задание не выполнено, процесс заменяется
+            # (если его еще не заменил _dispatch)
+            if worker not in self.workers:
+                return
+            self._replace_worker(worker)
+            if job is not None:
+                self._finish(worker, "error", error="рабочий процесс завершился аварийно")
+            elif not self.stopped.is_set():
+                self._dispatch()
+            return
+
+        kind, job_id = message[0], message[1]
+        if job is None or job.id != job_id:
+            return
+        if kind == "progress":
+            _, _, job.progress, job.message, job.eta = message
+        elif kind == "done":
+            report = message[2]
+            metrics = report.pop("metrics")
+            self.metrics.merge(metrics)
+            report["stages"] = {stage: round(totals["seconds"], 4) for stage, totals in metrics["stages"].items()}
+            self._finish(worker, "done", report=report)
+        elif kind == "cancelled":
+            self._finish(worker, "cancelled")
+        else:
+            self._finish(worker, "error", error=message[2])
+
+    def _finish(self, worker, status, report=None, error=None):
+        job = worker.job
+        worker.job = None
+        job.worker = None
+        job.status = status
+        job.report = report
+        job.error = error
+        job.eta = None
+        job.finished = time.time()
+        job.message = {"done": "Готово", "cancelled": "Отменено"}.get(status, f"Ошибка: {error}")
+        self.metrics.count(f"jobs_{status}")
+        if status == "done":
+            job.progress = 100.0
+        self.running[job.client] -= 1
+        if worker in self.workers:
+            self.idle.append(worker)
+        self._cleanup()
+        self._dispatch()
+
+    def cancel(self, job_id):
+        """Отменяет задание в очереди или выполняющееся (между страницами)"""
+        job = self.jobs[job_id]
+        if job.status == "queued":
+            self.queue = [entry for entry in self.queue if entry[2] != job_id]
+            job.status = "cancelled"
+            job.message = "Отменено"
+            job.finished = time.time()
+            self.metrics.count("jobs_cancelled")
+        elif job.status == "running":
+            job.worker.cancel_event.set()
+            job.message = "Отмена..."
+        return job
+
+    def remove(self, job_id):
+        """Удаляет завершенное задание и его файлы"""
+        job = self.jobs.pop(job_id)
+        shutil.rmtree(job.directory, ignore_errors=True)
+        return job
+
+    def _cleanup(self):
+        """Удаляет самые старые завершенные задания сверх keep_finished"""
+        finished = [job for job in self.jobs.values() if job.status in FINISHED]
+        finished.sort(key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            self.remove(job.id)
+
+    def health(self):
+        """Сводка состояния сервиса"""
+        return {
+            "workers": len(self.workers),
+            "idle": len(self.idle),
+            "queued": len(self.queue),
+            "running": sum(self.running.values()),
+            "jobs": len(self.jobs),
+        }
+
+    def prometheus(self):
+        """Замеры выполненных заданий и состояние очереди в формате Prometheus"""
+        lines = [prometheus_text(self.metrics).rstrip("\n")]
+        for name, value in self.health().items():
+            lines.append(f"# TYPE pdf_bw_service_{name} gauge")
+            lines.append(f"pdf_bw_service_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def shutdown(self):
+        """Останавливает serve; можно вызывать из любого потока"""
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+    async def close(self):
+        """Завершает рабочие процессы и удаляет временную папку"""
+        self.stopped.set()
+        for worker in self.workers:
+            if worker.job is not None:
+                worker.cancel_event.set()
+            worker.stop()
+        for worker in self.workers:
+            await self.loop.run_in_executor(None, worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        if self.own_work_dir:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def route(self, method, target, body):
+        """
+        Обрабатывает запрос API
+
+        Returns:
+            tuple: (код ответа, тип содержимого, тело)
+        """
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+
+        if parts == ["health"] and method == "GET":
+            return self._json(200, self.health())
+        if parts == ["metrics"] and method == "GET":
+            return 200, "text/plain; version=0.0.4; charset=utf-8", self.prometheus().encode("utf-8")
+        if parts == ["jobs"]:
+            if method == "GET":
+                return self._json(200, [job.as_dict() for job in self.jobs.values()])
+            if method != "POST":
+                return self._json(405, {"error": "метод не поддерживается"})
+            try:
+                settings, client, priority = parse_job_settings(url.query)
+            except ValueError as e:
+                return self._json(400, {"error": str(e)})
+            if not body.startswith(b"%PDF"):
+                return self._json(400, {"error": "тело запроса должно быть PDF файлом"})
+            return self._json(202, self.submit(body, settings, client, priority).as_dict())
+
+        if len(parts) not in (2, 3) or parts[0] != "jobs" or parts[1] not in self.jobs:
+            return self._json(404, {"error": "задание не найдено"})
+        job = self.jobs[parts[1]]
+        if len(parts) == 3:
+            if parts[2] != "result" or method != "GET":
+                return self._json(404, {"error": "неизвестный адрес"})
+            if job.status != "done":
+                return self._json(409, {"error": f"задание в состоянии {job.status}"})
+            with open(job.output_path, "rb") as output_file:
+                return 200, "application/pdf", output_file.read()
+        if method == "GET":
+            return self._json(200, job.as_dict())
+        if method == "DELETE":
+            if job.status in FINISHED:
+                return self._json(200, self.remove(job.id).as_dict())
+            return self._json(200, self.cancel(job.id).as_dict())
+        return self._json(405, {"error": "метод не поддерживается"})
+
+    @staticmethod
+    def _json(status, data):
+        return status, "application/json; charset=utf-8", json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    async def handle_connection(self, reader, writer):
+        """Обрабатывает одно HTTP соединение (один запрос, Connection: close)"""
+        try:
+            request_line = await reader.readline()
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if method == "POST" and "content-length" not in headers:
+                response = self._json(411, {"error": "нужен заголовок Content-Length"})
+            elif int(headers.get("content-length", 0)) > self.max_upload:
+                response = self._json(413, {"error": "файл больше ограничения сервиса"})
+            else:
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    response = self.route(method, target, body)
+                except Exception as e:
+                    print(f"Ошибка обработки запроса {method} {target}:", file=sys.stderr)
+                    traceback.print_exc(file=sys.stderr)
+                    response = self._json(500, {"error": f"внутренняя ошибка сервиса: {e}"})
+        except (ValueError, asyncio.IncompleteReadError):
+            response = self._json(400, {"error": "неверный HTTP запрос"})
+
+        status, content_type, payload = response
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(service, host="127.0.0.1", port=8765, socket_path=None, ready=None):
+    """
+    Запускает сервис и HTTP сервер до вызова service.shutdown
+
+    Args:
+        ready: функция, которой передается адрес сервера после запуска
+    """
+    await service.start()
+    if socket_path:
+        server = await asyncio.start_unix_server(service.handle_connection, path=socket_path)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+    try:
+        address = socket_path or server.sockets[0].getsockname()[:2]
+        if ready:
+            ready(address)
+        await service.stopped.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await service.close()
+
+
+def build_parser():
+    """Создает парсер аргументов командной строки"""
+    parser = argparse.ArgumentParser(prog="pdf-bw-service", description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1", help="адрес для TCP (по умолчанию 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="порт для TCP (по умолчанию 8765)")
+    parser.add_argument("--socket", help="путь Unix-сокета вместо TCP")
+    parser.add_argument("-w", "--workers", type=int, help="число рабочих процессов (по умолчанию по числу ядер)")
+    parser.add_argument("--per-client", type=int, default=2,
+                        help="наибольшее число одновременных заданий одного клиента")
+    parser.add_argument("--work-dir", help="папка для файлов заданий (по умолчанию временная)")
+    parser.add_argument("--max-upload", type=int, default=200, help="наибольший размер PDF, МБ")
+    parser.add_argument("--keep-finished", type=int, default=1000, help="сколько завершенных заданий хранить")
+    return parser
+
+
+def main(argv=None):
+    """Точка входа команды pdf-bw-service"""
+    args = build_parser().parse_args(argv)
+    service = ConversionService(args.workers, args.per_client, args.work_dir, args.max_upload, args.keep_finished)
+
+    def ready(address):
+        print(f"Сервис конвертации слушает {address}, процессов: {service.worker_count}", file=sys.stderr)
+
+    try:
+        asyncio.run(serve(service, args.host, args.port, args.socket, ready))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
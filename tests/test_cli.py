@@ -0,0 +1,167 @@
+"""
+Тесты для консольного интерфейса
+"""
+
+import unittest
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from src import cli
+from tests.test_converter import make_color_pdf
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+
+
+class TestCLI(unittest.TestCase):
+    """Тесты для команды pdf-bw"""
+    
+    def setUp(self):
+        """Настройка перед каждым тестом"""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmp_dir, "in")
+        os.makedirs(os.path.join(self.input_dir, "sub"))
+        shutil.copy2(os.path.join(EXAMPLES_DIR, "cat_bw.pdf"), self.input_dir)
+        make_color_pdf(os.path.join(self.input_dir, "sub", "color.pdf"), pages=2)
+    
+    def tearDown(self):
+        """Удаление временных файлов"""
+        shutil.rmtree(self.tmp_dir)
+    
+    def run_cli(self, *args):
+        """Запускает команду и возвращает код выхода и строки отчета"""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            code = cli.main(list(args))
+        return code, [json.loads(line) for line in output.getvalue().splitlines() if line.startswith("{")]
+    
+    def test_collect_inputs(self):
+        """Тест раскрытия папок и шаблонов glob"""
+        self.assertEqual([name for _, name in cli.collect_inputs([self.input_dir])], ["cat_bw.pdf"])
+        
+        names = [name for _, name in cli.collect_inputs([self.input_dir], recursive=True)]
+        self.assertEqual(names, ["cat_bw.pdf", os.path.join("sub", "color.pdf")])
+        
+        pattern = os.path.join(self.input_dir, "**", "*.pdf")
+        self.assertEqual(len(cli.collect_inputs([pattern, self.input_dir])), 2)
+    
+    def test_parse_size(self):
+        """Тест разбора размера страницы"""
+        self.assertEqual(cli.parse_size("A4"), "A4")
+        self.assertEqual(cli.parse_size("500x700"), (500.0, 700.0))
+    
+    def test_batch_conversion_report_and_skip(self):
+        """Тест пакетной конвертации, отчета и пропуска актуальных результатов"""
+        output_dir = os.path.join(self.tmp_dir, "out")
+        report_path = os.path.join(self.tmp_dir, "report.json")
+        code, reports = self.run_cli(self.input_dir, "-o", output_dir, "-r", "--jobs", "2", "--report", report_path)
+        
+        self.assertEqual(code, 0)
+        by_input = {os.path.basename(report["input"]): report for report in reports}
+        self.assertEqual(by_input["cat_bw.pdf"]["status"], "copied")
+        self.assertEqual(by_input["color.pdf"]["status"], "converted")
+        self.assertEqual(by_input["color.pdf"]["rendered_pages"], 2)
+        self.assertEqual(by_input["color.pdf"]["codecs"]["jpeg"]["pages"], 2)
+        self.assertEqual(by_input["color.pdf"]["duplicate_pages"], 0)
+        self.assertTrue(os.path.exists(os.path.join(output_dir, "sub", "color.pdf")))
+        with open(report_path, encoding="utf-8") as report_file:
+            self.assertEqual(len(json.load(report_file)), 2)
+        
+        code, reports = self.run_cli(self.input_dir, "-o", output_dir, "-r")
+        self.assertEqual([report["status"] for report in reports], ["skipped", "skipped"])
+        
+        # С другими настройками результаты конвертируются заново
+        code, reports = self.run_cli(self.input_dir, "-o", output_dir, "-r", "--contrast", "1.5")
+        self.assertEqual(sorted(report["status"] for report in reports), ["converted", "copied"])
+        code, reports = self.run_cli(self.input_dir, "-o", output_dir, "-r", "--page-settings", "1:dpi=100")
+        self.assertNotIn("skipped", [report["status"] for report in reports])
+        code, reports = self.run_cli(self.input_dir, "-o", output_dir, "-r", "--page-settings", "1:dpi=100")
+        self.assertEqual([report["status"] for report in reports], ["skipped", "skipped"])
+    
+    def test_jobs_with_page_workers(self):
+        """Тест пакетной конвертации в нескольких процессах с процессами страниц"""
+        output_dir = os.path.join(self.tmp_dir, "out")
+        make_color_pdf(os.path.join(self.input_dir, "second.pdf"), pages=3)
+        code, reports = self.run_cli(self.input_dir, "-o", output_dir, "-r", "--jobs", "2", "--page-workers", "2")
+        
+        self.assertEqual(code, 0)
+        by_input = {os.path.basename(report["input"]): report for report in reports}
+        self.assertEqual((by_input["color.pdf"]["status"], by_input["color.pdf"]["rendered_pages"]), ("converted", 2))
+        self.assertEqual((by_input["second.pdf"]["status"], by_input["second.pdf"]["rendered_pages"]), ("converted", 3))
+    
+    def test_outputs_next_to_inputs_are_not_reconverted(self):
+        """Тест пропуска результатов предыдущего запуска при выводе рядом с исходными"""
+        self.run_cli(self.input_dir)
+        self.assertTrue(os.path.exists(os.path.join(self.input_dir, "cat_bw_bw.pdf")))
+        
+        self.assertEqual([name for _, name in cli.collect_inputs([self.input_dir], skip_suffix="_bw")],
+                         ["cat_bw.pdf"])
+    
+    def test_result_cache(self):
+        """Тест повторной конвертации через кэш результатов"""
+        output_dir = os.path.join(self.tmp_dir, "out")
+        cache_dir = os.path.join(self.tmp_dir, "cache")
+        color_dir = os.path.join(self.input_dir, "sub")
+        
+        _, reports = self.run_cli(color_dir, "-o", output_dir, "--cache-dir", cache_dir)
+        self.assertEqual(reports[0]["cache"], "miss")
+        _, reports = self.run_cli(color_dir, "-o", output_dir, "--cache-dir", cache_dir, "--force")
+        self.assertEqual(reports[0]["cache"], "hit")
+        self.assertEqual(reports[0]["rendered_pages"], 2)
+    
+    def test_incremental_page_settings(self):
+        """Тест повторной конвертации с настройками для диапазона страниц"""
+        output_dir = os.path.join(self.tmp_dir, "out")
+        color_dir = os.path.join(self.input_dir, "sub")
+        
+        self.run_cli(color_dir, "-o", output_dir, "--incremental")
+        _, reports = self.run_cli(color_dir, "-o", output_dir, "--incremental", "--page-settings", "2:contrast=1.5")
+        self.assertEqual(reports[0]["rendered_pages"], 1)
+        self.assertEqual(reports[0]["reused_pages"], 1)
+        
+        # Значения вне допустимых границ ограничиваются, как и общие настройки
+        _, reports = self.run_cli(color_dir, "-o", output_dir, "--incremental", "--page-settings", "1:gamma=0,dpi=0")
+        self.assertEqual(reports[0]["status"], "converted")
+    
+    def test_journal(self):
+        """Тест конвертации с журналом: после успешного завершения журнал удаляется"""
+        journal_dir = os.path.join(self.tmp_dir, "journal")
+        color_dir = os.path.join(self.input_dir, "sub")
+        
+        _, reports = self.run_cli(color_dir, "-o", os.path.join(self.tmp_dir, "out"), "--journal-dir", journal_dir)
+        self.assertEqual(reports[0]["status"], "converted")
+        self.assertEqual(reports[0]["resumed_pages"], 0)
+        self.assertEqual(os.listdir(journal_dir), [])
+    
+    def test_metrics_export(self):
+        """Тест замеров этапов в отчете, JSON lines и формате Prometheus"""
+        metrics_path = os.path.join(self.tmp_dir, "metrics.jsonl")
+        prometheus_path = os.path.join(self.tmp_dir, "metrics.prom")
+        color_dir = os.path.join(self.input_dir, "sub")
+        
+        _, reports = self.run_cli(color_dir, "-o", os.path.join(self.tmp_dir, "out"),
+                                  "--metrics", metrics_path, "--prometheus", prometheus_path)
+        self.assertEqual(reports[0]["stages"]["render"]["count"], 2)
+        self.assertNotIn("metrics", reports[0])
+        with open(metrics_path, encoding="utf-8") as metrics_file:
+            records = [json.loads(line) for line in metrics_file]
+        self.assertEqual(len([record for record in records if record.get("stage") == "encode"]), 2)
+        self.assertEqual(records[-1]["type"], "summary")
+        with open(prometheus_path, encoding="utf-8") as prometheus_file:
+            self.assertIn("pdf_bw_pages_rasterized_total 2\n", prometheus_file.read())
+    
+    def test_import_does_not_load_tkinter(self):
+        """Тест импорта без tkinter"""
+        repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+        result = subprocess.run(
+            [sys.executable, "-c", "import sys, src.cli; print('tkinter' in sys.modules)"],
+            cwd=repo_dir, check=True, capture_output=True, text=True,
+        )
+        self.assertEqual(result.stdout.split()[-1], "False")
+
+if __name__ == "__main__":
+    unittest.main()
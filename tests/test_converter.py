@@ -3,10 +3,74 @@
 """
 
 import unittest
+import io
+import multiprocessing
 import os
+import subprocess
+import sys
 import tempfile
+import fitz
+from PIL import Image
 from src.converter import PDFToBWConverter
 
+
+def make_color_pdf(path, pages=4):
+    """Создает цветной PDF с заданным количеством страниц"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page(width=300, height=400)
+        page.draw_rect(fitz.Rect(20, 20, 280, 200), color=(1, 0, 0), fill=(0, 0.5, 1))
+        page.insert_text((40, 300), f"Page {page_num + 1}", fontsize=24, color=(0, 0.6, 0))
+    doc.save(path)
+    doc.close()
+
+
+def make_text_pdf(path, pages=10, color_pages=()):
+    """Создает текстовый PDF, в котором цветной текст только на страницах color_pages"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page(width=300, height=400)
+        page.draw_rect(fitz.Rect(20, 20, 280, 60), color=(0.3, 0.3, 0.3), fill=(0.9, 0.9, 0.9))
+        color = (0, 0, 1) if page_num in color_pages else (0, 0, 0)
+        page.insert_text((40, 300), f"Page {page_num + 1}", fontsize=24, color=color)
+    doc.save(path)
+    doc.close()
+
+
+def convert_with_page_workers(paths):
+    """Конвертация с workers=2 (выполняется в рабочем процессе multiprocessing.Pool)"""
+    converter = PDFToBWConverter()
+    converter.set_workers(2)
+    return converter.convert_pdf_to_bw(*paths).rendered_pages
+
+
+# Конвертация в отдельном процессе, чтобы пиковый RSS не зависел от других тестов
+STREAMING_SCRIPT = """
+import random, resource, sys
+import fitz
+sys.path.insert(0, sys.argv[1])
+from src.converter import PDFToBWConverter
+
+input_path, output_path, pages = sys.argv[2], sys.argv[3], int(sys.argv[4])
+rnd = random.Random(1)
+noise = fitz.Pixmap(fitz.csRGB, 600, 800, bytes(rnd.getrandbits(8) for _ in range(600 * 800 * 3)), False)
+doc = fitz.open()
+xref = 0
+for page_num in range(pages):
+    page = doc.new_page(width=300, height=400)
+    xref = page.insert_image(page.rect, xref=xref) if xref else page.insert_image(page.rect, pixmap=noise)
+    page.insert_text((20, 200), f"Page {page_num}", fontsize=40)
+doc.save(input_path)
+doc.close()
+
+converter = PDFToBWConverter()
+converter.set_memory_limit(4)
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+assert converter.convert_pdf_to_bw(input_path, output_path)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before)
+"""
+
+
 class TestPDFToBWConverter(unittest.TestCase):
     """Тесты для класса PDFToBWConverter"""
     
@@ -48,5 +112,914 @@ class TestPDFToBWConverter(unittest.TestCase):
         self.converter.set_image_settings(brightness=-1.0)  # Должно быть ограничено до 0.1
         self.assertEqual(self.converter.brightness, 0.1)
 
+    def test_parallel_conversion_matches_sequential(self):
+        """Тест побайтовой идентичности параллельной и последовательной конвертации"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "color.pdf")
+            make_color_pdf(input_path, pages=5)
+            
+            sequential_path = os.path.join(tmp_dir, "sequential.pdf")
+            self.assertTrue(self.converter.convert_pdf_to_bw(input_path, sequential_path))
+            
+            progress = []
+            self.converter.set_workers(2)
+            parallel_path = os.path.join(tmp_dir, "parallel.pdf")
+            self.assertTrue(self.converter.convert_pdf_to_bw(
+                input_path, parallel_path, progress_callback=lambda value, message: progress.append(value)
+            ))
+            
+            with open(sequential_path, "rb") as f1, open(parallel_path, "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+            self.assertEqual(progress, [0, 0, 20, 40, 60, 80, 100])
+            
+            # В демоническом процессе пула страницы рендерятся последовательно
+            pool_path = os.path.join(tmp_dir, "pool.pdf")
+            with multiprocessing.Pool(1) as pool:
+                self.assertEqual(pool.apply(convert_with_page_workers, ((input_path, pool_path),)), 5)
+            with open(sequential_path, "rb") as f1, open(pool_path, "rb") as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_is_already_grayscale_tolerance(self):
+        """Тест допуска на шум JPEG при определении черно-белого изображения"""
+        noisy_gray = Image.new("RGB", (200, 100), (120, 123, 118))
+        self.assertTrue(self.converter.is_already_grayscale(noisy_gray))
+        self.assertFalse(self.converter.is_already_grayscale(noisy_gray, tolerance=0))
+        self.assertTrue(self.converter.is_already_grayscale(Image.new("L", (10, 10))))
+    
+    def test_is_already_grayscale_threshold(self):
+        """Тест порога доли цветных пикселей"""
+        image = Image.new("RGB", (100, 100), (255, 255, 255))
+        image.paste((255, 0, 0), (0, 0, 100, 3))
+        self.assertTrue(self.converter.is_already_grayscale(image, threshold=0.95))
+        image.paste((255, 0, 0), (0, 90, 100, 100))
+        self.assertFalse(self.converter.is_already_grayscale(image, threshold=0.95))
+        self.assertFalse(self.converter.is_already_grayscale(image, threshold=0.95, band_height=1))
+
+    def test_content_analysis_checks_every_page(self):
+        """Тест определения цветной страницы в середине документа без рендеринга"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            gray_path = os.path.join(tmp_dir, "gray.pdf")
+            make_text_pdf(gray_path, pages=10)
+            self.assertEqual(self.converter.check_pdf_is_grayscale(gray_path), (True, 10, 10))
+            
+            mixed_path = os.path.join(tmp_dir, "mixed.pdf")
+            make_text_pdf(mixed_path, pages=10, color_pages=(4,))
+            self.assertEqual(self.converter.check_pdf_is_grayscale(mixed_path), (False, 9, 10))
+            self.assertEqual(self.converter.check_pdf_is_grayscale(mixed_path, analysis="raster"), (True, 3, 3))
+            
+            doc = fitz.open(mixed_path)
+            self.assertEqual(self.converter.analyze_page_colors(doc[0]), "gray")
+            self.assertEqual(self.converter.analyze_page_colors(doc[4]), "color")
+            doc.close()
+    
+    def test_content_analysis_falls_back_to_raster_for_images(self):
+        """Тест растровой проверки страниц с RGB изображениями"""
+        examples_dir = os.path.join(os.path.dirname(__file__), "..", "examples")
+        color_doc = fitz.open(os.path.join(examples_dir, "cat_color.pdf"))
+        bw_doc = fitz.open(os.path.join(examples_dir, "cat_bw.pdf"))
+        
+        self.assertEqual(self.converter.analyze_page_colors(color_doc[0]), "unknown")
+        self.assertEqual(self.converter.classify_pages(color_doc), ["color"])
+        self.assertEqual(self.converter.analyze_page_colors(bw_doc[0]), "gray")
+        
+        color_doc.close()
+        bw_doc.close()
+
+    def test_gray_pages_are_copied_without_rendering(self):
+        """Тест копирования черно-белых страниц с сохранением текстового слоя"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "mixed.pdf")
+            make_text_pdf(input_path, pages=4, color_pages=(1,))
+            
+            messages = []
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            summary = self.converter.convert_pdf_to_bw(
+                input_path, output_path, progress_callback=lambda value, message: messages.append(message)
+            )
+            
+            self.assertEqual((summary.copied_pages, summary.rendered_pages), (3, 1))
+            self.assertFalse(summary.file_copied)
+            self.assertIn("(рендеринг)", messages[2])
+            self.assertIn("Скопировано страниц: 3, отрендерено: 1", messages[-1])
+            
+            doc = fitz.open(output_path)
+            self.assertEqual(len(doc), 4)
+            self.assertIn("Page 1", doc[0].get_text())
+            self.assertEqual(doc[1].get_text().strip(), "")
+            doc.close()
+            
+            self.converter.set_pass_through(False)
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual((summary.copied_pages, summary.rendered_pages), (0, 4))
+
+    def test_page_with_small_color_image_is_not_copied(self):
+        """Тест, что текстовая страница с небольшим цветным логотипом не копируется в цвете"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "logo.pdf")
+            make_text_pdf(input_path, pages=2, color_pages=(0,))
+            logo = io.BytesIO()
+            Image.new("RGB", (60, 60), (255, 0, 0)).save(logo, "PNG")
+            doc = fitz.open(input_path)
+            doc[1].insert_image(fitz.Rect(200, 100, 260, 160), stream=logo.getvalue())
+            doc.saveIncr()
+            doc.close()
+            
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual((summary.copied_pages, summary.rendered_pages), (0, 2))
+            
+            doc = fitz.open(output_path)
+            pix = doc[1].get_pixmap()
+            red, green, blue = pix.pixel(230, 130)
+            self.assertEqual(red, green)
+            self.assertEqual(green, blue)
+            doc.close()
+    
+    def test_vector_engine_rewrites_colors(self):
+        """Тест перезаписи цветов без рендеринга с рендерингом страниц, которые перевести нельзя"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "color.pdf")
+            make_color_pdf(input_path, pages=3)
+            doc = fitz.open(input_path)
+            doc[2].add_highlight_annot(fitz.Rect(40, 280, 150, 310))
+            doc.saveIncr()
+            doc.close()
+            
+            self.assertFalse(self.converter.set_engine("unknown"))
+            self.assertTrue(self.converter.set_engine("vector"))
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual((summary.rewritten_pages, summary.rendered_pages), (2, 1))
+            
+            doc = fitz.open(output_path)
+            self.assertIn("Page 1", doc[0].get_text())
+            self.assertNotIn(b" rg", doc[0].read_contents())
+            self.assertEqual(self.converter.classify_pages(doc), ["gray", "gray", "gray"])
+            doc.close()
+
+    def test_streaming_output_keeps_memory_bounded(self):
+        """Тест конвертации большого документа частями при ограничении памяти"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "large.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+            result = subprocess.run(
+                [sys.executable, "-c", STREAMING_SCRIPT, repo_dir, input_path, output_path, "120"],
+                check=True, capture_output=True, text=True,
+            )
+            rss_growth = int(result.stdout.split()[-1]) * 1024
+            output_size = os.path.getsize(output_path)
+            
+            self.assertGreater(output_size, 20 * 1024 * 1024)
+            self.assertLess(rss_growth, output_size / 2)
+            self.assertFalse(os.path.exists(output_path + ".part"))
+            doc = fitz.open(output_path)
+            self.assertEqual(len(doc), 120)
+            doc.close()
+
+    def test_render_dpi_policies(self):
+        """Тест выбора разрешения рендеринга по политике"""
+        examples_dir = os.path.join(os.path.dirname(__file__), "..", "examples")
+        scan_doc = fitz.open(os.path.join(examples_dir, "cat_color.pdf"))
+        text_doc = fitz.open()
+        text_doc.new_page().insert_text((50, 50), "text")
+        
+        self.assertEqual(self.converter.get_render_dpi(scan_doc[0]), 144)
+        self.assertFalse(self.converter.set_resolution("unknown"))
+        
+        self.assertTrue(self.converter.set_resolution("native", dpi=200))
+        # Изображение 1500 пикселей по ширине страницы 842 пт - около 128 dpi
+        self.assertAlmostEqual(self.converter.get_render_dpi(scan_doc[0]), 1500 / 842 * 72, places=3)
+        self.assertAlmostEqual(self.converter.get_render_dpi(scan_doc[0], scale=0.5), 1500 / 842 * 144, places=3)
+        self.assertEqual(self.converter.get_render_dpi(text_doc[0]), 200)
+        
+        self.converter.set_resolution("native", dpi=200, max_dpi=100)
+        self.assertEqual(self.converter.get_render_dpi(scan_doc[0]), 100)
+        
+        self.converter.set_resolution("native")
+        width, height, _ = self.converter.render_page(scan_doc[0])
+        self.assertEqual((width, height), (842, 595))
+        scan_doc.close()
+        text_doc.close()
+
+    def test_enhancement_lut_matches_image_enhance(self):
+        """Тест совпадения таблицы улучшений с цепочкой ImageEnhance"""
+        from PIL import ImageEnhance
+        from src.converter import enhance_grayscale
+        
+        examples_dir = os.path.join(os.path.dirname(__file__), "..", "examples")
+        doc = fitz.open(os.path.join(examples_dir, "cat_color.pdf"))
+        image = doc[0].get_pixmap(colorspace=fitz.csGRAY).pil_image().convert("L")
+        doc.close()
+        
+        for brightness, contrast, sharpness in [(1.0, 1.0, 1.0), (1.3, 0.7, 1.0), (0.6, 2.5, 1.8)]:
+            expected = image
+            if brightness != 1.0:
+                expected = ImageEnhance.Brightness(expected).enhance(brightness)
+            if contrast != 1.0:
+                expected = ImageEnhance.Contrast(expected).enhance(contrast)
+            if sharpness != 1.0:
+                expected = ImageEnhance.Sharpness(expected).enhance(sharpness)
+            result = enhance_grayscale(image, brightness, contrast, sharpness)
+            self.assertEqual(list(result.getdata()), list(expected.getdata()))
+        
+        self.converter.set_levels(black_point=50, white_point=200, gamma=1.0)
+        ramp = Image.frombytes("L", (256, 1), bytes(range(256)))
+        leveled = list(self.converter.apply_image_enhancements(ramp).getdata())
+        self.assertEqual(leveled[:51], [0] * 51)
+        self.assertEqual(leveled[200:], [255] * 56)
+        self.assertEqual(leveled, sorted(leveled))
+        self.assertEqual(self.converter.get_settings()["white_point"], 200)
+
+    def test_bilevel_output(self):
+        """Тест однобитного вывода с сжатием CCITT Group 4"""
+        from PIL import features
+        from src.converter import otsu_threshold
+        
+        histogram = [0] * 256
+        histogram[20] = 100
+        histogram[230] = 900
+        self.assertTrue(20 <= otsu_threshold(histogram) < 230)
+        self.assertFalse(self.converter.set_output_format("bilevel", "unknown"))
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "text.pdf")
+            jpeg_path = os.path.join(tmp_dir, "jpeg.pdf")
+            make_text_pdf(input_path, pages=3, color_pages=(0, 1, 2))
+            self.converter.set_pass_through(False)
+            self.assertTrue(self.converter.convert_pdf_to_bw(input_path, jpeg_path))
+            with fitz.open(input_path) as source:
+                source_samples = source[0].get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY).samples
+            dark = [index for index, value in enumerate(source_samples) if value < 128]
+            self.assertGreater(sum(source_samples) / len(source_samples), 240)
+            # Без libtiff однобитное изображение сжимается без потерь через PNG
+            expected_filter = "/CCITTFaxDecode" if features.check("libtiff") else "/FlateDecode"
+            
+            for binarization in ("otsu", "adaptive", "dither"):
+                output_path = os.path.join(tmp_dir, f"{binarization}.pdf")
+                self.assertTrue(self.converter.set_output_format("bilevel", binarization))
+                summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+                self.assertEqual(summary.rendered_pages, 3)
+                
+                doc = fitz.open(output_path)
+                xref = doc[0].get_images()[0][0]
+                self.assertEqual(doc.xref_get_key(xref, "Filter"), ("name", expected_filter))
+                self.assertEqual(doc.xref_get_key(xref, "BitsPerComponent"), ("int", "1"))
+                # Страница отрендерена в масштабе 2.0 (144 dpi), пиксели совпадают 1:1
+                samples = doc[0].get_pixmap(matrix=fitz.Matrix(2, 2), colorspace=fitz.csGRAY).samples
+                self.assertEqual(set(samples) - {0, 255}, set())
+                self.assertIn(0, set(samples))
+                # Полярность не инвертирована (/BlackIs1, /Decode): белый фон остается
+                # белым, а темный текст исходной страницы - черным
+                self.assertGreater(sum(samples) / len(samples), 240)
+                self.assertGreater(sum(1 for index in dark if samples[index] == 0), len(dark) * 0.8)
+                doc.close()
+                if binarization != "dither":
+                    self.assertLess(os.path.getsize(output_path), os.path.getsize(jpeg_path) / 3)
+
+    def test_auto_codec_selection(self):
+        """Тест выбора кодека для каждой страницы по содержимому"""
+        from src.converter import pixmap_to_image, select_codec
+        
+        examples_dir = os.path.join(os.path.dirname(__file__), "..", "examples")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "mixed.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            make_text_pdf(input_path, pages=1, color_pages=(0,))
+            doc = fitz.open(input_path)
+            doc.insert_pdf(fitz.open(os.path.join(examples_dir, "cat_color.pdf")))
+            chart = doc.new_page(width=300, height=400)
+            for index in range(4):
+                chart.draw_rect(fitz.Rect(20 + index * 60, 100, 70 + index * 60, 380), width=0,
+                                fill=(index / 4, 0.5, 1 - index / 4))
+            doc.saveIncr()
+            doc.close()
+            
+            self.assertTrue(self.converter.set_output_format("auto"))
+            self.converter.set_pass_through(False)
+            # Эталон ниже рендерится с ICC, как и страницы при set_color_management(True)
+            self.converter.set_color_management(True)
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual([codec for codec, _ in summary.page_codecs.values()], ["bilevel", "jpeg", "flate"])
+            self.assertEqual(summary.codec_totals()["jpeg"][0], 1)
+            
+            # Страница с заливками встроена без потерь
+            source = fitz.open(input_path)
+            result = fitz.open(output_path)
+            matrix = fitz.Matrix(2, 2)
+            expected = source[2].get_pixmap(matrix=matrix, colorspace=fitz.csGRAY)
+            actual = result[2].get_pixmap(matrix=matrix, colorspace=fitz.csGRAY)
+            self.assertEqual(actual.samples, expected.samples)
+            self.assertEqual(select_codec(pixmap_to_image(expected).histogram()), "flate")
+            source.close()
+            result.close()
+
+    def test_color_management_scope(self):
+        """Тест, что ICC отключается только на время рендеринга конвертера"""
+        from src.converter import _without_icc
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            make_color_pdf(input_path, pages=1)
+            with fitz.open(input_path) as doc:
+                before = doc[0].get_pixmap(colorspace=fitz.csGRAY).samples
+                with _without_icc():
+                    without_icc = doc[0].get_pixmap(colorspace=fitz.csGRAY).samples
+                    with _without_icc():
+                        pass
+                    self.assertEqual(doc[0].get_pixmap(colorspace=fitz.csGRAY).samples, without_icc)
+            self.assertNotEqual(before, without_icc)
+            
+            self.converter.set_pass_through(False)
+            self.assertTrue(self.converter.convert_pdf_to_bw(input_path, output_path))
+            with fitz.open(input_path) as doc:
+                self.assertEqual(doc[0].get_pixmap(colorspace=fitz.csGRAY).samples, before)
+    
+    def test_quality_target(self):
+        """Тест подбора качества JPEG под размер файла и PSNR"""
+        from src.converter import allocate_page_budgets, psnr
+        
+        self.assertEqual(allocate_page_budgets({0: 10, 1: 50}, 100), {})
+        self.assertEqual(allocate_page_budgets({0: 10, 1: 50, 2: 80}, 100), {1: 45, 2: 45})
+        
+        examples_dir = os.path.join(os.path.dirname(__file__), "..", "examples")
+        input_path = os.path.join(examples_dir, "cat_color.pdf")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual(summary.page_qualities, {0: 75})
+            self.assertIsNone(summary.target_met)
+            full_size = os.path.getsize(output_path)
+            
+            self.converter.set_quality_target(max_bytes=full_size // 2)
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertTrue(summary.target_met)
+            self.assertLessEqual(os.path.getsize(output_path), full_size // 2)
+            self.assertLess(summary.page_qualities[0], 75)
+            
+            self.converter.set_quality_target(max_bytes=1000)
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertFalse(summary.target_met)
+            self.assertEqual(summary.page_qualities[0], 10)
+            
+            self.converter.set_quality_target(min_psnr=30)
+            doc = fitz.open(input_path)
+            image = self.converter.apply_image_enhancements(doc[0].get_pixmap(colorspace=fitz.csGRAY).pil_image())
+            doc.close()
+            data, quality = self.converter.search_jpeg_quality(image, min_psnr=30)
+            self.assertGreaterEqual(psnr(image, Image.open(io.BytesIO(data))), 30)
+            self.assertLess(quality, 75)
+            if quality > 10:
+                lower, _ = self.converter.search_jpeg_quality(image, max_bytes=len(data) - 1)
+                self.assertLess(psnr(image, Image.open(io.BytesIO(lower))), 30)
+
+    def test_preview_renderer_cache(self):
+        """Тест кэша предпросмотра: попадания, вытеснение, фоновый рендеринг и смена файла"""
+        import time
+        from src.converter import PreviewRenderer
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            make_text_pdf(input_path, pages=6)
+            
+            preview = PreviewRenderer(prefetch=0)
+            self.assertEqual(preview.open(input_path), 6)
+            first = preview.get_page(0)
+            self.assertEqual(first.mode, "L")
+            self.assertIs(preview.get_page(0), first)
+            self.assertIs(preview.get_cached(0), first)
+            self.assertIsNone(preview.get_cached(1))
+            self.assertEqual((preview.hits, preview.misses), (2, 1))
+            
+            # Ограничение памяти в две страницы: первая вытесняется
+            preview.memory_limit = first.width * first.height * 2
+            preview.get_page(1)
+            preview.get_page(2)
+            self.assertIsNone(preview.get_cached(0))
+            self.assertIsNotNone(preview.get_cached(2))
+            preview.close()
+            
+            preview = PreviewRenderer(prefetch=2)
+            preview.open(input_path)
+            preview.get_page(2)
+            deadline = time.time() + 5
+            while len(preview.cache) < 5 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(sorted(page_num for page_num, _ in preview.cache), [0, 1, 2, 3, 4])
+            
+            # Файл заменен: кэш сбрасывается, документ открывается заново
+            make_text_pdf(input_path, pages=3)
+            stat = os.stat(input_path)
+            os.utime(input_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            self.assertIsNone(preview.get_cached(1))
+            self.assertEqual(preview.page_count, 3)
+            preview.close()
+    
+    def test_preview_renderer_errors(self):
+        """Тест запросов предпросмотра без документа и после ошибки запроса"""
+        import time
+        from src.converter import PreviewRenderer
+        
+        preview = PreviewRenderer(prefetch=1)
+        with self.assertRaisesRegex(RuntimeError, "не открыт"):
+            preview.get_page(0)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            make_text_pdf(input_path, pages=4)
+            preview.open(input_path)
+            preview.get_page(0)
+            deadline = time.time() + 5
+            while 1 not in [page_num for page_num, _ in list(preview.cache)] and time.time() < deadline:
+                time.sleep(0.01)
+            
+            # Фоновый поток ждет окончания запроса и продолжает работу после ошибки
+            with self.assertRaises(ValueError):
+                with preview._request():
+                    preview.pending = [3]
+                    raise ValueError("ошибка запроса")
+            deadline = time.time() + 5
+            while 3 not in [page_num for page_num, _ in list(preview.cache)] and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertIn(3, [page_num for page_num, _ in preview.cache])
+            
+            preview.close()
+            with self.assertRaisesRegex(RuntimeError, "не открыт"):
+                preview.get_page(0)
+
+    def test_preview_pipeline_latest_wins(self):
+        """Тест фоновой обработки предпросмотра: обрабатывается последний запрос"""
+        import threading
+        import time
+        from src.converter import PreviewPipeline
+        
+        processed = []
+        delivered = []
+        done = threading.Event()
+        
+        def process(image, value):
+            processed.append(value)
+            time.sleep(0.02)
+            return image + value
+        
+        def deliver(generation, result, submitted):
+            delivered.append((generation, result))
+            if result == 100 + 49:
+                done.set()
+        
+        pipeline = PreviewPipeline(process, deliver)
+        for value in range(50):
+            generation = pipeline.submit(100, value)
+        self.assertTrue(done.wait(5))
+        pipeline.close()
+        
+        self.assertEqual(delivered[-1], (generation, 149))
+        generations = [number for number, _ in delivered]
+        self.assertEqual(generations, sorted(generations))
+        self.assertLess(len(processed), 50)
+        self.assertEqual(processed[-1], 49)
+        self.assertGreater(pipeline.dropped, 0)
+        
+        self.assertIsNone(pipeline.latency_stats())
+        pipeline.displayed(time.perf_counter() - 0.01)
+        median, worst = pipeline.latency_stats()
+        self.assertGreaterEqual(worst, 10)
+
+    def test_preview_pipeline_cancels_stale_work(self):
+        """Тест прерывания обработки, результат которой был бы отброшен"""
+        import threading
+        import time
+        from src.converter import PreviewPipeline
+        
+        started = threading.Event()
+        steps = []
+        delivered = []
+        done = threading.Event()
+        
+        def process(image, value, check):
+            for step in range(20):
+                check()
+                steps.append((value, step))
+                started.set()
+                time.sleep(0.01)
+            return value
+        
+        def deliver(generation, result, submitted):
+            delivered.append(result)
+            done.set()
+        
+        pipeline = PreviewPipeline(process, deliver, refresh_interval=60, cancellable=True)
+        pipeline.last_delivery = time.perf_counter()
+        pipeline.submit(None, 1)
+        self.assertTrue(started.wait(5))
+        pipeline.submit(None, 2)
+        self.assertTrue(done.wait(5))
+        pipeline.close()
+        
+        self.assertEqual(delivered, [2])
+        self.assertEqual(pipeline.cancelled, 1)
+        self.assertLess(len([value for value, _ in steps if value == 1]), 20)
+        self.assertEqual(len([value for value, _ in steps if value == 2]), 20)
+    
+    def test_progress_throttling_and_eta(self):
+        """Тест очереди событий прогресса: ограничение частоты, время страниц и оценка"""
+        from src.converter import ConversionProgress
+        
+        progress = ConversionProgress(max_rate=10)
+        for page in range(1, 6):
+            progress.report(page * 20, f"Страница {page}", page, 5)
+        events = progress.poll()
+        
+        # Первое событие передается сразу, остальные заменяются последним
+        self.assertEqual([event.page for event in events], [1, 5])
+        self.assertEqual(len(progress.page_times), 4)
+        self.assertIsNotNone(events[-1].eta)
+        self.assertEqual(progress.poll(), [])
+        
+        progress.report(100, "Готово", final=True)
+        events = progress.poll()
+        self.assertTrue(events[-1].final)
+        self.assertIs(progress.final_event, events[-1])
+        self.assertEqual(len(progress.page_times), 5)
+
+    def test_conversion_cancel_removes_partial_output(self):
+        """Тест отмены конвертации между страницами"""
+        from src.converter import ConversionProgress
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            make_color_pdf(input_path, pages=6)
+            
+            part_written = []
+            
+            def listener(event):
+                if event.page == 4:
+                    part_written.append(os.path.exists(output_path + ".part"))
+                    progress.cancel()
+            
+            # Ограничение памяти в 1 КБ заставляет писать результат во временный файл
+            self.converter.set_memory_limit(-1)
+            self.assertEqual(self.converter.memory_limit, 1 / 1024)
+            self.converter.set_memory_limit(0)
+            self.assertIsNone(self.converter.memory_limit)
+            self.converter.set_memory_limit(1 / 1024)
+            progress = ConversionProgress(max_rate=0, listener=listener)
+            self.assertFalse(self.converter.convert_pdf_to_bw(input_path, output_path, progress=progress))
+            
+            self.assertTrue(progress.cancelled)
+            self.assertEqual(progress.final_event.message, "Конвертация отменена")
+            self.assertIsNone(progress.final_event.error)
+            self.assertEqual(part_written, [True])
+            self.assertEqual(os.listdir(tmp_dir), ["input.pdf"])
+            
+            pages = [event.page for event in progress.poll() if event.page]
+            self.assertEqual(pages, [1, 2, 3, 4])
+            
+            # Прерванная конвертация не мешает следующей
+            progress = ConversionProgress()
+            self.assertTrue(self.converter.convert_pdf_to_bw(input_path, output_path, progress=progress))
+            self.assertIsNone(progress.final_event.error)
+
+    def test_result_cache(self):
+        """Тест кэша результатов: документы по содержимому, общие страницы, вытеснение"""
+        from src.converter import ResultCache
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            copy_path = os.path.join(tmp_dir, "copy.pdf")
+            edited_path = os.path.join(tmp_dir, "edited.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            cache_dir = os.path.join(tmp_dir, "cache")
+            make_color_pdf(input_path, pages=4)
+            with open(input_path, "rb") as source, open(copy_path, "wb") as copy:
+                copy.write(source.read())
+            
+            # Страницы в другом порядке, одна изменена, объекты перенумерованы
+            doc = fitz.open(input_path)
+            doc.select([3, 2, 1, 0])
+            doc[0].insert_text((40, 350), "edited", color=(1, 0, 0))
+            doc.save(edited_path, garbage=4)
+            doc.close()
+            
+            self.converter.set_cache(cache_dir)
+            first = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertFalse(first.from_cache)
+            with open(output_path, "rb") as output_file:
+                converted = output_file.read()
+            
+            cached = self.converter.convert_pdf_to_bw(copy_path, output_path)
+            self.assertTrue(cached.from_cache)
+            self.assertEqual(cached.rendered_pages, first.rendered_pages)
+            self.assertEqual(cached.page_codecs, first.page_codecs)
+            with open(output_path, "rb") as output_file:
+                self.assertEqual(output_file.read(), converted)
+            
+            edited = self.converter.convert_pdf_to_bw(edited_path, output_path)
+            self.assertFalse(edited.from_cache)
+            self.assertEqual(edited.cached_pages, 3)
+            
+            # Другие настройки - другой ключ
+            self.converter.set_image_settings(contrast=1.5)
+            self.assertFalse(self.converter.convert_pdf_to_bw(input_path, output_path).from_cache)
+            self.assertEqual(self.converter.cache.stats()["hits"], 1)
+            
+            # Вытесняются давно не использованные записи
+            cache = ResultCache(cache_dir, max_size=0)
+            cache.evict()
+            self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_conversion_journal_resume(self):
+        """Тест продолжения прерванной конвертации по журналу"""
+        from src.converter import ConversionProgress
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            reference_path = os.path.join(tmp_dir, "reference.pdf")
+            journal_dir = os.path.join(tmp_dir, "journal")
+            make_color_pdf(input_path, pages=6)
+            self.converter.convert_pdf_to_bw(input_path, reference_path)
+            
+            def listener(event):
+                if event.page == 4:
+                    progress.cancel()
+            
+            self.converter.set_journal(journal_dir)
+            progress = ConversionProgress(max_rate=0, listener=listener)
+            self.assertFalse(self.converter.convert_pdf_to_bw(input_path, output_path, progress=progress))
+            self.assertFalse(os.path.exists(output_path))
+            journals = os.listdir(journal_dir)
+            self.assertEqual(len(journals), 1)
+            pages = sorted(os.listdir(os.path.join(journal_dir, journals[0])))
+            self.assertEqual(pages, ["0.page", "1.page", "2.page", "3.page", "journal.json"])
+            
+            # Недописанный результат прерванного процесса заменяется целиком
+            with open(output_path + ".part", "wb") as part_file:
+                part_file.write(b"%PDF-1.7 truncated")
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual((summary.rendered_pages, summary.resumed_pages), (6, 4))
+            self.assertEqual(os.listdir(journal_dir), [])
+            self.assertFalse(os.path.exists(output_path + ".part"))
+            
+            output_doc = fitz.open(output_path)
+            reference_doc = fitz.open(reference_path)
+            self.assertEqual(len(output_doc), 6)
+            for page_num in range(6):
+                self.assertEqual(output_doc[page_num].get_pixmap().samples,
+                                 reference_doc[page_num].get_pixmap().samples)
+            output_doc.close()
+            reference_doc.close()
+            
+            # Журнал с другими настройками не используется
+            progress = ConversionProgress(max_rate=0, listener=listener)
+            self.converter.convert_pdf_to_bw(input_path, output_path, progress=progress)
+            self.converter.set_image_settings(contrast=1.5)
+            self.assertEqual(self.converter.convert_pdf_to_bw(input_path, output_path).resumed_pages, 0)
+            self.assertEqual(len(os.listdir(journal_dir)), 1)
+            
+    def test_page_deduplication(self):
+        """Тест повторного использования изображений повторяющихся страниц"""
+        import io
+        from PIL import ImageChops, ImageDraw
+        from src.converter import Instrumentation
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            reference_path = os.path.join(tmp_dir, "reference.pdf")
+            
+            # Страницы 0, 2 и 4 - один и тот же лист, 5 и 6 - два скана одного бланка с шумом
+            form = Image.new("RGB", (600, 800), (250, 245, 235))
+            ImageDraw.Draw(form).rectangle((40, 40, 560, 200), fill=(30, 60, 160))
+            scans = []
+            for sigma in (5, 6):
+                noise = Image.effect_noise(form.size, sigma).convert("RGB")
+                buffer = io.BytesIO()
+                ImageChops.add(form, noise, 1, -128).save(buffer, "PNG")
+                scans.append(buffer.getvalue())
+            doc = fitz.open()
+            for page_num in range(7):
+                page = doc.new_page(width=300, height=400)
+                if page_num >= 5:
+                    page.insert_image(page.rect, stream=scans[page_num - 5])
+                    continue
+                page.draw_rect(fitz.Rect(20, 20, 280, 200), color=(1, 0, 0), fill=(0, 0.5, 1))
+                text = "Cover sheet" if page_num % 2 == 0 else f"Page {page_num + 1}"
+                page.insert_text((40, 300), text, fontsize=24, color=(0, 0.6, 0))
+            doc.save(input_path)
+            doc.close()
+            
+            reference = PDFToBWConverter()
+            reference.set_deduplication(False)
+            reference.convert_pdf_to_bw(input_path, reference_path)
+            reference_doc = fitz.open(reference_path)
+            
+            for workers in (1, 2):
+                instrumentation = Instrumentation()
+                self.converter.set_instrumentation(instrumentation)
+                self.converter.set_workers(workers)
+                # Ограничение памяти в 1 КБ: изображения берутся и из уже записанной части
+                self.converter.set_memory_limit(1 / 1024)
+                summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+                self.assertEqual(summary.duplicate_pages, 2)
+                self.assertEqual(summary.dedup_bytes, 2 * summary.page_codecs[0][1])
+                self.assertAlmostEqual(summary.dedup_ratio(), summary.dedup_bytes / sum(
+                    size for _, size in summary.page_codecs.values()))
+                if workers == 1:
+                    self.assertEqual(instrumentation.counters["encodes_skipped"], 2)
+                
+                output_doc = fitz.open(output_path)
+                self.assertEqual(len({image[0] for page in output_doc for image in page.get_images()}), 5)
+                for page_num in range(7):
+                    self.assertEqual(output_doc[page_num].get_pixmap().samples,
+                                     reference_doc[page_num].get_pixmap().samples)
+                output_doc.close()
+            reference_doc.close()
+            
+            # С допуском второй скан бланка берет изображение первого
+            self.converter.set_workers(1)
+            self.converter.set_deduplication(tolerance=16)
+            summary = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual(summary.duplicate_pages, 3)
+            output_doc = fitz.open(output_path)
+            self.assertEqual(output_doc[5].get_images()[0][0], output_doc[6].get_images()[0][0])
+            self.assertNotEqual(output_doc[1].get_images()[0][0], output_doc[3].get_images()[0][0])
+            output_doc.close()
+    
+    def test_page_override_validation(self):
+        """Тест проверки и ограничения значений в настройках диапазонов страниц"""
+        for settings in ({"output_size": "Invalid"}, {"output_format": "bogus"}, {"binarization": "none"},
+                         {"contrast": "high"}, {"dpi": None}):
+            self.assertFalse(self.converter.set_page_overrides([(0, 0, settings)]), settings)
+        self.assertEqual(self.converter.page_overrides, [])
+        
+        self.assertTrue(self.converter.set_page_overrides([
+            (0, 0, {"dpi": 0, "gamma": 0, "quality": 500}),
+            (1, 1, {"contrast": 50, "black_point": 300}),
+        ]))
+        self.assertEqual(self.converter.page_override(0), {"dpi": 18, "gamma": 0.1, "quality": 100})
+        self.assertEqual(self.converter.page_override(1), {"contrast": 3.0, "black_point": 254})
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            make_color_pdf(input_path, pages=2)
+            summary = self.converter.convert_pdf_to_bw(input_path, os.path.join(tmp_dir, "output.pdf"))
+            self.assertEqual(summary.rendered_pages, 2)
+    
+    def test_incremental_reconversion(self):
+        """Тест инкрементальной конвертации с настройками для диапазона страниц"""
+        from src.converter import manifest_path_for
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            reference_path = os.path.join(tmp_dir, "reference.pdf")
+            make_color_pdf(input_path, pages=5)
+            
+            self.converter.set_incremental()
+            first = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual((first.rendered_pages, first.reused_pages), (5, 0))
+            self.assertTrue(os.path.exists(manifest_path_for(output_path)))
+            
+            output_doc = fitz.open(output_path)
+            original_page = output_doc[1].get_pixmap().samples
+            output_doc.close()
+            
+            unchanged = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual((unchanged.rendered_pages, unchanged.reused_pages), (0, 5))
+            self.assertEqual(unchanged.page_codecs, first.page_codecs)
+            
+            self.assertFalse(self.converter.set_page_overrides([(1, 2, {"engine": "vector"})]))
+            self.assertTrue(self.converter.set_page_overrides([(1, 2, {"contrast": 1.8})]))
+            updated = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual((updated.rendered_pages, updated.reused_pages), (2, 3))
+            
+            # Результат совпадает с полной конвертацией с теми же настройками
+            converter = PDFToBWConverter()
+            converter.set_page_overrides([(1, 2, {"contrast": 1.8})])
+            converter.convert_pdf_to_bw(input_path, reference_path)
+            output_doc = fitz.open(output_path)
+            reference_doc = fitz.open(reference_path)
+            self.assertEqual(len(output_doc), 5)
+            for page_num in range(5):
+                self.assertEqual(output_doc[page_num].get_pixmap().samples,
+                                 reference_doc[page_num].get_pixmap().samples)
+            self.assertNotEqual(output_doc[1].get_pixmap().samples, original_page)
+            output_doc.close()
+            reference_doc.close()
+            
+            # Результат, измененный после конвертации, не используется
+            with open(output_path, "ab") as output_file:
+                output_file.write(b"\n")
+            rebuilt = self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual((rebuilt.rendered_pages, rebuilt.reused_pages), (5, 0))
+    
+    def test_instrumentation(self):
+        """Тест замеров этапов, счетчиков и экспорта в JSON lines и Prometheus"""
+        import json
+        from src.converter import Instrumentation, JsonLinesExporter, prometheus_text
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.pdf")
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            make_color_pdf(input_path, pages=3)
+            
+            for workers in (1, 2):
+                lines = io.StringIO()
+                exporter = JsonLinesExporter(lines, input="input.pdf")
+                instrumentation = Instrumentation(listener=exporter)
+                self.converter.set_workers(workers)
+                self.converter.set_instrumentation(instrumentation)
+                self.assertTrue(self.converter.convert_pdf_to_bw(input_path, output_path))
+                exporter.finish(instrumentation)
+                
+                # Этапы страниц отмечаются и при рендеринге в других процессах
+                for stage in ("render", "decode", "enhance", "encode", "insert"):
+                    self.assertEqual(sorted(span["page"] for span in instrumentation.spans
+                                            if span["stage"] == stage), [0, 1, 2], stage)
+                for stage in ("open", "grayscale_check", "save", "convert"):
+                    self.assertEqual(instrumentation.stages[stage]["count"], 1)
+                self.assertGreater(instrumentation.stages["render"]["seconds"], 0)
+                counters = instrumentation.counters
+                self.assertEqual((counters["pages_rasterized"], counters["pages_copied"]), (3, 0))
+                self.assertEqual(counters["bytes_out"], os.path.getsize(output_path))
+                self.assertGreater(counters["pixels_processed"], 3 * 300 * 400)
+                
+                records = [json.loads(line) for line in lines.getvalue().splitlines()]
+                self.assertEqual(len(records), len(instrumentation.spans) + 1)
+                self.assertEqual(records[0]["input"], "input.pdf")
+                self.assertEqual(records[-1]["type"], "summary")
+                self.assertEqual(records[-1]["counters"], counters)
+            
+            text = prometheus_text(instrumentation, labels={"host": 'a"b'})
+            self.assertIn('pdf_bw_stage_spans_total{host="a\\"b",stage="render"} 3\n', text)
+            self.assertIn('pdf_bw_pages_rasterized_total{host="a\\"b"} 3\n', text)
+            
+            # Ошибки учитываются, выключенные замеры не накапливаются
+            self.assertFalse(self.converter.convert_pdf_to_bw(os.path.join(tmp_dir, "missing.pdf"), output_path))
+            self.assertEqual(instrumentation.counters["conversions_failed"], 1)
+            self.converter.set_instrumentation(None)
+            self.converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual(instrumentation.counters["conversions"], 1)
+    
+    def test_tiled_rendering(self):
+        """Тест рендеринга больших страниц полосами"""
+        import io
+        from src.converter import Instrumentation, image_codec, psnr, unpack_tiles
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, "poster.pdf")
+            doc = fitz.open()
+            for rotation in (0, 90):
+                page = doc.new_page(width=400, height=1200)
+                page.draw_rect(fitz.Rect(20, 20, 380, 600), color=(1, 0, 0), fill=(0, 0.5, 1))
+                for line in range(20):
+                    page.insert_text((40, 640 + line * 26), f"Line {line + 1}", fontsize=18, color=(0, 0.6, 0))
+                page.set_rotation(rotation)
+            doc.save(input_path)
+            doc.close()
+            
+            doc = fitz.open(input_path)
+            for output_format in ("jpeg", "bilevel"):
+                converter = PDFToBWConverter()
+                converter.set_image_settings(contrast=1.3, sharpness=1.5, quality=95)
+                converter.set_output_format(output_format, "adaptive")
+                for page in doc:
+                    width, height, whole, _ = converter._render_page(page)
+                    converter.set_tiling(1)
+                    instrumentation = Instrumentation()
+                    converter.set_instrumentation(instrumentation)
+                    tiled_width, tiled_height, tiled, _ = converter._render_page(page)
+                    converter.set_tiling(None)
+                    converter.set_instrumentation(None)
+                    
+                    self.assertEqual((tiled_width, tiled_height), (width, height))
+                    self.assertEqual(image_codec(tiled), image_codec(whole))
+                    rows, tiles = unpack_tiles(tiled)
+                    self.assertGreater(len(tiles), 2)
+                    self.assertEqual(instrumentation.counters["tiles"], len(tiles))
+                    
+                    # Полосы совпадают с соответствующими строками целой страницы
+                    whole_image = Image.open(io.BytesIO(whole)).convert("L")
+                    self.assertEqual(whole_image.height, rows)
+                    for top, tile_rows, data in tiles:
+                        tile = Image.open(io.BytesIO(data)).convert("L")
+                        self.assertEqual(tile.size, (whole_image.width, tile_rows))
+                        reference = whole_image.crop((0, top, whole_image.width, top + tile_rows))
+                        self.assertGreater(psnr(reference, tile), 35)
+            doc.close()
+            
+            output_path = os.path.join(tmp_dir, "output.pdf")
+            converter = PDFToBWConverter()
+            converter.set_tiling(1)
+            summary = converter.convert_pdf_to_bw(input_path, output_path)
+            self.assertEqual(summary.rendered_pages, 2)
+            output_doc = fitz.open(output_path)
+            self.assertEqual([page.rect for page in output_doc], [fitz.Rect(0, 0, 400, 1200), fitz.Rect(0, 0, 1200, 400)])
+            self.assertGreater(len(output_doc[0].get_images()), 2)
+            output_doc.close()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+Тесты для сервиса конвертации
+"""
+
+import unittest
+import asyncio
+import concurrent.futures
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import fitz
+from src import service
+from tests.test_converter import make_color_pdf
+
+
+class TestService(unittest.TestCase):
+    """Тесты для HTTP API, очереди и пула процессов"""
+    
+    def start_service(self, **options):
+        """Запускает сервис в отдельном потоке и возвращает базовый URL"""
+        self.service = service.ConversionService(**options)
+        started = threading.Event()
+        address = []
+        
+        def ready(server_address):
+            address.extend(server_address)
+            started.set()
+        
+        self.thread = threading.Thread(
+            target=asyncio.run, args=(service.serve(self.service, port=0, ready=ready),), daemon=True,
+        )
+        self.thread.start()
+        self.assertTrue(started.wait(30))
+        self.addCleanup(self.stop_service)
+        return f"http://{address[0]}:{address[1]}"
+    
+    def stop_service(self):
+        """Останавливает сервис и ждет завершения процессов"""
+        self.service.shutdown()
+        self.thread.join(30)
+        self.assertFalse(self.thread.is_alive())
+    
+    def request(self, method, url, data=None):
+        """Выполняет запрос и возвращает код ответа и тело"""
+        request = urllib.request.Request(url, data=data, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+    
+    def submit(self, base_url, data, query=""):
+        """Отправляет задание и возвращает его состояние"""
+        status, body = self.request("POST", f"{base_url}/jobs?{query}", data)
+        self.assertEqual(status, 202, body)
+        return json.loads(body)
+    
+    def wait(self, base_url, job_id, timeout=60):
+        """Ждет завершения задания и возвращает его состояние"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = json.loads(self.request("GET", f"{base_url}/jobs/{job_id}")[1])
+            if job["status"] in service.FINISHED:
+                return job
+            time.sleep(0.05)
+        self.fail(f"задание {job_id} не завершилось")
+    
+    def pdf_bytes(self, pages):
+        """Цветной PDF с заданным числом страниц"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "input.pdf")
+            make_color_pdf(path, pages=pages)
+            with open(path, "rb") as pdf_file:
+                return pdf_file.read()
+    
+    def test_parse_job_settings(self):
+        """Тест разбора параметров задания"""
+        settings, client, priority = service.parse_job_settings(
+            "size=A4&contrast=1.2&preserve_orientation=false&priority=3&client=scan1"
+        )
+        self.assertEqual(settings, {"size": "A4", "contrast": 1.2, "preserve_orientation": False})
+        self.assertEqual((client, priority), ("scan1", 3))
+        for query in ("size=B99", "contrast=high", "dpi=300"):
+            with self.assertRaises(ValueError):
+                service.parse_job_settings(query)
+    
+    def test_job_lifecycle(self):
+        """Тест отправки задания, получения результата и удаления"""
+        base_url = self.start_service(workers=1)
+        job = self.submit(base_url, self.pdf_bytes(3), "size=A4&contrast=1.2&client=test")
+        self.assertEqual(job["settings"], {"size": "A4", "contrast": 1.2})
+        
+        job = self.wait(base_url, job["id"])
+        self.assertEqual(job["status"], "done", job)
+        self.assertEqual(job["progress"], 100.0)
+        self.assertEqual(job["report"]["pages"], 3)
+        
+        status, body = self.request("GET", f"{base_url}/jobs/{job['id']}/result")
+        self.assertEqual(status, 200)
+        with fitz.open(stream=body, filetype="pdf") as doc:
+            self.assertEqual(len(doc), 3)
+            self.assertEqual((doc[0].rect.width, doc[0].rect.height), (595, 842))
+        
+        self.assertIn("render", job["report"]["stages"])
+        status, body = self.request("GET", f"{base_url}/metrics")
+        self.assertEqual(status, 200)
+        self.assertIn("pdf_bw_pages_rasterized_total 3\n", body.decode("utf-8"))
+        self.assertIn("pdf_bw_jobs_done_total 1\n", body.decode("utf-8"))
+        
+        self.assertEqual(self.request("DELETE", f"{base_url}/jobs/{job['id']}")[0], 200)
+        self.assertEqual(self.request("GET", f"{base_url}/jobs/{job['id']}")[0], 404)
+        self.assertFalse(os.listdir(self.service.work_dir))
+    
+    def test_request_errors(self):
+        """Тест ответов на неверные запросы"""
+        base_url = self.start_service(workers=1)
+        self.assertEqual(self.request("POST", f"{base_url}/jobs?size=B99", self.pdf_bytes(1))[0], 400)
+        self.assertEqual(self.request("POST", f"{base_url}/jobs", b"not a pdf")[0], 400)
+        self.assertEqual(self.request("GET", f"{base_url}/jobs/unknown")[0], 404)
+        self.assertEqual(self.request("PUT", f"{base_url}/jobs", b"")[0], 405)
+        
+        job = self.submit(base_url, self.pdf_bytes(60))
+        status, _ = self.request("GET", f"{base_url}/jobs/{job['id']}/result")
+        self.assertEqual(status, 409)
+        self.wait(base_url, job["id"])
+        
+        status, body = self.request("GET", f"{base_url}/health")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["workers"], 1)
+    
+    def test_cancel_and_priority(self):
+        """Тест отмены выполняющегося задания и порядка по приоритету"""
+        base_url = self.start_service(workers=1)
+        long_job = self.submit(base_url, self.pdf_bytes(400))
+        small = self.pdf_bytes(1)
+        low = self.submit(base_url, small, "priority=1")
+        high = self.submit(base_url, small, "priority=5")
+        self.assertEqual((low["status"], high["status"]), ("queued", "queued"))
+        
+        self.request("DELETE", f"{base_url}/jobs/{long_job['id']}")
+        long_job = self.wait(base_url, long_job["id"])
+        self.assertEqual(long_job["status"], "cancelled")
+        self.assertEqual(self.request("GET", f"{base_url}/jobs/{long_job['id']}/result")[0], 409)
+        
+        low = self.wait(base_url, low["id"])
+        high = self.wait(base_url, high["id"])
+        self.assertEqual((low["status"], high["status"]), ("done", "done"))
+        self.assertLessEqual(high["finished"], low["started"])
+    
+    def test_cancel_before_start(self):
+        """Тест отмены задания, отправленного процессу, но еще не принятого им"""
+        base_url = self.start_service(workers=1)
+        data = self.pdf_bytes(60)
+        result = concurrent.futures.Future()
+        
+        def submit_and_cancel():
+            # Отмена в том же шаге цикла событий, что и отправка задания процессу
+            job = self.service.submit(data)
+            result.set_result(self.service.cancel(job.id).id)
+        
+        self.service.loop.call_soon_threadsafe(submit_and_cancel)
+        job = self.wait(base_url, result.result(30))
+        self.assertEqual(job["status"], "cancelled", job)
+    
+    def test_internal_errors(self):
+        """Тест ответа 500 и замены процесса, завершившегося до получения задания"""
+        base_url = self.start_service(workers=1)
+        
+        def broken_health():
+            raise RuntimeError("сбой")
+        
+        self.service.health = broken_health
+        status, body = self.request("GET", f"{base_url}/health")
+        self.assertEqual(status, 500)
+        self.assertIn("сбой", json.loads(body)["error"])
+        del self.service.health
+        
+        data = self.pdf_bytes(1)
+        result = concurrent.futures.Future()
+        
+        def kill_and_submit():
+            # Поток чтения еще не успел сообщить о завершении процесса
+            worker = self.service.workers[0]
+            worker.process.kill()
+            worker.process.join()
+            result.set_result(self.service.submit(data).id)
+        
+        self.service.loop.call_soon_threadsafe(kill_and_submit)
+        job = self.wait(base_url, result.result(30))
+        self.assertEqual(job["status"], "error", job)
+        self.assertIn("недоступен", job["error"])
+        
+        job = self.wait(base_url, self.submit(base_url, data)["id"])
+        self.assertEqual(job["status"], "done", job)
+        self.assertEqual(json.loads(self.request("GET", f"{base_url}/health")[1])["workers"], 1)
+    
+    def test_per_client_limit(self):
+        """Тест ограничения одновременных заданий одного клиента"""
+        base_url = self.start_service(workers=2, per_client=1)
+        data = self.pdf_bytes(20)
+        first = self.submit(base_url, data, "client=x")
+        second = self.submit(base_url, data, "client=x")
+        other = self.submit(base_url, data, "client=y")
+        self.assertEqual([first["status"], second["status"], other["status"]], ["running", "queued", "running"])
+        
+        first = self.wait(base_url, first["id"])
+        second = self.wait(base_url, second["id"])
+        self.assertEqual(self.wait(base_url, other["id"])["status"], "done")
+        self.assertGreaterEqual(second["started"], first["finished"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+"""
+Тесты времени запуска: бюджет времени импорта и отложенная загрузка зависимостей
+"""
+
+import unittest
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Бюджет суммарного времени импорта src.cli с прогретым кэшем байт-кода, мс.
+# Сейчас около 20 мс; импорт PyMuPDF и Pillow при загрузке модуля его превысит.
+IMPORT_BUDGET_MS = 60
+
+HEAVY_MODULES = ["fitz", "pymupdf", "PIL.Image", "tkinter", "multiprocessing"]
+
+
+def run_python(code, pycache_dir, *options):
+    """Выполняет код в новом процессе интерпретатора с кэшем байт-кода в pycache_dir"""
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return subprocess.run(
+        [sys.executable, *options, "-X", f"pycache_prefix={pycache_dir}", "-c", code],
+        cwd=REPO_DIR, env=env, check=True, capture_output=True, text=True,
+    )
+
+
+class TestStartup(unittest.TestCase):
+    """Тесты времени импорта модулей конвертера"""
+    
+    def setUp(self):
+        """Настройка перед каждым тестом"""
+        self.pycache_dir = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        """Удаление кэша байт-кода"""
+        shutil.rmtree(self.pycache_dir)
+    
+    def test_heavy_modules_are_loaded_lazily(self):
+        """Тест, что импорт конвертера и CLI не загружает тяжелые зависимости"""
+        code = f"import sys, src.cli; print([name for name in {HEAVY_MODULES!r} if name in sys.modules])"
+        result = run_python(code, self.pycache_dir)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "[]")
+    
+    def test_import_time_budget(self):
+        """Тест бюджета времени импорта по -X importtime"""
+        run_python("import src.cli", self.pycache_dir)
+        timings = []
+        for _ in range(3):
+            result = run_python("import src.cli", self.pycache_dir, "-X", "importtime")
+            line = [line for line in result.stderr.splitlines() if line.rstrip().endswith("| src.cli")][-1]
+            timings.append(int(line.split("|")[1]) / 1000)
+        self.assertLess(min(timings), IMPORT_BUDGET_MS)
+
+if __name__ == "__main__":
+    unittest.main()